@@ -0,0 +1,402 @@
+import os
+import re
+import time
+import threading
+import contextvars
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from database import get_database, quote_identifier, schema_catalog
+from db import WorkspaceLocal
+from llm_cache import fingerprint, tables_in_sql
+from schema_catalog import INTERNAL_PREFIXES
+from query_plan import sql_tokens
+from query_guard import QueryTooExpensive, query_governor
+from metrics import metrics
+
+# Runs of one aggregate shape, averaging at least this long, before it is materialized
+AGG_CACHE_MIN_RUNS = int(os.getenv('AGG_CACHE_MIN_RUNS', 3))
+AGG_CACHE_MIN_MS = float(os.getenv('AGG_CACHE_MIN_MS', 20))
+# Summary tables kept (least recently used are dropped) and their row cap
+AGG_CACHE_MAX_TABLES = int(os.getenv('AGG_CACHE_MAX_TABLES', 20))
+AGG_CACHE_MAX_ROWS = int(os.getenv('AGG_CACHE_MAX_ROWS', 100000))
+# Distinct query shapes whose run counts are tracked
+SHAPE_HISTORY = 500
+MV_PREFIX = INTERNAL_PREFIXES[0]
+
+AGGREGATE_FUNCTIONS = {'SUM', 'COUNT', 'AVG', 'MIN', 'MAX', 'TOTAL', 'GROUP_CONCAT'}
+# Results that depend on when or how often the query runs cannot be reused
+VOLATILE_WORDS = {'RANDOM', 'RANDOMBLOB', 'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP',
+                  'CHANGES', 'TOTAL_CHANGES', 'LAST_INSERT_ROWID'}
+LIMIT_CLAUSE = re.compile(r'^\d+(?:\s*(?:,|OFFSET)\s*\d+)?$', re.IGNORECASE)
+ORDER_SUFFIX = re.compile(r'^(?:ASC|DESC)?(?:\s+NULLS\s+(?:FIRST|LAST))?$', re.IGNORECASE)
+
+def _normalize(tokens):
+    # Keywords and bare identifiers are case-insensitive; literals are not
+    return " ".join(text if text[0] in "'\"`[" else text.upper() for text, _, _ in tokens)
+
+def parse_aggregate(sql_query):
+    """Split an aggregate query into its shape and its ORDER BY / LIMIT tail.
+
+    Returns {'key', 'core', 'order', 'limit'} or None when the query is not
+    a deterministic aggregate. The core is the query without its top-level
+    ORDER BY and LIMIT, so top-10 and top-5 variants share one shape.
+    """
+    sql_query = sql_query.strip().rstrip(';').strip()
+    tokens = list(sql_tokens(sql_query))
+    if not tokens or tokens[0][0].upper() not in ('SELECT', 'WITH'):
+        return None
+    words = {text.upper() for text, _, _ in tokens}
+    if words & VOLATILE_WORDS or "'now'" in (text.lower() for text, _, _ in tokens):
+        return None
+
+    order_at = limit_at = None
+    grouped = False
+    for i, (text, start, depth) in enumerate(tokens):
+        if depth:
+            continue
+        word = text.upper()
+        following = tokens[i + 1][0] if i + 1 < len(tokens) else ''
+        if word == 'GROUP' and following.upper() == 'BY':
+            grouped = True
+        elif word in AGGREGATE_FUNCTIONS and following == '(':
+            grouped = True
+        elif word == 'ORDER' and following.upper() == 'BY':
+            order_at, limit_at = i, None
+        elif word == 'LIMIT':
+            limit_at = i
+    if not grouped:
+        return None
+
+    core_end = min(index for index in (order_at, limit_at, len(tokens)) if index is not None)
+    if core_end == 0:
+        return None
+    order_end = limit_at if limit_at is not None else len(tokens)
+    order = tokens[order_at + 2:order_end] if order_at is not None else []
+    limit = sql_query[tokens[limit_at][1] + len('LIMIT'):].strip() if limit_at is not None else ''
+    core = sql_query[:tokens[core_end][1]].strip() if core_end < len(tokens) else sql_query
+    return {'key': _normalize(tokens[:core_end]), 'core': core, 'order': order, 'limit': limit}
+
+def _order_terms(order, columns):
+    """ORDER BY terms rewritten against the summary table's columns, or None.
+
+    Only terms naming an output column or its position can be answered
+    from the summary; expressions over the source tables cannot.
+    """
+    terms, current = [], []
+    for token in order + [(',', None, 0)]:
+        if token[0] == ',' and token[2] == 0:
+            terms.append(current)
+            current = []
+        else:
+            current.append(token)
+    by_name = {column.lower(): column for column in columns}
+    rewritten = []
+    for term in terms:
+        if not term:
+            return None
+        text = term[0][0]
+        suffix = " ".join(token[0] for token in term[1:])
+        if not ORDER_SUFFIX.match(suffix):
+            return None
+        if text.isdigit() and 1 <= int(text) <= len(columns):
+            column = columns[int(text) - 1]
+        else:
+            name = text[1:-1] if text[0] in '"`[' else text
+            column = by_name.get(name.lower())
+            if column is None:
+                return None
+        rewritten.append(f"{quote_identifier(column)} {suffix}".strip())
+    return rewritten
+
+
+class AggregateCache:
+    """Summary tables for hot aggregate queries.
+
+    Every generated aggregate query is reduced to its shape (the query
+    without its ORDER BY / LIMIT). A shape that ran AGG_CACHE_MIN_RUNS times,
+    averaging at least AGG_CACHE_MIN_MS, is materialized in the background
+    into an agg_mv_* table. Later queries of that shape read the summary
+    instead, with their own ORDER BY / LIMIT applied to it. A summary is only
+    used while the catalog versions of its input tables are those it was
+    built from; writes to an input queue a rebuild. Builds run under the
+    query governor's budgets; a shape whose build exceeds them is dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shapes = OrderedDict()
+        self._tables = {}
+        self._pending = set()
+        self._lookups = Counter()
+        self._saved_ms = 0.0
+        self._build_failures = Counter()
+        self._cleaned = False
+        # One background builder: summaries are built one after another
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='aggregate-builder')
+
+    def execute(self, engine, sql_query):
+        """Run generated SQL on the engine, through a summary table when one matches"""
+        shape = parse_aggregate(sql_query) if engine.name == 'sqlite' else None
+        if shape is None:
+            return engine.execute(sql_query)
+        if not self._cleaned:
+            self._cleaned = True
+            self._submit(self._drop_orphans)
+
+        entry, rewritten = self._lookup(shape)
+        if rewritten is not None:
+            start = time.perf_counter()
+            try:
+                result = engine.execute(rewritten)
+            except Exception as e:
+                print(f"Aggregate cache: reading {entry['table']} failed, running the query: {str(e)}")
+            else:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                saved_ms = max(entry['source_ms'] - elapsed_ms, 0.0)
+                with self._lock:
+                    self._lookups['hit'] += 1
+                    self._saved_ms += saved_ms
+                    entry['hits'] += 1
+                    entry['saved_ms'] += saved_ms
+                    entry['last_used'] = time.time()
+                result.cost = dict(result.cost or {}, materialized=entry['table'], saved_ms=round(saved_ms, 1))
+                return result
+
+        start = time.perf_counter()
+        result = engine.execute(sql_query)
+        self._observe(shape, (time.perf_counter() - start) * 1000)
+        return result
+
+    def _lookup(self, shape):
+        """(entry, rewritten SQL) for a fresh matching summary, else (entry or None, None)"""
+        with self._lock:
+            entry = self._tables.get(shape['key'])
+        if entry is None:
+            with self._lock:
+                self._lookups['miss'] += 1
+            return None, None
+        versions = schema_catalog.table_versions()
+        if any(versions.get(name) != version for name, version in entry['versions'].items()):
+            with self._lock:
+                self._lookups['stale'] += 1
+            self._schedule(shape['key'])
+            return entry, None
+        order = _order_terms(shape['order'], entry['columns'])
+        if order is None or (shape['limit'] and not LIMIT_CLAUSE.match(shape['limit'])):
+            with self._lock:
+                self._lookups['miss'] += 1
+            return entry, None
+        # Without an ORDER BY, rows come back in the order the query produced them
+        rewritten = (f"SELECT * FROM {quote_identifier(entry['table'])} "
+                     f"ORDER BY {', '.join(order) if order else 'rowid'}")
+        if shape['limit']:
+            rewritten += f" LIMIT {shape['limit']}"
+        return entry, rewritten
+
+    def _observe(self, shape, elapsed_ms):
+        key = shape['key']
+        with self._lock:
+            stats = self._shapes.pop(key, None) or {
+                'core': shape['core'], 'runs': 0, 'total_ms': 0.0, 'unusable': None}
+            self._shapes[key] = stats
+            while len(self._shapes) > SHAPE_HISTORY:
+                self._shapes.popitem(last=False)
+            stats['runs'] += 1
+            stats['total_ms'] += elapsed_ms
+            hot = (stats['unusable'] is None and key not in self._tables
+                   and stats['runs'] >= AGG_CACHE_MIN_RUNS
+                   and stats['total_ms'] / stats['runs'] >= AGG_CACHE_MIN_MS)
+        if hot:
+            self._schedule(key)
+
+    def _schedule(self, key):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        if not self._submit(self._build, key):
+            with self._lock:
+                self._pending.discard(key)
+
+    def _submit(self, func, *args):
+        """Queue func on the builder in the current context; False once the cache is closed"""
+        try:
+            self._builder.submit(contextvars.copy_context().run, func, *args)
+            return True
+        except RuntimeError:
+            # close() shut the builder down while a request still held this cache
+            return False
+
+    def close(self):
+        """Stop the builder thread; queued builds are dropped, a running one finishes"""
+        self._builder.shutdown(wait=False, cancel_futures=True)
+
+    def _build(self, key):
+        """Materialize (or refresh) the summary table of one shape"""
+        try:
+            with self._lock:
+                self._pending.discard(key)
+                entry = self._tables.get(key)
+                stats = self._shapes.get(key)
+                if entry is None and stats is None:
+                    return
+                core = entry['core'] if entry else stats['core']
+                source_ms = entry['source_ms'] if entry else stats['total_ms'] / stats['runs']
+            table_name = MV_PREFIX + fingerprint(key)[:16]
+            # Versions are read first: a write during the build leaves the summary stale
+            versions = schema_catalog.table_versions()
+            if entry and all(versions.get(name) == version for name, version in entry['versions'].items()):
+                return
+            inputs = tables_in_sql(core, list(versions))
+            start = time.perf_counter()
+            with get_database().reader() as conn, query_governor.sqlite_limits(conn, core) as cost:
+                cursor = conn.execute(core)
+                columns = [column[0] for column in cursor.description]
+                rows = cursor.fetchmany(AGG_CACHE_MAX_ROWS + 1)
+                cost['rows'] = len(rows)
+            problem = None
+            if len(rows) > AGG_CACHE_MAX_ROWS:
+                problem = f"more than {AGG_CACHE_MAX_ROWS} rows"
+            elif len({column.lower() for column in columns}) < len(columns):
+                problem = "duplicate output column names"
+            elif not inputs:
+                problem = "no uploaded tables"
+            if problem:
+                print(f"Aggregate cache: not materializing a query with {problem}")
+                self._discard(key, problem)
+                return
+
+            table = quote_identifier(table_name)
+            with get_database().writer() as conn:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+                # Untyped columns store the values exactly as the query returned them
+                conn.execute(f"CREATE TABLE {table} ({', '.join(quote_identifier(c) for c in columns)})")
+                conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' for _ in columns)})", rows)
+            build_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                previous = self._tables.get(key, {})
+                self._tables[key] = {
+                    'table': table_name,
+                    'core': core,
+                    'columns': columns,
+                    'versions': {name: versions[name] for name in inputs},
+                    'rows': len(rows),
+                    'source_ms': source_ms,
+                    'build_ms': round(build_ms, 1),
+                    'built_at': time.time(),
+                    'hits': previous.get('hits', 0),
+                    'saved_ms': previous.get('saved_ms', 0.0),
+                    'last_used': previous.get('last_used', time.time())
+                }
+            print(f"Aggregate cache: {'refreshed' if previous else 'materialized'} {table_name} "
+                  f"({len(rows)} rows from {', '.join(inputs)}) in {build_ms:.1f} ms")
+            self._evict()
+        except QueryTooExpensive as e:
+            print(f"Aggregate cache: not materializing a query over its budget: {str(e)}")
+            with self._lock:
+                self._build_failures[e.reason] += 1
+            self._discard(key, f"over budget ({e.reason})")
+        except Exception as e:
+            print(f"Aggregate cache: could not materialize query: {str(e)}")
+            self._discard(key, str(e))
+
+    def _discard(self, key, reason):
+        """Stop materializing a shape and drop its summary table"""
+        with self._lock:
+            entry = self._tables.pop(key, None)
+            if key in self._shapes:
+                self._shapes[key]['unusable'] = reason
+        if entry is not None:
+            self._drop(entry['table'])
+
+    def _evict(self):
+        with self._lock:
+            excess = sorted(self._tables.items(), key=lambda item: item[1]['last_used'])
+            excess = excess[:max(len(self._tables) - AGG_CACHE_MAX_TABLES, 0)]
+            for key, _ in excess:
+                del self._tables[key]
+        for _, entry in excess:
+            self._drop(entry['table'])
+
+    def _drop(self, table_name):
+        with get_database().writer() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+
+    def _drop_orphans(self):
+        """Drop summary tables left over from an earlier run"""
+        try:
+            with get_database().reader() as conn:
+                names = [name for (name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ?",
+                    (len(MV_PREFIX), MV_PREFIX))]
+            with self._lock:
+                known = {entry['table'] for entry in self._tables.values()}
+            for name in names:
+                if name not in known:
+                    self._drop(name)
+        except Exception as e:
+            print(f"Aggregate cache: could not drop old summary tables: {str(e)}")
+
+    def on_table_changed(self, table_name, schema_changed=True):
+        """Schema catalog listener: rebuild the summaries that read a changed table"""
+        if table_name.startswith(MV_PREFIX):
+            return
+        with self._lock:
+            keys = [key for key, entry in self._tables.items() if table_name in entry['versions']]
+        for key in keys:
+            self._schedule(key)
+
+    def collect_metrics(self):
+        """Lookup outcomes and time saved for the /metrics endpoint"""
+        with self._lock:
+            lookups = {(result,): count for result, count in self._lookups.items()}
+            failures = {(reason,): count for reason, count in self._build_failures.items()}
+            return [('aggregate_cache_lookups_total', 'counter',
+                     'Aggregate queries by summary table outcome (hit, miss or stale)', lookups, ('result',)),
+                    ('aggregate_cache_saved_seconds_total', 'counter',
+                     'Estimated query time saved by reading summary tables', {(): self._saved_ms / 1000}, ()),
+                    ('aggregate_cache_tables', 'gauge', 'Materialized summary tables',
+                     {(): len(self._tables)}, ()),
+                    ('aggregate_cache_build_failures_total', 'counter',
+                     'Summary table builds stopped by the query governor, by reason', failures, ('reason',))]
+
+    def report(self):
+        """Hit ratio, time saved, the summary tables and the hottest other shapes"""
+        with self._lock:
+            lookups = dict(self._lookups)
+            total = sum(lookups.values())
+            tables = [{
+                'table': entry['table'],
+                'sql': entry['core'],
+                'inputs': sorted(entry['versions']),
+                'rows': entry['rows'],
+                'hits': entry['hits'],
+                'source_ms': round(entry['source_ms'], 1),
+                'saved_ms': round(entry['saved_ms'], 1),
+                'build_ms': entry['build_ms'],
+                'built_at': entry['built_at']
+            } for entry in self._tables.values()]
+            candidates = sorted(
+                ({'sql': stats['core'], 'runs': stats['runs'],
+                  'avg_ms': round(stats['total_ms'] / stats['runs'], 1), 'unusable': stats['unusable']}
+                 for key, stats in self._shapes.items() if key not in self._tables),
+                key=lambda shape: -shape['runs'])[:10]
+            return {
+                'limits': {
+                    'min_runs': AGG_CACHE_MIN_RUNS,
+                    'min_ms': AGG_CACHE_MIN_MS,
+                    'max_tables': AGG_CACHE_MAX_TABLES,
+                    'max_rows': AGG_CACHE_MAX_ROWS
+                },
+                'lookups': lookups,
+                'hit_ratio': round(lookups.get('hit', 0) / total, 4) if total else 0.0,
+                'saved_ms': round(self._saved_ms, 1),
+                'build_failures': dict(self._build_failures),
+                'tables': sorted(tables, key=lambda table: -table['hits']),
+                'candidates': candidates
+            }
+
+
+aggregate_cache = WorkspaceLocal(lambda workspace: AggregateCache(), close=lambda cache: cache.close())
+schema_catalog.add_listener(lambda table_name, changed: aggregate_cache.on_table_changed(table_name, changed))
+metrics.add_collector(lambda: aggregate_cache.collect_metrics())
@@ -1,17 +1,24 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import pandas as pd
-import sqlite3
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
-from database import create_table_from_file, init_database
-from gemini_service import is_valid_query
+from db import DEFAULT_WORKSPACE, clean_workspace, current_workspace, reset_workspace, set_workspace, use_workspace
+from database import UPLOAD_MODES, get_table_metadata, init_database, remove_table, schema_catalog
+from ingest import ingest_csv, ingest_columnar, ingest_excel, parse_key_columns, COLUMNAR_FORMATS, EXCEL_EXTENSIONS
+from query_pipeline import answer_question, stream_answer, llm_cache, run_sync, iterate_sync
+from result_format import dumps, format_frame
+from column_profiles import column_profiles
+from result_store import result_store, MAX_PAGE_SIZE
+from index_advisor import index_advisor
+from aggregate_cache import aggregate_cache
+from query_guard import query_governor
+from metrics import metrics
+from upload_jobs import upload_jobs
+from conversation_store import conversation_history, clean_session_id
 import traceback
 from werkzeug.utils import secure_filename
 
 load_dotenv()
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
 app = Flask(__name__)
 
@@ -20,41 +27,36 @@ CORS(app, resources={
     r"/*": {
         "origins": ["http://localhost:3000"],  # Your frontend URL
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"],
+        "allow_headers": ["Content-Type", "X-Workspace"],
     }
 })
 
-DATABASE = 'data.db'
+def request_workspace():
+    """Workspace named by the X-Workspace header or ?workspace=, or None if the name is invalid"""
+    workspace = request.headers.get('X-Workspace') or request.args.get('workspace')
+    return clean_workspace(workspace) if workspace else DEFAULT_WORKSPACE
 
-def init_db():
-    """Initialize database connection"""
-    try:
-        # Use absolute path to the database file
-        db_path = os.path.join(os.path.dirname(__file__), DATABASE)
-        conn = sqlite3.connect(db_path)
-        return conn
-    except Exception as e:
-        print(f"Database connection error: {str(e)}")
-        raise
+@app.before_request
+def enter_workspace():
+    """Route the request's tables, schema and history to its workspace"""
+    workspace = request_workspace()
+    if workspace is None:
+        return jsonify({
+            'error': 'Invalid workspace',
+            'suggestion': 'Use up to 64 letters, digits, "-" or "_"'
+        }), 400
+    g.workspace_token = set_workspace(workspace)
+
+@app.teardown_request
+def leave_workspace(exc):
+    token = g.pop('workspace_token', None)
+    if token is not None:
+        reset_workspace(token)
 
 def get_table_schema():
     """Get detailed schema information for all tables"""
-    schema = {}
     try:
-        with init_db() as conn:
-            cursor = conn.cursor()
-            # Get all tables
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-            
-            for (table_name,) in tables:
-                cursor.execute(f"PRAGMA table_info({table_name});")
-                columns = cursor.fetchall()
-                schema[table_name] = {
-                    'columns': [col[1] for col in columns],
-                    'types': [col[2] for col in columns]
-                }
-        return schema
+        return schema_catalog.get_schema()
     except Exception as e:
         print(f"Error getting schema: {str(e)}")
         return {}
@@ -66,6 +68,61 @@ def health_check():
         "app": "DataChat AI"
     }), 200
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(llm_cache.get_stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage latencies, token counts and cache hit rates in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/indexes', methods=['GET'])
+def indexes():
+    """Indexes on the uploaded tables and what the index advisor did"""
+    try:
+        return jsonify(index_advisor.report()), 200
+    except Exception as e:
+        print(f"Error reading index report: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/aggregates', methods=['GET'])
+def aggregates():
+    """Summary tables kept for hot aggregate queries, hit ratio and time saved"""
+    try:
+        return jsonify(aggregate_cache.report()), 200
+    except Exception as e:
+        print(f"Error reading aggregate cache report: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def upload_options():
+    """Write mode and declared upsert key of an upload (form fields or query args)"""
+    mode = request.values.get('mode', 'replace').lower()
+    if mode not in UPLOAD_MODES:
+        raise ValueError(f"Unknown upload mode '{mode}'; use one of: {', '.join(UPLOAD_MODES)}")
+    return mode, parse_key_columns(request.values.get('key'))
+
+@app.route('/tables', methods=['GET'])
+def tables():
+    """Row count, version and upsert key of every uploaded table"""
+    try:
+        return jsonify(get_table_metadata()), 200
+    except Exception as e:
+        print(f"Error reading table metadata: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/tables/<table_name>/profile', methods=['GET'])
+def table_profile(table_name):
+    """Column profiles computed when the table was last written"""
+    try:
+        profile = column_profiles.get(table_name)
+        if profile is None:
+            return jsonify({'error': f'No profile for table {table_name}'}), 404
+        return jsonify(profile), 200
+    except Exception as e:
+        print(f"Error reading table profile: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/upload/csv', methods=['POST'])
 def upload_csv():
     try:
@@ -76,35 +133,164 @@ def upload_csv():
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
         
+        try:
+            mode, key_columns = upload_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         if file:
             filename = secure_filename(file.filename)
-            print(f"Received file: {filename}")
-            
-            # Create DataFrame from CSV
-            df = pd.read_csv(file)
+            print(f"Received file: {filename} ({mode})")
             
-            # Get table name from filename (without extension)
-            table_name = os.path.splitext(filename)[0]
+            # Get table name from filename (without extension) unless one is given
+            table_name = request.values.get('table') or os.path.splitext(filename)[0]
             
-            # Create table in database
-            create_table_from_file(df, table_name)
+            # Stream the CSV into the database in bounded chunks
+            stats = ingest_csv(file, table_name, mode=mode, key_columns=key_columns)
             
             return jsonify({
                 'message': 'File uploaded successfully',
-                'table': table_name
+                'table': table_name,
+                'ingestion': stats,
+                'schema': get_table_schema()
             })
             
+    except ValueError as e:
+        print(f"Rejected upload: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error processing file: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/columnar', methods=['POST'])
+def upload_columnar():
+    """Upload a Parquet or Arrow IPC (.arrow/.feather) file"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file part'}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No selected file'}), 400
+
+        filename = secure_filename(file.filename)
+        table_name, extension = os.path.splitext(filename)
+        file_format = COLUMNAR_FORMATS.get(extension.lower())
+        if file_format is None:
+            return jsonify({
+                'error': f'Unsupported file type: {extension or filename}',
+                'suggestion': 'Upload a .parquet, .arrow or .feather file'
+            }), 400
+        try:
+            mode, key_columns = upload_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        table_name = request.values.get('table') or table_name
+        print(f"Received file: {filename} ({mode})")
+
+        stats = ingest_columnar(file, table_name, file_format, mode=mode, key_columns=key_columns)
+
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'table': table_name,
+            'ingestion': stats,
+            'schema': get_table_schema()
+        })
+
+    except ValueError as e:
+        print(f"Rejected upload: {str(e)}")
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error processing file: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/upload/excel', methods=['POST'])
+def upload_excel():
+    """Upload an .xlsx workbook; every sheet with data becomes its own table"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file part'}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'No selected file'}), 400
+
+        filename = secure_filename(file.filename)
+        base_name, extension = os.path.splitext(filename)
+        if extension.lower() not in EXCEL_EXTENSIONS:
+            return jsonify({
+                'error': f'Unsupported file type: {extension or filename}',
+                'suggestion': 'Upload an .xlsx workbook (save older .xls files as .xlsx first)'
+            }), 400
+        try:
+            mode, key_columns = upload_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        print(f"Received file: {filename} ({mode})")
+
+        stats = ingest_excel(file, request.values.get('table') or base_name, mode=mode, key_columns=key_columns)
+
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'tables': [sheet['table'] for sheet in stats['sheets']],
+            'ingestion': stats,
+            'schema': get_table_schema()
+        })
+
+    except ValueError as e:
+        print(f"Rejected upload: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error processing file: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Upload several CSV/Parquet/Arrow files at once; returns a job id to poll"""
+    try:
+        files = [file for file in request.files.getlist('files') if file.filename]
+        if not files:
+            return jsonify({'error': 'No files selected'}), 400
+        try:
+            mode, key_columns = upload_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        batch = []
+        for file in files:
+            filename = secure_filename(file.filename)
+            table_name, extension = os.path.splitext(filename)
+            file_format = 'csv' if extension.lower() == '.csv' else COLUMNAR_FORMATS.get(extension.lower())
+            if file_format is None:
+                return jsonify({
+                    'error': f'Unsupported file type: {extension or filename}',
+                    'suggestion': 'Upload .csv, .parquet, .arrow or .feather files'
+                }), 400
+            batch.append((filename, table_name, file_format, file))
+
+        job_id = upload_jobs.submit(batch, mode, key_columns)
+        return jsonify(upload_jobs.get(job_id)), 202
+
+    except ValueError as e:
+        print(f"Rejected upload: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error starting batch upload: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/jobs/<job_id>', methods=['GET'])
+def upload_job(job_id):
+    """Progress of a batch upload"""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Upload job not found'}), 404
+    return jsonify(job), 200
+
 @app.route('/remove/<filename>', methods=['POST'])
 def remove_file(filename):
     try:
         table_name = os.path.splitext(filename)[0]
-        with init_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+        remove_table(table_name)
         
         schema = get_table_schema()
         return jsonify({'message': 'File removed successfully', 'schema': schema})
@@ -122,202 +308,88 @@ def process_query():
                 'suggestion': 'Please provide a question to analyze'
             }), 400
 
-        question = data['question']
-        print(f"Processing question: {question}")
-
-        # Validate the question first
-        is_valid, error_message = is_valid_query(question)
-        if not is_valid:
-            return jsonify({
-                'error': error_message,
-                'suggestion': "Try asking something like: 'What are the total sales?' or 'Show me orders from January 2024'"
-            }), 400
+        # Under WSGI the worker thread waits on the shared pipeline loop; the
+        # ASGI entry point (asgi.py) awaits the pipeline without holding a thread
+        payload, status = run_sync(answer_question(data['question'], data.get('session_id')))
+        with metrics.span('query', 'serialization'):
+            body = dumps(payload)
+        return Response(body, status=status, mimetype='application/json')
 
-        # Get current schema with error checking
-        try:
-            schema = get_table_schema()
-            print("Schema retrieved:", schema)
-        except Exception as e:
-            print(f"Error getting schema: {str(e)}")
-            return jsonify({
-                'error': 'Database error',
-                'suggestion': 'There was an error accessing the database'
-            }), 500
-
-        if not schema:
-            return jsonify({
-                'error': 'No tables found in database',
-                'suggestion': 'Please upload some data files first'
-            }), 400
+    except Exception as e:
+        print(f"General error in process_query: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'error': 'Failed to process your question',
+            'suggestion': 'Please try asking in a different way or check your question for typos'
+        }), 400
 
-        # Format schema for the prompt
-        schema_str = ""
-        for table_name, table_info in schema.items():
-            if table_name not in ['conversation_history', 'sqlite_sequence', 'data']:
-                schema_str += f"\nTable: {table_name}\n"
-                for col, col_type in zip(table_info['columns'], table_info['types']):
-                    schema_str += f"  - {col} ({col_type})\n"
+@app.route('/history/<session_id>', methods=['GET'])
+def history(session_id):
+    """Recent questions and answers of a conversation, newest first"""
+    if clean_session_id(session_id) is None:
+        return jsonify({'error': 'Invalid session id'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        turns = conversation_history.recent(session_id, limit)
+        return Response(dumps({'session_id': session_id, 'turns': turns}), mimetype='application/json')
+    except Exception as e:
+        print(f"Error reading conversation history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-        # Generate SQL query using Gemini
-        try:
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            sql_prompt = f"""
-            Given these database tables and their structure:
-            {schema_str}
-
-            Write a SQL query to answer this question: "{question}"
-
-            Analysis Guidelines:
-            1. Schema Analysis:
-               - Examine table relationships through foreign key columns
-               - Understand data types and their meaning:
-                 * Percentage fields (like discounts) are stored as numbers (e.g., 10 means 10%)
-                 * Price/monetary fields need decimal precision
-                 * Dates may need formatting
-               - Identify required tables and their relationships
-
-            2. Data Operations:
-               - For calculations with percentages:
-                 * Always divide percentage values by 100
-                 * Example: 10% should be calculated as value/100
-                 * Use (1 - discount/100) for discount calculations
-               - For monetary calculations:
-                 * Use ROUND() for consistent decimal places
-                 * Maintain proper calculation order
-               - For counting and aggregations:
-                 * Choose appropriate functions (SUM, AVG, COUNT)
-                 * Group results as needed
-                 * Use LEFT JOIN when counting from reference tables
-                 * Include all records from main entity
-                - For table relationships:
-                 * ALWAYS use LEFT JOIN from primary entity to preserve all records
-                 * Start FROM the table containing all records needed (e.g., customers for customer queries)
-                 * Chain additional LEFT JOINs for related data
-                 * Use COALESCE/IFNULL for NULL values (e.g., COALESCE(SUM(...), 0))
-                 * Show zero/empty values for missing data
-
-            3. Query Structure:
-              - Start with the main entity table
-              - Use LEFT JOIN (not regular JOIN) to preserve all records
-              - Apply filters in WHERE clause after joins
-              - Group by main entity identifiers
-              - Order results meaningfully
-
-            4. Result Formatting:
-               - Use clear column aliases
-               - Ensure proper ordering
-               - Format output for readability
-               - Include supporting metrics when:
-                 * Counting items (show the count)
-                 * Finding maximums (show the value)
-                 * Calculating totals (show the total)
-                 * Comparing data (show relevant measures)
-               - Name columns descriptively (e.g., number_of_orders instead of count)
-               - For empty results:
-                 * Return meaningful message instead of empty set
-                 * Show relevant thresholds or criteria
-                 * Indicate why no results were found
-               - Include all relevant information in results
-
-            Generate a focused SQL query that provides complete information to answer the question.
-            Return only the SQL query, no explanations.
-            """
-
-            print("Sending SQL prompt to Gemini:", sql_prompt)
-            response = model.generate_content(sql_prompt)
-            sql_query = response.text.strip()
-            
-            # Clean the SQL query
-            sql_query = sql_query.replace('```sql', '').replace('```', '').strip()
-            print("Generated SQL query:", sql_query)
-
-            # Execute the query with error handling
-            with init_db() as conn:
-                df = pd.read_sql_query(sql_query, conn)
-                print("Query executed successfully, row count:", len(df))
-                
-            if df.empty:
-                return jsonify({
-                    'error': 'No results found',
-                    'sql_query': sql_query,
-                    'suggestion': 'Try modifying your question'
-                }), 404
+@app.route('/query/costs', methods=['GET'])
+def query_costs():
+    """Execution budgets and the cost of recent queries"""
+    return jsonify(query_governor.report()), 200
 
-            # Format results for explanation
-            results = df.to_dict('records')
-            
-            # Generate detailed explanation
-            explanation_prompt = f"""
-            Based on the original question: "{question}"
+@app.route('/query/<result_id>/rows', methods=['GET'])
+def query_rows(result_id):
+    """Page through a large query result kept on the server"""
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', MAX_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
 
-            And the SQL query used to retrieve the data: {sql_query}
-            
-            And the result data retrieved: {results}
-
-            Provide a clear analysis that:
-            1. Directly answers the question with key insights and findings
-            2. Uses proper markdown formatting for better readability:
-               - Use bullet points for listing items
-               - Use tables for structured data when relevant
-               - Use bold and italics for emphasis
-            3. Formats numbers appropriately:
-               - Currency with ₹ and two decimal places
-               - Percentages with two decimal places
-               - Large numbers with comma separators
-            4. Provides relevant context or trends when helpful
-            
-            Keep the focus on answering the user's question clearly and concisely.
-            Only mention SQL or technical details if there's a specific issue that affects the results.
-            """
-            
-            explanation = model.generate_content(explanation_prompt).text
-            
-            # Format numeric columns in results
-            formatted_results = []
-            for row in results:
-                formatted_row = {}
-                for key, value in row.items():
-                    # Only format as currency if it's a monetary value
-                    if isinstance(value, (int, float)):
-                        key_lower = key.lower()
-                        # Check specifically for monetary columns
-                        if ('price' in key_lower or 
-                            'amount' in key_lower or 
-                            'sales' in key_lower or
-                            'revenue' in key_lower or 
-                            'spent' in key_lower or 
-                            'cost' in key_lower):
-                            formatted_row[key] = f"₹{value:.2f}"
-                        else:
-                            # Keep other numeric values as is (like quantity)
-                            formatted_row[key] = value
-                    else:
-                        formatted_row[key] = value
-                formatted_results.append(formatted_row)
-            
-            return jsonify({
-                'sql_query': sql_query,
-                'data': formatted_results,
-                'explanation': explanation,
-                'row_count': len(df)
-            })
+    page = result_store.fetch_rows(result_id, offset, limit)
+    if page is None:
+        return jsonify({
+            'error': 'Result set not found',
+            'suggestion': 'The result may have expired; please ask the question again'
+        }), 404
 
-        except Exception as e:
-            print(f"SQL execution error: {str(e)}")
-            return jsonify({
-                'error': 'Error executing the query',
-                'sql_query': sql_query,
-                'suggestion': 'There might be an issue with the generated SQL query'
-            }), 400
+    return Response(dumps({
+        'result_id': result_id,
+        'offset': offset,
+        'limit': limit,
+        'row_count': page['row_count'],
+        'has_more': offset + len(page['rows']) < page['row_count'],
+        'truncated': page['truncated'],
+        'data': format_frame(page['rows'])
+    }), mimetype='application/json')
 
-    except Exception as e:
-        print(f"General error in process_query: {str(e)}")
-        traceback.print_exc()
+@app.route('/query/stream', methods=['POST'])
+def process_query_stream():
+    """Same pipeline as /query, streamed as newline-delimited JSON events"""
+    data = request.json
+    if not data or 'question' not in data:
         return jsonify({
-            'error': 'Failed to process your question',
-            'suggestion': 'Please try asking in a different way or check your question for typos'
+            'error': 'No question provided',
+            'suggestion': 'Please provide a question to analyze'
         }), 400
 
+    # The response is streamed after the request context (and its workspace) is gone
+    workspace = current_workspace()
+
+    def events():
+        with use_workspace(workspace):
+            for event in iterate_sync(stream_answer(data['question'], session_id=data.get('session_id'))):
+                yield dumps(event) + "\n"
+
+    return Response(events(), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     # Initialize database
     init_database()
@@ -0,0 +1,144 @@
+"""ASGI entry point: `uvicorn asgi:application --port 5000`
+
+POST /query and /query/stream are served natively on the event loop so that
+waiting on the model does not pin a worker thread; every other route is
+delegated to the Flask app. Like there, the X-Workspace header (or
+?workspace=) selects the workspace a question is answered in.
+"""
+import json
+import asyncio
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from app import app as flask_app
+from db import DEFAULT_WORKSPACE, clean_workspace, use_workspace
+from database import init_database
+from query_pipeline import answer_question, stream_answer
+from result_format import dumps
+from metrics import metrics
+
+ALLOWED_ORIGINS = {"http://localhost:3000"}
+
+wsgi_application = WsgiToAsgi(flask_app)
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+def _response_headers(scope, content_type):
+    headers = [(b'content-type', content_type)]
+    origin = dict(scope.get('headers', [])).get(b'origin', b'').decode('latin-1')
+    if origin in ALLOWED_ORIGINS:
+        headers.append((b'access-control-allow-origin', origin.encode('latin-1')))
+        headers.append((b'vary', b'Origin'))
+    return headers
+
+async def _send_json(send, scope, payload, status):
+    headers = _response_headers(scope, b'application/json')
+    with metrics.span('query', 'serialization'):
+        body = dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+def _request_workspace(scope):
+    """Workspace named by the X-Workspace header or ?workspace=, or None if the name is invalid"""
+    workspace = dict(scope.get('headers', [])).get(b'x-workspace', b'').decode('latin-1')
+    if not workspace:
+        workspace = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('workspace', [''])[0]
+    return clean_workspace(workspace) if workspace else DEFAULT_WORKSPACE
+
+async def _read_question(scope, receive, send):
+    """Return the posted request body, or None after answering/abandoning the request"""
+    body = await _read_body(receive)
+    if body is None:
+        return None
+    if _request_workspace(scope) is None:
+        await _send_json(send, scope, {
+            'error': 'Invalid workspace',
+            'suggestion': 'Use up to 64 letters, digits, "-" or "_"'
+        }, 400)
+        return None
+    try:
+        data = json.loads(body or b'null')
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'question' not in data:
+        await _send_json(send, scope, {
+            'error': 'No question provided',
+            'suggestion': 'Please provide a question to analyze'
+        }, 400)
+        return None
+    return data
+
+async def _run_until_disconnect(coro, receive):
+    """Run coro, cancelling it (and any in-flight model call) if the client goes away"""
+    task = asyncio.ensure_future(coro)
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+    done, _ = await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    if task not in done:
+        task.cancel()
+        print("Client disconnected, cancelled query")
+        return
+    disconnect.cancel()
+    return task.result()
+
+async def query_endpoint(scope, receive, send):
+    data = await _read_question(scope, receive, send)
+    if data is None:
+        return
+
+    async def respond():
+        try:
+            payload, status = await answer_question(data['question'], data.get('session_id'))
+        except Exception as e:
+            print(f"General error in process_query: {str(e)}")
+            payload, status = {
+                'error': 'Failed to process your question',
+                'suggestion': 'Please try asking in a different way or check your question for typos'
+            }, 400
+        await _send_json(send, scope, payload, status)
+
+    with use_workspace(_request_workspace(scope)):
+        await _run_until_disconnect(respond(), receive)
+
+async def query_stream_endpoint(scope, receive, send):
+    data = await _read_question(scope, receive, send)
+    if data is None:
+        return
+
+    async def respond():
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': _response_headers(scope, b'application/x-ndjson')})
+        async for event in stream_answer(data['question'], session_id=data.get('session_id')):
+            line = dumps(event) + "\n"
+            await send({'type': 'http.response.body', 'body': line.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    with use_workspace(_request_workspace(scope)):
+        await _run_until_disconnect(respond(), receive)
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                init_database()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] == 'http' and scope['method'] == 'POST':
+        if scope['path'] == '/query':
+            return await query_endpoint(scope, receive, send)
+        if scope['path'] == '/query/stream':
+            return await query_stream_endpoint(scope, receive, send)
+    return await wsgi_application(scope, receive, send)
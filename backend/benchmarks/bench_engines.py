@@ -0,0 +1,99 @@
+"""Aggregate query latency: SQLite row store vs the DuckDB columnar store.
+
+    python benchmarks/bench_engines.py --orders 10000000 --repeat 3
+
+Generates the dummy_data_DataChat_AI/sample_data_2 schema (customers,
+products, order_details, orders) scaled to --orders order lines with
+benchmarks/synthetic.py, loads it through the upload path into a scratch
+SQLite database and DuckDB file, and times the SUM/AVG/GROUP BY questions
+users ask most on both engines. Prints a JSON report; the app's progress
+prints go to stderr.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from synthetic import SyntheticDataset  # noqa: E402
+
+QUERIES = {
+    'revenue_by_category': """
+        SELECT p.category, ROUND(SUM(o.quantity * o.unit_price * (1 - o.discount / 100.0)), 2) AS revenue
+        FROM products p LEFT JOIN orders o ON o.product_id = p.product_id
+        GROUP BY p.category ORDER BY revenue DESC""",
+    'top_customers_by_spend': """
+        SELECT c.customer_id, c.customer_name, ROUND(SUM(o.quantity * o.unit_price), 2) AS total_spent
+        FROM customers c
+        LEFT JOIN order_details d ON d.customer_id = c.customer_id
+        LEFT JOIN orders o ON o.order_id = d.order_id
+        GROUP BY c.customer_id, c.customer_name ORDER BY total_spent DESC LIMIT 10""",
+    'orders_per_month': """
+        SELECT substr(order_date, 1, 7) AS month, COUNT(*) AS number_of_orders
+        FROM order_details GROUP BY month ORDER BY month""",
+    'avg_discount_by_country_status': """
+        SELECT d.shipping_country, d.status, ROUND(AVG(o.discount), 2) AS avg_discount, SUM(o.quantity) AS units
+        FROM order_details d LEFT JOIN orders o ON o.order_id = d.order_id
+        GROUP BY d.shipping_country, d.status""",
+}
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--orders', type=int, default=10000000, help='rows in the orders table')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Scratch stores; must be configured before the app modules are imported
+    workdir = tempfile.mkdtemp(prefix='datachat-bench-engines-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'data.db')
+    os.environ['RESULTS_DB_PATH'] = os.path.join(workdir, 'results.db')
+    os.environ['COLUMNAR_DB_PATH'] = os.path.join(workdir, 'data.duckdb')
+
+    from database import init_database
+    from engines import SQLiteEngine, DuckDBEngine
+    from index_advisor import index_advisor
+
+    dataset = SyntheticDataset('sample_data_2', args.orders)
+    report = {'benchmark': 'query_engines', 'orders': args.orders, 'tables': dataset.sizes,
+              'load': {}, 'queries': []}
+    with contextlib.redirect_stdout(sys.stderr):
+        init_database()
+        sqlite_engine, duckdb_engine = SQLiteEngine(), DuckDBEngine()
+        for table, rows in dataset.sizes.items():
+            # One pass over the chunks fills both stores, as an upload does
+            _, (load_s,) = timed(lambda: duckdb_engine.load_table(table, dataset.chunks(table)), 1)
+            _, (index_s,) = timed(lambda: index_advisor.index_uploaded_table(table), 1)
+            report['load'][table] = {'rows': rows, 'load_s': round(load_s, 2), 'index_s': round(index_s, 2)}
+
+        for name, sql in QUERIES.items():
+            entry = {'query': name}
+            for engine in (sqlite_engine, duckdb_engine):
+                result, times = timed(lambda: engine.execute(sql), args.repeat)
+                entry[engine.name] = {
+                    'median_s': round(statistics.median(times), 4),
+                    'best_s': round(min(times), 4),
+                    'rows': result.row_count,
+                }
+            entry['speedup'] = round(entry['sqlite']['median_s'] / max(entry['duckdb']['median_s'], 1e-9), 1)
+            report['queries'].append(entry)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Result formatting benchmark: per-cell loop vs vectorized columns.
+
+    python benchmarks/bench_formatting.py --rows 1000 100000 1000000
+
+Times formatting + JSON serialization of a synthetic query result with
+monetary, count, percentage and text columns and prints a JSON report.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from result_format import format_frame, records_json  # noqa: E402
+
+
+def legacy_format_results(results):
+    """The original per-cell formatting loop from process_query"""
+    formatted_results = []
+    for row in results:
+        formatted_row = {}
+        for key, value in row.items():
+            if isinstance(value, (int, float)):
+                key_lower = key.lower()
+                if ('price' in key_lower or
+                    'amount' in key_lower or
+                    'sales' in key_lower or
+                    'revenue' in key_lower or
+                    'spent' in key_lower or
+                    'cost' in key_lower):
+                    formatted_row[key] = f"₹{value:.2f}"
+                else:
+                    formatted_row[key] = value
+            else:
+                formatted_row[key] = value
+        formatted_results.append(formatted_row)
+    return formatted_results
+
+
+def make_result(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'customer_id': np.arange(rows),
+        'customer_name': rng.choice(['Alice', 'Bob', 'Carol', 'Dave'], rows),
+        'number_of_orders': rng.integers(0, 50, rows),
+        'total_spent': rng.random(rows) * 5000,
+        'avg_discount': rng.random(rows) * 20,
+    })
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    report = []
+    for rows in args.rows:
+        df = make_result(rows)
+        legacy = timed(lambda: json.dumps(legacy_format_results(df.to_dict('records')),
+                                          ensure_ascii=False), args.repeat)
+        vectorized = timed(lambda: records_json(format_frame(df)), args.repeat)
+        report.append({
+            'rows': rows,
+            'legacy_loop_s': round(legacy, 4),
+            'vectorized_s': round(vectorized, 4),
+            'speedup': round(legacy / vectorized, 2),
+        })
+    json.dump({'benchmark': 'result_formatting', 'results': report}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+"""Offline benchmark suite: upload, schema, query, formatting and end-to-end /query.
+
+    python benchmarks/bench_suite.py --rows 1000000 --output bench.json
+    python benchmarks/bench_suite.py --rows 1000000 --compare bench.json
+
+Runs without a Gemini key: the model is a FakeBackend that replays canned
+SQL for the suite's questions (with --latency seconds of simulated model
+time) and a canned explanation. The data is benchmarks/synthetic.py scaled
+from --sample to --rows fact rows, in scratch databases.
+
+Scenarios (select with --scenarios):
+* upload: CSV ingestion throughput per table, through ingest_csv
+* schema: cached prompt schema, full catalog reload and schema retrieval
+  with --schema-tables extra tables in the workspace
+* query: the QUERY_ENGINE's latency on the bench_engines.py questions
+* formatting: format_frame + JSON of a --format-rows result
+* e2e: /query latency and throughput with --concurrency requests in
+  flight, on the ASGI app and on Flask worker threads
+
+The JSON report (stdout, and --output) carries the commit it was measured
+at. --compare checks it against an earlier report and exits with status 1
+when a timing got more than --threshold slower or a throughput dropped by
+as much; scenarios whose parameters differ from the earlier run are not
+compared. The app's progress prints go to stderr.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+import contextlib
+import tempfile
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+from synthetic import SyntheticDataset  # noqa: E402
+from bench_engines import QUERIES  # noqa: E402
+from bench_formatting import make_result  # noqa: E402
+
+SCENARIOS = ('upload', 'schema', 'query', 'formatting', 'e2e')
+# Parameters each scenario's timings depend on; --compare needs them to match
+SCENARIO_PARAMS = {
+    'upload': ('sample', 'rows'),
+    'schema': ('sample', 'rows', 'schema_tables', 'runs'),
+    'query': ('sample', 'rows', 'runs'),
+    'formatting': ('format_rows', 'runs'),
+    'e2e': ('sample', 'rows', 'requests', 'concurrency', 'latency'),
+}
+# Questions the fake model answers with the bench_engines.py queries
+QUESTIONS = {
+    'What is the revenue by category': 'revenue_by_category',
+    'Who are the top customers by spend': 'top_customers_by_spend',
+    'How many orders were placed per month': 'orders_per_month',
+    'What is the average discount by country and status': 'avg_discount_by_country_status',
+}
+CANNED_EXPLANATION = "Revenue is concentrated in a few categories, led by **Electronics**."
+QUESTION_PATTERN = re.compile(r'answer this question: "([^"]*)"')
+
+
+def replay_backend(latency):
+    """FakeBackend answering the suite's questions with canned SQL"""
+    from llm import FakeBackend
+
+    def sql_for(prompt):
+        question = QUESTION_PATTERN.search(prompt).group(1)
+        for text, name in QUESTIONS.items():
+            if question.startswith(text):
+                return QUERIES[name]
+        raise ValueError(f"No canned SQL for {question!r}")
+
+    return FakeBackend({'Write a SQL query': sql_for, 'Provide a clear analysis': CANNED_EXPLANATION},
+                       latency=latency)
+
+
+def timings(times):
+    times = sorted(times)
+    return {
+        'runs': len(times),
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 3),
+        'best_ms': round(times[0] * 1000, 3),
+    }
+
+
+def repeat(func, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_upload(dataset, workdir):
+    from ingest import ingest_csv
+
+    paths = dataset.write_csv(os.path.join(workdir, 'csv'))
+    report = {'tables': {}}
+    total_rows = total_seconds = 0
+    for table, path in paths.items():
+        with open(path, 'rb') as f:
+            stats = ingest_csv(f, table)
+        report['tables'][table] = {'rows': stats['rows'], 'seconds': stats['seconds'],
+                                   'rows_per_s': stats['rows_per_sec'], 'bytes_per_s': stats['bytes_per_sec']}
+        total_rows += stats['rows']
+        total_seconds += stats['seconds']
+    report['total'] = {'rows': total_rows, 'seconds': round(total_seconds, 3),
+                       'rows_per_s': round(total_rows / max(total_seconds, 1e-9), 1)}
+    return report
+
+
+def bench_schema(extra_tables, runs):
+    import pandas as pd
+    from database import schema_catalog
+    from ingest import load_chunks
+    from schema_index import schema_index
+
+    # Unrelated narrow tables, so retrieval has something to prune
+    for i in range(extra_tables):
+        load_chunks(f"extra_table_{i}", [pd.DataFrame({
+            f"extra_{i}_id": range(10), 'label': [f"item {j}" for j in range(10)],
+            'amount': [j * 1.5 for j in range(10)], 'created_on': ['2024-01-01'] * 10})])
+    full_schema = schema_catalog.prompt_schema()
+    report = {
+        'tables': len(schema_catalog.table_names()),
+        'prompt_schema_chars': len(full_schema),
+        'prompt_schema': timings(repeat(schema_catalog.prompt_schema, runs)),
+        'catalog_reload': timings(repeat(schema_catalog.reload, max(runs // 10, 3))),
+    }
+    questions = list(QUESTIONS)
+    retrieved = schema_index.relevant_schema(questions[0], full_schema)
+    report['retrieval'] = timings(repeat(
+        lambda: [schema_index.relevant_schema(question, full_schema) for question in questions], runs))
+    report['retrieval_chars'] = len(retrieved)
+    return report
+
+
+def bench_query(runs):
+    from engines import get_engine
+
+    engine = get_engine()
+    report = {'engine': engine.name, 'queries': {}}
+    for name, sql in QUERIES.items():
+        report['queries'][name] = timings(repeat(lambda: engine.execute(sql), runs))
+    return report
+
+
+def bench_formatting(rows, runs):
+    from result_format import format_frame, records_json
+
+    df = make_result(rows)
+    return {'rows': rows, 'format_and_json': timings(repeat(lambda: records_json(format_frame(df)), runs))}
+
+
+def throughput(label, results, elapsed):
+    return {
+        'mode': label,
+        'requests': len(results),
+        'ok': sum(1 for _, status in results if status == 200),
+        'seconds': round(elapsed, 3),
+        'requests_per_s': round(len(results) / elapsed, 2),
+        **timings([latency for latency, _ in results]),
+    }
+
+
+def bench_e2e(requests, concurrency):
+    from concurrent.futures import ThreadPoolExecutor
+    from app import app
+    from asgi import application
+
+    questions = list(QUESTIONS)
+
+    def question(run, i):
+        # Distinct questions, so the LLM cache never short-circuits the model
+        return f"{questions[i % len(questions)]} (run {run} {i})"
+
+    async def run_async():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(text):
+            body = json.dumps({'question': text}).encode('utf-8')
+            scope = {'type': 'http', 'method': 'POST', 'path': '/query', 'headers': []}
+            messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+            sent = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await asyncio.Event().wait()
+
+            async def send(message):
+                sent.append(message)
+
+            async with semaphore:
+                start = time.perf_counter()
+                await application(scope, receive, send)
+                return time.perf_counter() - start, sent[0]['status']
+
+        return await asyncio.gather(*(one(question('asgi', i)) for i in range(requests)))
+
+    start = time.perf_counter()
+    asgi_results = asyncio.run(run_async())
+    asgi = throughput(f'asgi ({concurrency} in flight)', asgi_results, time.perf_counter() - start)
+
+    client = app.test_client()
+
+    def one(text):
+        start = time.perf_counter()
+        response = client.post('/query', json={'question': text})
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        flask_results = list(pool.map(one, [question('flask', i) for i in range(requests)]))
+    flask = throughput(f'flask ({concurrency} threads)', flask_results, time.perf_counter() - start)
+
+    # A repeated question is answered from the LLM cache without calling the model
+    cached = timings(repeat(lambda: client.post('/query', json={'question': questions[0]}), 10))
+    return {'asgi': asgi, 'flask': flask, 'cached_question': cached}
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=BENCH_DIR, capture_output=True, text=True).stdout.strip()
+    try:
+        return git('rev-parse', 'HEAD') or None, bool(git('status', '--porcelain', '--untracked-files=no'))
+    except OSError:
+        return None, None
+
+
+def _leaves(report, path=()):
+    if isinstance(report, dict):
+        for key, value in report.items():
+            yield from _leaves(value, path + (key,))
+    elif isinstance(report, (int, float)) and not isinstance(report, bool):
+        yield path, report
+
+
+def mismatched_params(report, baseline):
+    """{scenario: [parameter, ...]} of the scenarios run with other parameters than baseline"""
+    params, before = report['params'], baseline.get('params', {})
+    mismatched = {}
+    for scenario in report['scenarios']:
+        differ = [name for name in SCENARIO_PARAMS[scenario] if params.get(name) != before.get(name)]
+        if differ:
+            mismatched[scenario] = differ
+    return mismatched
+
+
+def compare(report, baseline, threshold):
+    """Metrics that got worse than baseline by more than threshold (a fraction).
+
+    Scenarios whose parameters differ from baseline's are skipped; their
+    timings are not comparable (see mismatched_params).
+    """
+    before = dict(_leaves(baseline['scenarios']))
+    skipped = mismatched_params(report, baseline)
+    regressions = []
+    for path, value in _leaves(report['scenarios']):
+        name = path[-1]
+        old = before.get(path)
+        if not old or path[0] in skipped or name in ('best_ms', 'runs', 'requests', 'ok', 'rows'):
+            continue
+        if name.endswith('_ms') or name == 'seconds':
+            change = value / old - 1
+        elif name.endswith('_per_s'):
+            change = old / max(value, 1e-9) - 1
+        else:
+            continue
+        if change > threshold:
+            regressions.append({'metric': '.'.join(path), 'baseline': old, 'current': value,
+                                'slower_by': round(change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sample', default='sample_data_2', help='sample dataset to scale')
+    parser.add_argument('--rows', type=int, default=1000000, help='rows in the fact table')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=20, help='repetitions of each timed operation')
+    parser.add_argument('--schema-tables', type=int, default=50, help='extra tables for the schema scenario')
+    parser.add_argument('--format-rows', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=200, help='/query requests per e2e mode')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05, help='fake model latency (s)')
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--compare', help='earlier report to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, e.g. 0.25 = 25%%')
+    args = parser.parse_args()
+
+    if args.sample != 'sample_data_2' and {'query', 'e2e'} & set(args.scenarios):
+        parser.error("the query and e2e scenarios run the sample_data_2 questions")
+
+    # Scratch stores and the offline model; must be configured before the app is imported
+    workdir = tempfile.mkdtemp(prefix='datachat-bench-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'data.db')
+    os.environ['RESULTS_DB_PATH'] = os.path.join(workdir, 'results.db')
+    os.environ['COLUMNAR_DB_PATH'] = os.path.join(workdir, 'data.duckdb')
+    os.environ['LLM_CACHE_PATH'] = os.path.join(workdir, 'llm_cache.db')
+    os.environ['LLM_BACKEND'] = 'fake'
+    os.environ.setdefault('LLM_MAX_CONCURRENCY', str(args.concurrency))
+
+    commit, dirty = git_commit()
+    dataset = SyntheticDataset(args.sample, args.rows)
+    report = {
+        'suite': 'datachat',
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'dataset': dataset.describe(),
+        'scenarios': {},
+    }
+    with contextlib.redirect_stdout(sys.stderr):
+        from llm import set_backend
+        from database import init_database
+
+        set_backend(replay_backend(args.latency))
+        init_database()
+        # Every scenario but formatting needs the data loaded
+        if set(args.scenarios) - {'formatting'}:
+            upload = bench_upload(dataset, workdir)
+            if 'upload' in args.scenarios:
+                report['scenarios']['upload'] = upload
+        if 'query' in args.scenarios:
+            report['scenarios']['query'] = bench_query(args.runs)
+        if 'formatting' in args.scenarios:
+            report['scenarios']['formatting'] = bench_formatting(args.format_rows, args.runs)
+        if 'e2e' in args.scenarios:
+            report['scenarios']['e2e'] = bench_e2e(args.requests, args.concurrency)
+        # Last, since it adds tables the other scenarios do not expect
+        if 'schema' in args.scenarios:
+            report['scenarios']['schema'] = bench_schema(args.schema_tables, args.runs)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['baseline'] = {'commit': baseline.get('commit'), 'threshold': args.threshold,
+                              'skipped': mismatched_params(report, baseline),
+                              'regressions': compare(report, baseline, args.threshold)}
+        for scenario, differ in report['baseline']['skipped'].items():
+            print(f"Not comparing {scenario}: {', '.join(differ)} differ from the baseline run", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.compare and report['baseline']['regressions']:
+        for regression in report['baseline']['regressions']:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']}",
+                  file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
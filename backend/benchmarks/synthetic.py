@@ -0,0 +1,177 @@
+"""Synthetic datasets scaled up from the sample CSVs.
+
+    python benchmarks/synthetic.py --sample sample_data_2 --rows 10000000 --out /tmp/sales
+
+Reads a dummy_data_DataChat_AI/sample_data_* directory, works out each
+table's role from its key columns and writes the same tables with --rows
+rows in the fact table. Fact tables are the ones without their own key,
+header tables (e.g. order_details keyed by order_id) get one row per
+HEADER_FANOUT facts and dimension tables (customers, products) one row
+per DIMENSION_FANOUT. Foreign keys into dimensions are skewed, so a few
+customers and products account for most rows, as in real sales data;
+foreign keys into headers are uniform. Other columns are drawn from the
+sample's values and ranges. Generation is chunked, so 100M-row tables
+only hold CHUNK_ROWS rows in memory at a time.
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'dummy_data_DataChat_AI')
+CHUNK_ROWS = 1000000
+HEADER_FANOUT = 3
+DIMENSION_FANOUT = 100
+# Foreign key index = n * u**KEY_SKEW, so about a fifth of the rows hit the top 1% of keys
+KEY_SKEW = 3.0
+# Spreads the hot keys over the key range instead of the lowest ids (a prime, so a bijection)
+KEY_SCRAMBLE = 2654435761
+# Sample date ranges are widened to at least this many days, ending at the sample's last date
+MIN_DATE_SPAN_DAYS = 730
+
+
+def _stem(name):
+    if name.endswith('ies'):
+        return name[:-3] + 'y'
+    return name[:-1] if name.endswith('s') and not name.endswith('ss') else name
+
+
+def _own_key(table, df, claimed):
+    """The column a sample table is keyed by, or None for fact tables"""
+    unique = [column for column in df.columns
+              if column.lower().endswith('_id') and df[column].is_unique and column not in claimed]
+    named = f"{_stem(table.lower())}_id"
+    for column in unique:
+        if column.lower() == named:
+            return column
+    return unique[0] if unique else None
+
+
+def _is_date(series):
+    parsed = pd.to_datetime(series.astype(str), format='%Y-%m-%d', errors='coerce')
+    return parsed.notna().all()
+
+
+class SyntheticDataset:
+    """Tables of a sample directory scaled so the fact table has `rows` rows"""
+
+    def __init__(self, sample='sample_data_2', rows=1000000, seed=0):
+        sample_dir = sample if os.path.isdir(sample) else os.path.join(SAMPLES_DIR, sample)
+        self.rows = rows
+        self.seed = seed
+        self.samples = {os.path.splitext(name)[0]: pd.read_csv(os.path.join(sample_dir, name))
+                        for name in sorted(os.listdir(sample_dir)) if name.endswith('.csv')}
+
+        # Keys named after their table (customers.customer_id) are claimed first
+        self.keys = {}
+        for table, df in self.samples.items():
+            column = f"{_stem(table.lower())}_id"
+            if column in df.columns and df[column].is_unique:
+                self.keys[table] = column
+        for table, df in self.samples.items():
+            if table not in self.keys:
+                key = _own_key(table, df, set(self.keys.values()))
+                if key is not None:
+                    self.keys[table] = key
+        owners = {column: table for table, column in self.keys.items()}
+        self.foreign_keys = {table: {column: owners[column] for column in df.columns
+                                     if column in owners and owners[column] != table}
+                             for table, df in self.samples.items()}
+
+        self.sizes = {}
+        for table in self.samples:
+            if table not in self.keys:
+                self.sizes[table] = rows
+            elif self.foreign_keys[table]:
+                self.sizes[table] = max(rows // HEADER_FANOUT, len(self.samples[table]))
+            else:
+                self.sizes[table] = max(rows // DIMENSION_FANOUT, len(self.samples[table]))
+
+    def role(self, table):
+        if table not in self.keys:
+            return 'fact'
+        return 'header' if self.foreign_keys[table] else 'dimension'
+
+    def _column(self, table, column, ids, rng):
+        sample = self.samples[table][column].dropna()
+        n = len(ids)
+        if column == self.keys.get(table):
+            return ids + int(sample.min()) - 1
+        parent = self.foreign_keys[table].get(column)
+        if parent is not None:
+            size = self.sizes[parent]
+            base = int(self.samples[parent][column].min())
+            if self.role(parent) == 'header':
+                return base + rng.integers(0, size, n)
+            index = np.minimum((size * rng.random(n) ** KEY_SKEW).astype(np.int64), size - 1)
+            return base + (index * KEY_SCRAMBLE) % size
+        if pd.api.types.is_integer_dtype(sample):
+            return rng.integers(int(sample.min()), int(sample.max()) + 1, n)
+        if pd.api.types.is_float_dtype(sample):
+            if (sample == sample.round()).all():
+                # Coded values such as discount percentages
+                counts = sample.value_counts(normalize=True)
+                return rng.choice(counts.index.to_numpy(), n, p=counts.to_numpy())
+            return np.round(rng.uniform(sample.min(), sample.max(), n), 2)
+        if _is_date(sample):
+            dates = pd.to_datetime(sample.astype(str), format='%Y-%m-%d')
+            last = dates.max()
+            first = min(dates.min(), last - pd.Timedelta(days=MIN_DATE_SPAN_DAYS))
+            days = pd.date_range(first, last).strftime('%Y-%m-%d').to_numpy()
+            return days[rng.integers(0, len(days), n)]
+        values = sample.astype(str)
+        if values.str.contains('@').all():
+            user = np.char.add('user', ids.astype(str))
+            return np.char.add(user, '@example.com')
+        if 'name' in column.lower():
+            # Unique names such as customer or product names
+            stems = values.to_numpy()[ids % len(values)].astype(str)
+            return np.char.add(np.char.add(stems, ' '), ids.astype(str))
+        counts = values.value_counts(normalize=True)
+        return rng.choice(counts.index.to_numpy(), n, p=counts.to_numpy())
+
+    def chunks(self, table, chunk_rows=CHUNK_ROWS):
+        """Yield DataFrame chunks of one scaled table"""
+        # Seeded per table, so every table is reproducible on its own
+        rng = np.random.default_rng([self.seed, sorted(self.samples).index(table)])
+        columns = list(self.samples[table].columns)
+        size = self.sizes[table]
+        for start in range(0, size, chunk_rows):
+            ids = np.arange(start + 1, min(start + chunk_rows, size) + 1)
+            yield pd.DataFrame({column: self._column(table, column, ids, rng) for column in columns})
+
+    def write_csv(self, out_dir):
+        """Write every table to out_dir/<table>.csv; returns {table: path}"""
+        os.makedirs(out_dir, exist_ok=True)
+        paths = {}
+        for table in self.samples:
+            path = paths[table] = os.path.join(out_dir, f"{table}.csv")
+            with open(path, 'w', newline='') as f:
+                for i, chunk in enumerate(self.chunks(table)):
+                    chunk.to_csv(f, index=False, header=i == 0)
+        return paths
+
+    def describe(self):
+        return {table: {'rows': self.sizes[table], 'role': self.role(table),
+                        'key': self.keys.get(table), 'foreign_keys': self.foreign_keys[table]}
+                for table in self.samples}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sample', default='sample_data_2', help='sample directory name or path')
+    parser.add_argument('--rows', type=int, default=1000000, help='rows in the fact table(s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', required=True, help='directory to write the CSV files to')
+    args = parser.parse_args()
+
+    dataset = SyntheticDataset(args.sample, args.rows, args.seed)
+    dataset.write_csv(args.out)
+    json.dump({'sample': args.sample, 'out': args.out, 'tables': dataset.describe()}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
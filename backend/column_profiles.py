@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import pandas as pd
+from database import get_database, quote_identifier, schema_catalog
+from db import WorkspaceLocal
+
+# Rows a profile is computed from, read as evenly spaced rowid windows
+PROFILE_SAMPLE_ROWS = int(os.getenv('PROFILE_SAMPLE_ROWS', 20000))
+PROFILE_WINDOWS = 20
+PROFILE_TOP_VALUES = 5
+# Text columns with at most this many distinct values list them in the prompt
+PROFILE_CATEGORY_MAX = 20
+# Share of sampled values that must match a format for it to be reported
+FORMAT_MATCH_RATIO = 0.95
+FORMAT_CHECK_VALUES = 200
+
+# Checked in order; day-first before month-first for ambiguous dd/mm dates
+DATE_FORMATS = (
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%d/%m/%Y', '%m/%d/%Y',
+    '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y', '%d %b %Y', '%b %d, %Y', '%Y-%m',
+)
+TEXT_FORMATS = (
+    ('percent', r'^-?\d+(?:\.\d+)?\s*%$'),
+    ('currency', r'^-?[₹$€£¥]\s?-?[\d,]+(?:\.\d+)?$'),
+    ('number', r'^-?\d{1,3}(?:,\d{3})+(?:\.\d+)?$|^-?\d+\.\d+$|^-?\d+$'),
+)
+NUMERIC_TYPES = ('INT', 'REAL', 'FLOA', 'DOUB', 'NUM', 'DEC')
+
+def _plain(value):
+    """JSON-safe scalar (numpy numbers become Python ones)"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+def _sample(conn, table_name, row_count):
+    """Up to PROFILE_SAMPLE_ROWS rows spread over the whole table.
+
+    Each window is a rowid range, so the read costs the size of the
+    sample rather than a scan of the table.
+    """
+    table = quote_identifier(table_name)
+    if row_count <= PROFILE_SAMPLE_ROWS:
+        return pd.read_sql_query(f"SELECT * FROM {table}", conn)
+    low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+    width = PROFILE_SAMPLE_ROWS // PROFILE_WINDOWS
+    # The first window starts at the first row and the last one ends at the last row
+    stride = max(high - low + 1 - width, 0) / (PROFILE_WINDOWS - 1)
+    windows = " OR ".join(f"rowid BETWEEN {start} AND {start + width - 1}"
+                          for start in sorted({low + int(i * stride) for i in range(PROFILE_WINDOWS)}))
+    return pd.read_sql_query(f"SELECT * FROM {table} WHERE {windows}", conn)
+
+def _text_format(values):
+    """('date', '%d/%m/%Y'), ('percent', None), ... or (None, None) for free text"""
+    values = values.drop_duplicates().head(FORMAT_CHECK_VALUES).str.strip()
+    if values.empty:
+        return None, None
+    for kind, pattern in TEXT_FORMATS:
+        if values.str.match(pattern).mean() >= FORMAT_MATCH_RATIO:
+            return kind, None
+    for date_format in DATE_FORMATS:
+        parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+        if parsed.notna().mean() >= FORMAT_MATCH_RATIO:
+            return 'date', date_format
+    return None, None
+
+def profile_frame(df, types):
+    """Per-column profiles of a sample: nulls, distinct count, range, format and top values"""
+    null_ratios = df.isna().mean()
+    distinct = df.nunique()
+    profiles = {}
+    for column, col_type in zip(df.columns, types):
+        series = df[column].dropna()
+        profile = {
+            'type': col_type,
+            'null_ratio': round(float(null_ratios[column]), 4),
+            'distinct': int(distinct[column]),
+            'min': None,
+            'max': None,
+            'format': None,
+            'top_values': []
+        }
+        if col_type.upper().startswith(NUMERIC_TYPES):
+            numbers = pd.to_numeric(series, errors='coerce').dropna()
+            if not numbers.empty:
+                profile['min'], profile['max'] = _plain(numbers.min()), _plain(numbers.max())
+        elif not series.empty:
+            text = series.astype(str)
+            kind, date_format = _text_format(text)
+            profile['format'] = kind
+            if date_format:
+                profile['date_format'] = date_format
+                dates = pd.to_datetime(text, format=date_format, errors='coerce').dropna()
+                profile['min'], profile['max'] = str(dates.min().date()), str(dates.max().date())
+            else:
+                profile['min'], profile['max'] = text.min(), text.max()
+            top = text.value_counts().head(PROFILE_TOP_VALUES)
+            profile['top_values'] = [[value, int(count)] for value, count in top.items()]
+        profiles[column] = profile
+    return profiles
+
+def _number(value):
+    return f"{value:,.2f}".rstrip('0').rstrip('.') if isinstance(value, float) else f"{value:,}"
+
+def column_hint(profile):
+    """One-line description of a column's values for the SQL prompt, or None"""
+    parts = []
+    if profile['format'] == 'date':
+        parts.append(f"dates formatted {profile['date_format']}, {profile['min']} to {profile['max']}")
+    elif profile['format'] in ('percent', 'currency', 'number'):
+        example = profile['top_values'][0][0] if profile['top_values'] else profile['min']
+        parts.append(f"{profile['format']} stored as text like '{example}'")
+    elif profile['top_values'] and profile['distinct'] <= PROFILE_CATEGORY_MAX:
+        values = ", ".join(f"'{value}'" for value, _ in profile['top_values'])
+        parts.append(f"values {values}" + (", ..." if profile['distinct'] > PROFILE_TOP_VALUES else ""))
+    elif profile['min'] is not None and not profile['top_values']:
+        parts.append(f"{_number(profile['min'])} to {_number(profile['max'])}")
+    if profile['null_ratio'] >= 0.01:
+        parts.append(f"{profile['null_ratio']:.0%} null")
+    return "; ".join(parts) or None
+
+
+class ColumnProfiles:
+    """Column profiles computed once per upload and stored in column_profiles.
+
+    The profiles are cached in memory for prompt construction, which reads
+    them through column_hints(); /tables/<name>/profile serves them whole.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def profile_table(self, table_name):
+        """Profile a table from a sample of its rows and store the result"""
+        start = time.perf_counter()
+        with get_database().reader() as conn:
+            table = quote_identifier(table_name)
+            known = conn.execute("SELECT row_count FROM table_metadata WHERE table_name = ?",
+                                 (table_name,)).fetchone()
+            row_count = known[0] if known else conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            types = [row[2] for row in conn.execute(f"PRAGMA table_info({table})")]
+            sample = _sample(conn, table_name, row_count)
+        record = {
+            'table': table_name,
+            'row_count': row_count,
+            'sample_rows': len(sample),
+            'columns': profile_frame(sample, types),
+            'profiled_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        }
+        with get_database().writer() as conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO column_profiles (table_name, row_count, sample_rows, profile, profiled_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (table_name, row_count, len(sample), json.dumps(record['columns']), record['profiled_at']))
+        with self._lock:
+            self._cache[table_name] = record
+        # Re-render the table's prompt schema with the new hints
+        schema_catalog.refresh_hints(table_name)
+        print(f"Profiled {len(types)} columns of {table_name} from {len(sample)} rows "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return record
+
+    def get(self, table_name):
+        """The stored profile of a table, or None if it was never profiled"""
+        with self._lock:
+            if table_name in self._cache:
+                return self._cache[table_name]
+        try:
+            with get_database().reader() as conn:
+                row = conn.execute('''
+                SELECT row_count, sample_rows, profile, profiled_at FROM column_profiles WHERE table_name = ?
+                ''', (table_name,)).fetchone()
+        except sqlite3.Error as e:
+            # e.g. a database created before init_database() added the table
+            print(f"Could not read the profile of {table_name}: {str(e)}")
+            return None
+        record = None
+        if row is not None:
+            record = {
+                'table': table_name,
+                'row_count': row[0],
+                'sample_rows': row[1],
+                'columns': json.loads(row[2]),
+                'profiled_at': row[3]
+            }
+        with self._lock:
+            self._cache[table_name] = record
+        return record
+
+    def column_hints(self, table_name):
+        """{column: hint} for the prompt schema of a table"""
+        record = self.get(table_name)
+        if record is None:
+            return {}
+        return {column: column_hint(profile) for column, profile in record['columns'].items()}
+
+    def on_table_changed(self, table_name, schema_changed=True):
+        """Schema catalog listener: forget the cached profile until it is recomputed or re-read"""
+        with self._lock:
+            self._cache.pop(table_name, None)
+
+
+column_profiles = WorkspaceLocal(lambda workspace: ColumnProfiles())
+schema_catalog.add_listener(lambda table_name, changed: column_profiles.on_table_changed(table_name, changed))
+schema_catalog.set_hint_source(lambda table_name: column_profiles.column_hints(table_name))
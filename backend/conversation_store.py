@@ -0,0 +1,174 @@
+import os
+import re
+import time
+import atexit
+import threading
+from datetime import datetime, timedelta
+from itertools import groupby
+from db import current_workspace, use_workspace, workspaces
+from database import (cleanup_expired_conversations, get_recent_conversations, pack_results,
+                      save_conversations, unpack_results)
+
+# Turns written per transaction, and the longest a turn waits to be written
+HISTORY_BATCH_SIZE = 100
+HISTORY_FLUSH_SECONDS = float(os.getenv('HISTORY_FLUSH_SECONDS', 0.5))
+# How often expired turns are deleted
+HISTORY_SWEEP_SECONDS = float(os.getenv('HISTORY_SWEEP_SECONDS', 600))
+# Earlier turns shown to the model with a follow-up question, and how recent they must be
+HISTORY_CONTEXT_TURNS = int(os.getenv('HISTORY_CONTEXT_TURNS', 3))
+HISTORY_CONTEXT_MINUTES = 30
+CONTEXT_SAMPLE_ROWS = 3
+MAX_SESSION_ID_LENGTH = 64
+
+# Questions that lean on an earlier answer: "and for 2023?", "what about Delhi",
+# "show those by month", "same but only returns"
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(?:and|but|also|now|then|only|instead|what about|how about)\b"
+    r"|\b(?:it|its|those|these|them|they|same|previous|above|instead|again|earlier)\b",
+    re.IGNORECASE)
+
+def is_follow_up(question):
+    """Whether a question reads as a continuation of the previous one"""
+    return bool(FOLLOW_UP_PATTERN.search(question))
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+
+
+class ConversationHistory:
+    """Session-aware conversation history with writes kept off the request path.
+
+    record() queues a turn in memory; a background thread writes queued
+    turns in batches (every HISTORY_FLUSH_SECONDS or HISTORY_BATCH_SIZE
+    turns) and deletes expired ones every HISTORY_SWEEP_SECONDS, so reads
+    never clean up. Results are stored as compressed JSON of their leading
+    rows. Turns not yet written are still returned by recent(). Each turn
+    is written to the workspace it was asked in.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queued = []
+        self._writing = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_sweep = 0.0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def record(self, session_id, question, sql_query, results, row_count, explanation):
+        """Queue one answered question for the history"""
+        entry = {
+            'question': question,
+            'sql_query': sql_query,
+            'results': pack_results(results),
+            'explanation': explanation,
+            'session_id': session_id,
+            'row_count': row_count,
+            'created_at': datetime.utcnow(),
+            'workspace': current_workspace()
+        }
+        with self._lock:
+            self._queued.append(entry)
+            full = len(self._queued) >= HISTORY_BATCH_SIZE
+        self._start()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(HISTORY_FLUSH_SECONDS)
+            self._wake.clear()
+            self.flush()
+            if time.time() - self._last_sweep >= HISTORY_SWEEP_SECONDS:
+                self.sweep()
+
+    def flush(self):
+        """Write every queued turn now"""
+        with self._lock:
+            if not self._queued or self._writing:
+                return
+            self._writing, self._queued = self._queued, []
+        try:
+            writing = sorted(self._writing, key=lambda entry: entry['workspace'])
+            for workspace, entries in groupby(writing, key=lambda entry: entry['workspace']):
+                entries = list(entries)
+                try:
+                    with use_workspace(workspace):
+                        save_conversations(entries)
+                except Exception as e:
+                    print(f"Could not save {len(entries)} history entries of {workspace}: {str(e)}")
+        finally:
+            with self._lock:
+                self._writing = []
+
+    def sweep(self):
+        """Delete expired turns in every open workspace"""
+        self._last_sweep = time.time()
+        for workspace in workspaces.names():
+            try:
+                with use_workspace(workspace):
+                    removed = cleanup_expired_conversations()
+            except Exception as e:
+                print(f"Could not delete expired history of {workspace}: {str(e)}")
+                continue
+            if removed:
+                print(f"Deleted {removed} expired history entries of {workspace}")
+
+    def recent(self, session_id, limit=20, include_results=True):
+        """A session's turns, newest first, including ones not yet written"""
+        workspace = current_workspace()
+        with self._lock:
+            unsaved = [entry for entry in self._writing + self._queued
+                       if entry['session_id'] == session_id and entry['workspace'] == workspace]
+        turns = [{
+            'question': entry['question'],
+            'sql_query': entry['sql_query'],
+            'results': unpack_results(entry['results']) if include_results else None,
+            'explanation': entry['explanation'],
+            'timestamp': entry['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+            'session_id': session_id,
+            'row_count': entry['row_count']
+        } for entry in reversed(unsaved)][:limit]
+        if len(turns) < limit:
+            turns += get_recent_conversations(session_id, limit - len(turns), include_results)
+        return turns
+
+    def context(self, session_id, question):
+        """Prompt text recapping the session's last turns, or '' if the question stands alone.
+
+        Each turn is the question, its SQL and a few result rows, never the
+        whole result.
+        """
+        if not session_id or not is_follow_up(question):
+            return ''
+        since = datetime.utcnow() - timedelta(minutes=HISTORY_CONTEXT_MINUTES)
+        turns = [turn for turn in self.recent(session_id, HISTORY_CONTEXT_TURNS)
+                 if _parse_timestamp(turn['timestamp']) >= since]
+        lines = []
+        for turn in reversed(turns):
+            results = turn['results'] or {}
+            lines.append(f"Question: {turn['question']}")
+            lines.append(f"SQL: {turn['sql_query']}")
+            if results.get('columns'):
+                sample = results['rows'][:CONTEXT_SAMPLE_ROWS]
+                lines.append(f"Result: {turn['row_count']} rows of ({', '.join(results['columns'])}), "
+                             f"first rows {sample}")
+        return "\n".join(lines)
+
+
+conversation_history = ConversationHistory()
+
+def clean_session_id(session_id):
+    """A usable client-supplied session id, or None"""
+    if isinstance(session_id, str) and 0 < len(session_id) <= MAX_SESSION_ID_LENGTH:
+        return session_id
+    return None
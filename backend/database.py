@@ -1,147 +1,440 @@
+import os
+import json
+import zlib
 import sqlite3
+import itertools
 import pandas as pd
 from datetime import datetime, timedelta
+from db import WorkspaceLocal, get_database, use_workspace, workspaces
+from schema_catalog import SchemaCatalog
+from query_guard import query_governor
+from metrics import metrics
 
-def init_database():
+
+class WorkspaceSchemaCatalog(WorkspaceLocal):
+    """The schema catalog of the current workspace.
+
+    Listeners and the hint source are registered once for every workspace's
+    catalog, and are called with that catalog's workspace current.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._hint_source = None
+        super().__init__(self._create)
+
+    def _create(self, workspace):
+        catalog = SchemaCatalog(lambda: get_database(workspace).reader())
+        for callback in self._listeners:
+            catalog.add_listener(self._in_workspace(workspace, callback))
+        if self._hint_source is not None:
+            catalog.set_hint_source(self._in_workspace(workspace, self._hint_source))
+        return catalog
+
+    @staticmethod
+    def _in_workspace(workspace, callback):
+        def call(*args):
+            with use_workspace(workspace):
+                return callback(*args)
+        return call
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+        for workspace, catalog in self.items():
+            catalog.add_listener(self._in_workspace(workspace, callback))
+
+    def set_hint_source(self, source):
+        self._hint_source = source
+        for workspace, catalog in self.items():
+            catalog.set_hint_source(self._in_workspace(workspace, source))
+
+
+# Per-workspace schema caches; kept current by the write paths below
+schema_catalog = WorkspaceSchemaCatalog()
+
+# How an upload is written into its table
+UPLOAD_MODES = ('replace', 'append', 'upsert')
+# Conversation history lifetime, and the leading result rows kept with each turn
+HISTORY_TTL_HOURS = float(os.getenv('HISTORY_TTL_HOURS', 24))
+HISTORY_RESULT_ROWS = 20
+
+def init_database(database=None):
     """Initialize database with necessary tables"""
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    # Create conversation history table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS conversation_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        question TEXT NOT NULL,
-        sql_query TEXT NOT NULL,
-        results TEXT NOT NULL,
-        explanation TEXT NOT NULL,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        expires_at DATETIME NOT NULL
-    )
-    ''')
-    
-    # Create data table (for CSV data)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS data (
-        id INTEGER PRIMARY KEY AUTOINCREMENT
+    with (database or get_database()).writer() as conn:
+        cursor = conn.cursor()
+        
+        # Create conversation history table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            sql_query TEXT NOT NULL,
+            results TEXT NOT NULL,
+            explanation TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            expires_at DATETIME NOT NULL,
+            session_id TEXT,
+            row_count INTEGER
+        )
+        ''')
+        # Databases created before history was session-aware lack these columns
+        history_columns = _table_columns(conn, 'conversation_history')
+        for column, col_type in (('session_id', 'TEXT'), ('row_count', 'INTEGER')):
+            if column not in history_columns:
+                cursor.execute(f"ALTER TABLE conversation_history ADD COLUMN {column} {col_type}")
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversation_session
+        ON conversation_history(session_id, timestamp)
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversation_expires ON conversation_history(expires_at)
+        ''')
+        
+        # Indexes created or considered by the index advisor
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS index_advisor_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            index_name TEXT,
+            source TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            status TEXT NOT NULL,
+            row_count INTEGER,
+            distinct_count INTEGER,
+            build_ms REAL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        # Row count, version and upsert key of every uploaded table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_metadata (
+            table_name TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            key_columns TEXT,
+            last_mode TEXT NOT NULL,
+            last_rows_written INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        # Column profiles of every uploaded table (see column_profiles.py)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS column_profiles (
+            table_name TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            sample_rows INTEGER NOT NULL,
+            profile TEXT NOT NULL,
+            profiled_at DATETIME NOT NULL
+        )
+        ''')
+
+        # Create data table (for CSV data)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT
+        )
+        ''')
+
+def quote_identifier(name):
+    """Quote a table or column name for safe use in SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def infer_column_types(df):
+    """Map the dtypes of a DataFrame sample to SQLite column types"""
+    column_types = {}
+    for col in df.columns:
+        series = df[col]
+        if series.isna().all():
+            column_types[col] = 'TEXT'
+        elif pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+            column_types[col] = 'INTEGER'
+        elif pd.api.types.is_float_dtype(series):
+            # Integer columns with missing values are read as floats
+            values = series.dropna()
+            column_types[col] = 'INTEGER' if (values % 1 == 0).all() else 'REAL'
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            column_types[col] = 'TIMESTAMP'
+        else:
+            column_types[col] = 'TEXT'
+    return column_types
+
+def _chunk_rows(chunk):
+    """Convert a DataFrame chunk into plain Python row tuples (NaN -> NULL)"""
+    datetimes = chunk.select_dtypes(include=['datetime', 'datetimetz']).columns
+    if len(datetimes):
+        # sqlite3 cannot bind pandas Timestamps; store them as ISO text
+        chunk = chunk.copy()
+        for col in datetimes:
+            chunk[col] = chunk[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+def _table_columns(conn, table_name):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})")]
+
+def _create_table(conn, table_name, first, chunks):
+    """Drop and recreate table_name with types inferred from the first chunk"""
+    column_types = infer_column_types(first)
+    table = quote_identifier(table_name)
+    columns_sql = ", ".join(
+        f"{quote_identifier(col)} {col_type}" for col, col_type in column_types.items()
     )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    placeholders = ", ".join("?" for _ in column_types)
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(f"CREATE TABLE {table} ({columns_sql})")
+    rows = 0
+    for chunk in itertools.chain([first], chunks):
+        conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", _chunk_rows(chunk))
+        rows += len(chunk)
+    return rows
+
+def _add_new_columns(conn, table_name, chunk):
+    """ALTER TABLE ADD COLUMN for chunk columns the table lacks; returns their names"""
+    existing = {col.lower() for col in _table_columns(conn, table_name)}
+    new_columns = [col for col in chunk.columns if str(col).lower() not in existing]
+    for col, col_type in infer_column_types(chunk[new_columns]).items():
+        conn.execute(f"ALTER TABLE {quote_identifier(table_name)} "
+                     f"ADD COLUMN {quote_identifier(col)} {col_type}")
+    return new_columns
 
-def create_table_from_file(df, table_name):
-    """Create a new table in SQLite database from DataFrame"""
+def _ensure_unique_key(conn, table_name, key_columns):
+    """Create the unique index ON CONFLICT needs for the upsert key"""
+    index_name = quote_identifier(f"upsert_key_{table_name}_{'_'.join(key_columns)}")
     try:
-        conn = sqlite3.connect('data.db')
-        df.to_sql(table_name, conn, if_exists='replace', index=False)
-        print(f"Created table {table_name} with {len(df)} rows")  # Debug print
-        
-        # Verify the table was created
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-        count = cursor.fetchone()[0]
-        print(f"Verified table {table_name} has {count} rows")  # Debug print
-        
-        conn.close()
-    except Exception as e:
-        print(f"Error creating table {table_name}: {str(e)}")
-        raise
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {quote_identifier(table_name)} "
+                     f"({', '.join(quote_identifier(col) for col in key_columns)})")
+    except sqlite3.IntegrityError:
+        raise ValueError(f"Cannot upsert into {table_name} on {', '.join(key_columns)}: "
+                         "the table already has duplicate values for that key")
+
+def _merge_rows(conn, table_name, first, chunks, mode, key_columns):
+    """Append or upsert chunks into an existing table; returns (rows, inserted, written)"""
+    table = quote_identifier(table_name)
+    if mode == 'upsert':
+        _ensure_unique_key(conn, table_name, key_columns)
+    # New rows get rowids past the current maximum, which tells inserts from updates
+    max_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+    changes_before = conn.total_changes
+    rows = 0
+    for chunk in itertools.chain([first], chunks):
+        columns = list(chunk.columns)
+        sql = (f"INSERT INTO {table} ({', '.join(quote_identifier(col) for col in columns)}) "
+               f"VALUES ({', '.join('?' for _ in columns)})")
+        if mode == 'upsert':
+            keys = {col.lower() for col in key_columns}
+            updates = [quote_identifier(col) for col in columns if str(col).lower() not in keys]
+            sql += f" ON CONFLICT ({', '.join(quote_identifier(col) for col in key_columns)}) DO "
+            if updates:
+                # Rows whose values did not change are left alone rather than rewritten
+                sql += ("UPDATE SET " + ", ".join(f"{col} = excluded.{col}" for col in updates)
+                        + " WHERE " + " OR ".join(f"{table}.{col} IS NOT excluded.{col}" for col in updates))
+            else:
+                sql += "NOTHING"
+        try:
+            conn.executemany(sql, _chunk_rows(chunk))
+        except sqlite3.IntegrityError as e:
+            # e.g. appending a key that an earlier upsert made unique
+            raise ValueError(f"Rows conflict with the data in {table_name}: {str(e)}")
+        rows += len(chunk)
+    inserted = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid > ?", (max_rowid,)).fetchone()[0]
+    return rows, inserted, conn.total_changes - changes_before
+
+def _record_write(conn, table_name, mode, key_columns, row_count, written):
+    """Update the table_metadata row of table_name; returns its new version"""
+    conn.execute('''
+    INSERT INTO table_metadata (table_name, row_count, version, key_columns, last_mode, last_rows_written)
+    VALUES (?, ?, 1, ?, ?, ?)
+    ON CONFLICT (table_name) DO UPDATE SET
+        row_count = excluded.row_count,
+        version = table_metadata.version + 1,
+        key_columns = COALESCE(excluded.key_columns, table_metadata.key_columns),
+        last_mode = excluded.last_mode,
+        last_rows_written = excluded.last_rows_written,
+        updated_at = CURRENT_TIMESTAMP
+    ''', (table_name, row_count, json.dumps(key_columns) if key_columns else None, mode, written))
+    return conn.execute("SELECT version FROM table_metadata WHERE table_name = ?", (table_name,)).fetchone()[0]
+
+def write_table_from_chunks(chunks, table_name, mode='replace', key_columns=None):
+    """Write rows streamed from an iterable of DataFrames into table_name.
+
+    'replace' drops and recreates the table with column types inferred from
+    the first chunk. 'append' inserts the rows into the existing table and
+    'upsert' inserts new keys and updates changed rows (INSERT ... ON CONFLICT
+    on key_columns); both add columns the table does not have yet and create
+    the table if it does not exist. Every chunk is bulk-inserted with
+    executemany inside a single transaction, so a failed upload leaves the
+    previous table untouched. Returns the write statistics.
+    """
+    if mode not in UPLOAD_MODES:
+        raise ValueError(f"Unknown upload mode {mode!r}; expected one of {', '.join(UPLOAD_MODES)}")
+    if mode == 'upsert' and not key_columns:
+        raise ValueError("Upsert needs key columns")
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError(f"No data to import into {table_name}")
+    missing = [col for col in key_columns or [] if col.lower() not in {str(c).lower() for c in first.columns}]
+    if missing:
+        raise ValueError(f"Key column(s) {', '.join(missing)} are not in the uploaded data")
+
+    added_columns = []
+    with get_database().writer() as conn:
+        conn.execute("BEGIN")
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table_name,)).fetchone()
+        if mode == 'replace' or not exists:
+            rows = inserted = written = _create_table(conn, table_name, first, chunks)
+            row_count = rows
+            if mode == 'upsert':
+                _ensure_unique_key(conn, table_name, key_columns)
+        else:
+            previous = conn.execute("SELECT row_count FROM table_metadata WHERE table_name = ?",
+                                    (table_name,)).fetchone()
+            if previous is None:
+                previous = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table_name)}").fetchone()
+            added_columns = _add_new_columns(conn, table_name, first)
+            rows, inserted, written = _merge_rows(conn, table_name, first, chunks, mode, key_columns)
+            row_count = previous[0] + inserted
+        version = _record_write(conn, table_name, mode, key_columns, row_count, written)
+    schema_catalog.refresh_table(table_name)
+    return {
+        'mode': mode,
+        'rows': rows,
+        'inserted': inserted,
+        'updated': written - inserted,
+        'unchanged': rows - written,
+        'added_columns': added_columns,
+        'key_columns': key_columns,
+        'table_rows': row_count,
+        'version': version
+    }
+
+def get_table_metadata(table_name=None):
+    """Row count, version and upsert key of one uploaded table, or of all of them"""
+    with get_database().reader() as conn:
+        rows = conn.execute('''
+        SELECT table_name, row_count, version, key_columns, last_mode, last_rows_written,
+               created_at, updated_at
+        FROM table_metadata
+        ''' + ("WHERE table_name = ?" if table_name else "ORDER BY table_name"),
+                            (table_name,) if table_name else ()).fetchall()
+    metadata = {
+        row[0]: {
+            'row_count': row[1],
+            'version': row[2],
+            'key_columns': json.loads(row[3]) if row[3] else None,
+            'last_mode': row[4],
+            'last_rows_written': row[5],
+            'created_at': row[6],
+            'updated_at': row[7]
+        }
+        for row in rows
+    }
+    return metadata.get(table_name) if table_name else metadata
 
 def remove_table(table_name):
     """Remove a table from the database"""
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
-    conn.commit()
-    conn.close()
+    with get_database().writer() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+        conn.execute("DELETE FROM table_metadata WHERE table_name = ?", (table_name,))
+        conn.execute("DELETE FROM column_profiles WHERE table_name = ?", (table_name,))
+    schema_catalog.drop_table(table_name)
 
 def get_all_tables():
     """Get list of all tables and their schemas"""
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    # Get all table names
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name != 'conversation_history';")
-    tables = cursor.fetchall()
-    
-    # Get schema for each table
-    schemas = {}
-    for (table_name,) in tables:
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
-        schemas[table_name] = {col[1]: col[2] for col in columns}
-    
-    conn.close()
-    return schemas
+    return {
+        table_name: dict(zip(info['columns'], info['types']))
+        for table_name, info in schema_catalog.get_schema().items()
+    }
 
 def execute_query(query):
     """Execute SQL query and return results as DataFrame"""
     try:
-        conn = sqlite3.connect('data.db')
-        result = pd.read_sql_query(query, conn)
-        conn.close()
-        return result
+        with get_database().reader() as conn:
+            with query_governor.sqlite_limits(conn, query) as cost:
+                df = pd.read_sql_query(query, conn)
+                cost['rows'] = len(df)
+            return df
     except Exception as e:
         print(f"Error executing query: {e}")
         raise e
 
-def save_conversation(question, sql_query, results, explanation):
-    """Save conversation to history with 24-hour expiration"""
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    current_time = datetime.now()
-    expires_at = current_time + timedelta(hours=24)
-    
-    cursor.execute('''
-    INSERT INTO conversation_history 
-    (question, sql_query, results, explanation, timestamp, expires_at)
-    VALUES (?, ?, ?, ?, ?, ?)
-    ''', (question, sql_query, str(results), explanation, current_time, expires_at))
-    
-    conn.commit()
-    conn.close()
-
-def get_recent_conversations():
-    """Get conversations from last 24 hours"""
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    # Clean up expired conversations
-    cleanup_expired_conversations()
-    
-    # Get valid conversations
-    cursor.execute('''
-    SELECT question, sql_query, results, explanation, timestamp
+def _timestamp(moment):
+    # The same text format as CURRENT_TIMESTAMP, so the two compare correctly
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def pack_results(results, max_rows=HISTORY_RESULT_ROWS):
+    """Compress the leading rows of a result (DataFrame or list of records) for history"""
+    df = results if isinstance(results, pd.DataFrame) else pd.DataFrame.from_records(results or [])
+    head = df.head(max_rows)
+    payload = {
+        'columns': [str(column) for column in head.columns],
+        'rows': head.astype(object).where(head.notna(), None).values.tolist(),
+        'row_count': len(df)
+    }
+    return zlib.compress(json.dumps(payload, default=str, separators=(',', ':')).encode('utf-8'))
+
+def unpack_results(blob):
+    """Inverse of pack_results: {'columns', 'rows', 'row_count'}"""
+    if isinstance(blob, bytes):
+        return json.loads(zlib.decompress(blob))
+    # Rows saved before results were compressed hold str(results)
+    return {'columns': [], 'rows': [], 'row_count': None, 'text': blob}
+
+def save_conversations(entries):
+    """Insert a batch of history entries in one transaction.
+
+    Each entry is a dict with question, sql_query, results (from
+    pack_results), explanation, session_id, row_count and created_at.
+    """
+    if not entries:
+        return
+    ttl = timedelta(hours=HISTORY_TTL_HOURS)
+    with get_database().writer() as conn:
+        conn.executemany('''
+        INSERT INTO conversation_history
+        (question, sql_query, results, explanation, timestamp, expires_at, session_id, row_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(entry['question'], entry['sql_query'], entry['results'], entry['explanation'],
+               _timestamp(entry['created_at']), _timestamp(entry['created_at'] + ttl),
+               entry.get('session_id'), entry.get('row_count')) for entry in entries])
+
+def get_recent_conversations(session_id=None, limit=50, include_results=True):
+    """Unexpired conversation turns, newest first, optionally for one session"""
+    query = '''
+    SELECT question, sql_query, results, explanation, timestamp, session_id, row_count
     FROM conversation_history
-    WHERE expires_at > CURRENT_TIMESTAMP
-    ORDER BY timestamp DESC
-    ''')
-    
-    conversations = cursor.fetchall()
-    conn.close()
-    
+    WHERE expires_at > ?
+    ''' + ("AND session_id = ? " if session_id else "") + "ORDER BY timestamp DESC, id DESC LIMIT ?"
+    params = [_timestamp(datetime.utcnow())] + ([session_id] if session_id else []) + [limit]
+    with get_database().reader() as conn:
+        conversations = conn.execute(query, params).fetchall()
+
     return [
         {
             'question': conv[0],
             'sql_query': conv[1],
-            'results': conv[2],
+            'results': unpack_results(conv[2]) if include_results else None,
             'explanation': conv[3],
-            'timestamp': conv[4]
+            'timestamp': conv[4],
+            'session_id': conv[5],
+            'row_count': conv[6]
         }
         for conv in conversations
     ]
 
 def cleanup_expired_conversations():
-    """Delete conversations older than 24 hours"""
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    DELETE FROM conversation_history
-    WHERE expires_at <= CURRENT_TIMESTAMP
-    ''')
-    
-    conn.commit()
-    conn.close() 
\ No newline at end of file
+    """Delete expired conversations; returns how many were removed"""
+    with get_database().writer() as conn:
+        return conn.execute('''
+        DELETE FROM conversation_history
+        WHERE expires_at <= ?
+        ''', (_timestamp(datetime.utcnow()),)).rowcount
+
+# A workspace's database gets the bookkeeping tables when it is first opened
+workspaces.add_open_hook(init_database)
+metrics.add_collector(workspaces.collect_metrics)
@@ -0,0 +1,426 @@
+import os
+import re
+import time
+import queue
+import sqlite3
+import weakref
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# Resolve the database next to the backend code, not relative to the CWD
+DATABASE_PATH = os.getenv('DATABASE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.db'))
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+BUSY_TIMEOUT_SECONDS = 30
+
+# Every other workspace keeps its tables in its own file here, so tenants
+# never see (or wait on) each other's writes; the default one is DATABASE_PATH
+WORKSPACES_DIR = os.getenv('WORKSPACES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workspaces'))
+DEFAULT_WORKSPACE = 'default'
+# Workspace databases kept open at once, and how long an unused one stays open
+MAX_OPEN_WORKSPACES = int(os.getenv('MAX_OPEN_WORKSPACES', 32))
+WORKSPACE_IDLE_SECONDS = float(os.getenv('WORKSPACE_IDLE_SECONDS', 600))
+WORKSPACE_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+# Per-connection tuning; WAL lets readers proceed while the writer commits
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",      # 64 MiB page cache
+    "PRAGMA mmap_size = 268435456",    # 256 MiB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+def open_connection(path, read_only=False):
+    """Open a tuned SQLite connection usable from any thread"""
+    if read_only:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True,
+                               timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """Thread-safe pool of up to `size` lazily opened connections"""
+
+    def __init__(self, factory, size=POOL_SIZE):
+        self._factory = factory
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_create = self._created < self._size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                break
+            try:
+                # Re-checked now and then: connections returned after close() are not put back
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                pass
+        try:
+            return self._factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _release(self, conn, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._idle.put(conn)
+                return
+            self._created -= 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        generation = self._generation
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn, generation)
+
+    def close(self):
+        """Close the idle connections now and the borrowed ones when they are returned"""
+        with self._lock:
+            self._generation += 1
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+class Database:
+    """Pooled read-only connections plus a single serialized writer for one file"""
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        self._readers = ConnectionPool(self._open_reader, pool_size)
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._write_depth = 0
+        self._users = 0
+        self._users_lock = threading.Lock()
+
+    @contextmanager
+    def _use(self):
+        with self._users_lock:
+            self._users += 1
+        try:
+            yield
+        finally:
+            with self._users_lock:
+                self._users -= 1
+
+    def in_use(self):
+        """Whether a connection is borrowed or the writer is held right now"""
+        return self._users > 0
+
+    def _writer_connection(self):
+        if self._writer is None:
+            self._writer = open_connection(self.path)
+        return self._writer
+
+    def _open_reader(self):
+        # Make sure the file exists (and is in WAL mode) before opening it read-only
+        with self._write_lock:
+            self._writer_connection()
+        return open_connection(self.path, read_only=True)
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection: `with db.reader() as conn: ...`"""
+        with self._use(), self._readers.connection() as conn:
+            yield conn
+
+    @contextmanager
+    def writer(self):
+        """Hold the writer connection; commits on success, rolls back on error.
+
+        Writes from every thread are serialized on one connection. Nested use
+        from the same thread joins the outer transaction.
+        """
+        with self._use(), self._write_lock:
+            conn = self._writer_connection()
+            self._write_depth += 1
+            try:
+                yield conn
+                if self._write_depth == 1:
+                    conn.commit()
+            except Exception:
+                if self._write_depth == 1:
+                    conn.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    def close(self):
+        """Close the connections; the next use opens new ones.
+
+        Readers borrowed at this moment are closed when they are returned, and
+        the writer once the write in progress is done.
+        """
+        self._readers.close()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+def clean_workspace(workspace):
+    """A usable client-supplied workspace name, or None"""
+    if isinstance(workspace, str) and WORKSPACE_NAME.match(workspace):
+        return workspace
+    return None
+
+def workspace_path(workspace, extension='.db'):
+    """File holding a workspace's tables (DATABASE_PATH for the default workspace)"""
+    if workspace == DEFAULT_WORKSPACE and extension == '.db':
+        return DATABASE_PATH
+    return os.path.join(WORKSPACES_DIR, workspace + extension)
+
+_current_workspace = contextvars.ContextVar('workspace', default=DEFAULT_WORKSPACE)
+
+def current_workspace():
+    """The workspace the current request (or task, or thread) works in"""
+    return _current_workspace.get()
+
+def set_workspace(workspace):
+    """Switch the current context to a workspace; returns a token for reset_workspace()"""
+    if clean_workspace(workspace) is None:
+        raise ValueError(f"Invalid workspace name {workspace!r}")
+    return _current_workspace.set(workspace)
+
+def reset_workspace(token):
+    _current_workspace.reset(token)
+
+@contextmanager
+def use_workspace(workspace):
+    """Run a block in a workspace: `with use_workspace('sales'): ...`"""
+    token = set_workspace(workspace)
+    try:
+        yield
+    finally:
+        reset_workspace(token)
+
+
+class Workspaces:
+    """Open databases of the non-default workspaces, least recently used first.
+
+    A workspace's file is created and opened on first use and closed again
+    once more than max_open workspaces are open or it has gone unused for
+    idle_seconds. Open hooks prepare a new handle (e.g. create the
+    bookkeeping tables); close hooks let per-workspace state elsewhere be
+    dropped along with it. Open hooks run outside the registry lock, so a
+    slow one only holds up requests for its own workspace. Each workspace has
+    its own writer, so uploads to different workspaces do not wait on each
+    other. A database in use is not closed, and a closed one is reused while
+    anything still holds it: a request keeping the handle reopens that one,
+    never a second writer on the same file.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_WORKSPACES, idle_seconds=WORKSPACE_IDLE_SECONDS):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        # workspace -> (database, last used, future set once the open hooks ran)
+        self._open = OrderedDict()
+        # Closed databases drop out once nothing holds them any more
+        self._databases = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._open_hooks = []
+        self._close_hooks = []
+        self._reaper = None
+        self.opened = 0
+        self.evicted = 0
+
+    def add_open_hook(self, hook):
+        """Call hook(database) whenever a workspace database is (re)opened"""
+        self._open_hooks.append(hook)
+
+    def add_close_hook(self, hook):
+        """Call hook(workspace) after a workspace database was closed"""
+        self._close_hooks.append(hook)
+
+    def database(self, workspace):
+        """The Database of a workspace, opening it if needed"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._open.pop(workspace, None)
+            if entry is None:
+                os.makedirs(WORKSPACES_DIR, exist_ok=True)
+                database = self._databases.get(workspace)
+                if database is None:
+                    database = self._databases[workspace] = Database(workspace_path(workspace))
+                ready = opening = Future()
+                self.opened += 1
+                self._start_reaper()
+            else:
+                database, _, ready = entry
+                opening = None
+            self._open[workspace] = (database, now, ready)
+            open_count = len(self._open)
+            evicted = self._evict(now, keep=workspace)
+        for name, other in evicted:
+            self._close(name, other)
+        if opening is None:
+            # Waits while another request is still setting the file up; its failure is ours too
+            ready.result()
+            return database
+        try:
+            for hook in self._open_hooks:
+                hook(database)
+        except BaseException as e:
+            with self._lock:
+                if self._open.get(workspace, (None, None, None))[2] is opening:
+                    del self._open[workspace]
+            opening.set_exception(e)
+            raise
+        opening.set_result(None)
+        print(f"Opened workspace {workspace} ({open_count} open)")
+        return database
+
+    def _evict(self, now, keep=None):
+        # Least recently used first; stops at the first one that may stay open.
+        # Databases in use or still being set up are skipped, so the limit may
+        # be exceeded for a while
+        evicted = []
+        for name, (database, last_used, ready) in self._open.items():
+            if len(self._open) - len(evicted) <= self.max_open and now - last_used < self.idle_seconds:
+                break
+            if name != keep and ready.done() and not database.in_use():
+                evicted.append((name, database))
+        for name, _ in evicted:
+            del self._open[name]
+        self.evicted += len(evicted)
+        return evicted
+
+    def _start_reaper(self):
+        # Closes idle workspaces even when no other workspace is being opened
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name='workspace-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle_seconds / 2, 1.0))
+            with self._lock:
+                evicted = self._evict(time.monotonic())
+            for name, database in evicted:
+                self._close(name, database)
+
+    def _close(self, workspace, database):
+        # A request that started using the database since it was picked still
+        # finishes: borrowed readers are closed when returned (see Database.close)
+        database.close()
+        for hook in self._close_hooks:
+            hook(workspace)
+        print(f"Closed idle workspace {workspace}")
+
+    def names(self):
+        """The default workspace plus every open one"""
+        with self._lock:
+            return [DEFAULT_WORKSPACE] + list(self._open)
+
+    def collect_metrics(self):
+        """Open workspace and eviction counts for the /metrics endpoint"""
+        with self._lock:
+            open_count = len(self._open)
+        return [('workspaces_open', 'gauge', 'Workspace databases open besides the default one',
+                 {(): open_count}, ()),
+                ('workspaces_opened_total', 'counter', 'Workspace databases opened',
+                 {(): self.opened}, ()),
+                ('workspaces_evicted_total', 'counter', 'Workspace databases closed when idle or over the limit',
+                 {(): self.evicted}, ())]
+
+
+class WorkspaceLocal:
+    """One instance of a component per workspace, used as if it were one object.
+
+    Attribute access goes to the current workspace's instance, created by
+    factory(workspace) on first use and dropped when that workspace's
+    database is closed. Methods are looked up at call time, so pass
+    `lambda *args: proxy.method(*args)` where a callback must follow the
+    workspace rather than stay bound to the one current at registration.
+    close(instance), if given, releases what a dropped instance holds.
+    """
+
+    def __init__(self, factory, close=None):
+        self._factory = factory
+        self._close = close
+        self._instances = {}
+        self._lock = threading.Lock()
+        workspaces.add_close_hook(self._forget)
+
+    def for_workspace(self, workspace):
+        """The instance of a workspace, creating it if needed"""
+        instance = self._instances.get(workspace)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(workspace)
+                if instance is None:
+                    instance = self._instances[workspace] = self._factory(workspace)
+        return instance
+
+    def current(self):
+        """The current workspace's instance"""
+        return self.for_workspace(current_workspace())
+
+    def items(self):
+        """(workspace, instance) of every workspace with an instance"""
+        with self._lock:
+            return list(self._instances.items())
+
+    def _forget(self, workspace):
+        with self._lock:
+            instance = self._instances.pop(workspace, None)
+        if instance is not None and self._close is not None:
+            try:
+                self._close(instance)
+            except Exception as e:
+                print(f"Could not close {type(instance).__name__} of workspace {workspace}: {str(e)}")
+
+    def collect_metrics(self):
+        """The collect_metrics() families of every workspace's instance, labelled by workspace"""
+        families = OrderedDict()
+        for workspace, instance in self.items():
+            for name, metric_type, help_text, values, labelnames in instance.collect_metrics():
+                family = families.setdefault(
+                    name, (name, metric_type, help_text, {}, ('workspace',) + tuple(labelnames)))
+                family[3].update({(workspace,) + tuple(key): value for key, value in values.items()})
+        return list(families.values())
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_factory', '_close', '_instances', '_lock'):
+            raise AttributeError(name)
+        return getattr(self.current(), name)
+
+
+_default_database = Database(DATABASE_PATH)
+workspaces = Workspaces()
+
+def get_database(workspace=None):
+    """Return the Database of a workspace (the current one by default)"""
+    workspace = workspace or current_workspace()
+    if workspace == DEFAULT_WORKSPACE:
+        return _default_database
+    return workspaces.database(workspace)
@@ -0,0 +1,289 @@
+import os
+import threading
+import pandas as pd
+from database import infer_column_types, quote_identifier, schema_catalog, write_table_from_chunks
+from db import DEFAULT_WORKSPACE, WorkspaceLocal, get_database, workspace_path
+from query_guard import QueryTooExpensive, query_governor
+from result_store import result_store
+
+try:
+    import duckdb
+except ImportError:  # optional: only needed for QUERY_ENGINE=duckdb
+    duckdb = None
+
+# 'sqlite' (default) or 'duckdb' for the columnar store
+QUERY_ENGINE = os.getenv('QUERY_ENGINE', 'sqlite')
+COLUMNAR_PATH = os.getenv('COLUMNAR_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.duckdb'))
+# Rows per chunk when copying existing SQLite tables into the columnar store
+COPY_CHUNK_SIZE = 100000
+
+# SQLite column types (see infer_column_types) -> DuckDB column types
+DUCKDB_TYPES = {'INTEGER': 'BIGINT', 'REAL': 'DOUBLE', 'TIMESTAMP': 'TIMESTAMP', 'TEXT': 'VARCHAR'}
+
+
+class SQLiteEngine:
+    """Row store: tables and queries both live in the SQLite database"""
+
+    name = 'sqlite'
+    dialect_hint = ''
+
+    def load_table(self, table_name, chunks, mode='replace', key_columns=None):
+        """Write an iterable of DataFrame chunks into table_name; returns write stats"""
+        return write_table_from_chunks(chunks, table_name, mode, key_columns)
+
+    def close(self):
+        # Its connections belong to the workspace's Database
+        pass
+
+    def execute(self, sql_query):
+        """Run generated SQL under the governor's budgets; returns a ResultSet"""
+        with get_database().reader() as conn:
+            with query_governor.sqlite_limits(conn, sql_query) as cost:
+                result = result_store.collect(conn.execute(sql_query))
+                cost.update(rows=result.row_count, truncated=result.truncated)
+        result.cost = cost
+        return result
+
+
+class _PlainValueCursor:
+    """DB-API view of a DuckDB cursor returning the values SQLite would.
+
+    DECIMAL results become floats and dates/timestamps ISO text, so rows can
+    be formatted, serialized and spilled to the result store unchanged.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.description = cursor.description
+        types = [str(column[1]) for column in self.description or []]
+        self._decimals = [i for i, t in enumerate(types) if t.startswith('DECIMAL')]
+        self._temporal = [i for i, t in enumerate(types) if t.startswith(('DATE', 'TIMESTAMP', 'TIME'))]
+
+    def _convert(self, rows):
+        if not (self._decimals or self._temporal):
+            return rows
+        converted = []
+        for row in rows:
+            row = list(row)
+            for i in self._decimals:
+                if row[i] is not None:
+                    row[i] = float(row[i])
+            for i in self._temporal:
+                if row[i] is not None:
+                    row[i] = str(row[i])
+            converted.append(tuple(row))
+        return converted
+
+    def fetchmany(self, size):
+        return self._convert(self._cursor.fetchmany(size))
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+
+class DuckDBEngine:
+    """Columnar copy of the uploaded tables, queried with DuckDB.
+
+    SQLite stays the system of record (schema catalog, indexes, history):
+    uploads are written to both stores in one pass over the chunks, and
+    tables that only exist in SQLite are copied over on first use. Queries
+    run on DuckDB; one it rejects (e.g. SQLite-only syntax) is retried on
+    SQLite.
+    """
+
+    name = 'duckdb'
+    dialect_hint = 'Use DuckDB SQL syntax.'
+
+    def __init__(self, path=COLUMNAR_PATH):
+        if duckdb is None:
+            raise RuntimeError("QUERY_ENGINE=duckdb needs the duckdb package: pip install duckdb")
+        self.path = path
+        self._conn = duckdb.connect(path)
+        self._open_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced = False
+        self._fallback = SQLiteEngine()
+        # Only this workspace's catalog: other workspaces have their own columnar file
+        schema_catalog.current().add_listener(self._on_table_changed)
+
+    def _cursor(self):
+        with self._open_lock:
+            if self._conn is None:
+                self._conn = duckdb.connect(self.path)
+            return self._conn.cursor()
+
+    def close(self):
+        """Close the DuckDB file; a request still holding this engine reopens it on its next query"""
+        with self._open_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _has_table(self, table_name):
+        return self._cursor().execute(
+            "SELECT 1 FROM duckdb_tables() WHERE table_name = ?", [table_name]).fetchone() is not None
+
+    def _mirror(self, cursor, table_name, chunks):
+        """Pass chunks through while appending each one to a new DuckDB table"""
+        table = quote_identifier(table_name)
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        casts = None
+        for chunk in chunks:
+            if casts is None:
+                # Same types the SQLite table gets, from the same first chunk
+                column_types = {col: DUCKDB_TYPES[t] for col, t in infer_column_types(chunk).items()}
+                cursor.execute(f"CREATE TABLE {table} (" + ", ".join(
+                    f"{quote_identifier(col)} {t}" for col, t in column_types.items()) + ")")
+                casts = ", ".join(f"TRY_CAST({quote_identifier(col)} AS {t})" for col, t in column_types.items())
+            cursor.register('upload_chunk', chunk)
+            cursor.execute(f"INSERT INTO {table} SELECT {casts} FROM upload_chunk")
+            cursor.unregister('upload_chunk')
+            yield chunk
+
+    def _mirror_merge(self, cursor, table_name, chunks, mode, key_columns):
+        """Pass chunks through while appending or upserting them into the DuckDB table"""
+        table = quote_identifier(table_name)
+        column_types = None
+        for chunk in chunks:
+            if column_types is None:
+                column_types = {name.lower(): t for name, t in cursor.execute(
+                    "SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = ?",
+                    [table_name]).fetchall()}
+                for col, t in infer_column_types(chunk).items():
+                    if str(col).lower() not in column_types:
+                        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {quote_identifier(col)} {DUCKDB_TYPES[t]}")
+                        column_types[str(col).lower()] = DUCKDB_TYPES[t]
+            columns = [quote_identifier(col) for col in chunk.columns]
+            incoming = "SELECT " + ", ".join(
+                f"TRY_CAST({col} AS {column_types[str(name).lower()]}) AS {col}"
+                for name, col in zip(chunk.columns, columns)) + " FROM upload_chunk"
+            cursor.register('upload_chunk', chunk)
+            if mode == 'upsert':
+                keys = [quote_identifier(col) for col in key_columns]
+                key_names = {col.lower() for col in key_columns}
+                # Last row wins for keys repeated within the chunk, as with SQLite's ON CONFLICT
+                incoming = (f"SELECT * EXCLUDE (upload_row) FROM (SELECT *, row_number() OVER () AS upload_row "
+                            f"FROM ({incoming})) QUALIFY row_number() OVER "
+                            f"(PARTITION BY {', '.join(keys)} ORDER BY upload_row DESC) = 1")
+                match = " AND ".join(f"{table}.{key} = u.{key}" for key in keys)
+                updates = [col for name, col in zip(chunk.columns, columns) if str(name).lower() not in key_names]
+                if updates:
+                    cursor.execute(
+                        f"UPDATE {table} SET " + ", ".join(f"{col} = u.{col}" for col in updates)
+                        + f" FROM ({incoming}) u WHERE {match} AND ("
+                        + " OR ".join(f"{table}.{col} IS DISTINCT FROM u.{col}" for col in updates) + ")")
+                incoming = f"SELECT * FROM ({incoming}) u WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {match})"
+            cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) {incoming}")
+            cursor.unregister('upload_chunk')
+            yield chunk
+
+    def _write(self, table_name, consume, mode='replace', key_columns=None):
+        """Run consume(mirrored_chunks) inside one DuckDB transaction"""
+        with self._write_lock:
+            cursor = self._cursor()
+            try:
+                cursor.begin()
+                if mode == 'replace':
+                    mirror = lambda chunks: self._mirror(cursor, table_name, chunks)
+                else:
+                    mirror = lambda chunks: self._mirror_merge(cursor, table_name, chunks, mode, key_columns)
+                result = consume(mirror)
+                cursor.commit()
+                return result
+            except Exception:
+                cursor.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def load_table(self, table_name, chunks, mode='replace', key_columns=None):
+        """Write chunks to SQLite and DuckDB; DuckDB commits only after SQLite"""
+        if mode != 'replace' and not self._has_table(table_name):
+            # Nothing to merge into yet: write SQLite, then copy the whole table
+            stats = write_table_from_chunks(chunks, table_name, mode, key_columns)
+            self._copy_from_sqlite(table_name)
+            return stats
+        return self._write(
+            table_name,
+            lambda mirror: write_table_from_chunks(mirror(chunks), table_name, mode, key_columns),
+            mode, key_columns)
+
+    def _copy_from_sqlite(self, table_name):
+        def consume(mirror):
+            with get_database().reader() as conn:
+                frames = pd.read_sql_query(f"SELECT * FROM {quote_identifier(table_name)}", conn,
+                                           chunksize=COPY_CHUNK_SIZE)
+                for _ in mirror(frames):
+                    pass
+        self._write(table_name, consume)
+        print(f"Copied {table_name} into the columnar store")
+
+    def _sync_tables(self):
+        """Copy tables uploaded before the engine was enabled"""
+        if self._synced:
+            return
+        with self._sync_lock:
+            if self._synced:
+                return
+            existing = {name for (name,) in self._cursor().execute(
+                "SELECT table_name FROM duckdb_tables()").fetchall()}
+            for table_name in schema_catalog.table_names():
+                if table_name not in existing:
+                    self._copy_from_sqlite(table_name)
+            self._synced = True
+
+    def _on_table_changed(self, table_name, schema_changed):
+        # Uploads write the DuckDB copy themselves; only removals need mirroring
+        if table_name not in schema_catalog.table_names():
+            with self._write_lock:
+                self._cursor().execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+
+    def execute(self, sql_query):
+        """Run generated SQL under the wall-clock budget; returns a ResultSet"""
+        self._sync_tables()
+        cursor = self._cursor()
+        try:
+            with query_governor.timeout_limits('duckdb', cursor.interrupt, sql_query,
+                                               duckdb.InterruptException) as cost:
+                cursor.execute(sql_query)
+                result = result_store.collect(_PlainValueCursor(cursor))
+                cost.update(rows=result.row_count, truncated=result.truncated)
+            result.cost = cost
+            return result
+        except QueryTooExpensive:
+            raise
+        except duckdb.Error as e:
+            print(f"DuckDB could not run the query, falling back to SQLite: {str(e)}")
+            return self._fallback.execute(sql_query)
+        finally:
+            cursor.close()
+
+
+ENGINES = {'sqlite': SQLiteEngine, 'duckdb': DuckDBEngine}
+
+def _create_engine(workspace):
+    name = QUERY_ENGINE.lower()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown QUERY_ENGINE {QUERY_ENGINE!r}; expected one of {sorted(ENGINES)}")
+    if name == 'duckdb' and workspace != DEFAULT_WORKSPACE:
+        return DuckDBEngine(workspace_path(workspace, '.duckdb'))
+    return ENGINES[name]()
+
+_engines = WorkspaceLocal(_create_engine, close=lambda engine: engine.close())
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Return the current workspace's query engine, creating it on first use"""
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+    return _engines.current()
+
+def set_engine(engine):
+    """Swap the query engine of every workspace (e.g. DuckDBEngine(path) in benchmarks)"""
+    global _engine
+    with _engine_lock:
+        _engine = engine
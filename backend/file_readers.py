@@ -0,0 +1,172 @@
+import re
+import datetime
+import pandas as pd
+
+# Chunked readers for uploaded files. This module imports nothing from the
+# app, so batch uploads can run it in worker processes (see upload_jobs).
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed for Parquet/Arrow uploads
+    pa = pa_ipc = pq = None
+
+try:
+    import openpyxl
+except ImportError:  # optional: only needed for Excel uploads
+    openpyxl = None
+
+# Columnar upload formats by file extension
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+EXCEL_EXTENSIONS = {'.xlsx', '.xlsm'}
+# Leading rows of a sheet that its column types are decided from
+EXCEL_SAMPLE_ROWS = 1000
+
+def _arrow_batches(stream, file_format, batch_size):
+    """Yield record batches of at most batch_size rows from a Parquet or Arrow IPC file"""
+    if file_format == 'parquet':
+        yield from pq.ParquetFile(stream).iter_batches(batch_size=batch_size)
+        return
+    try:
+        reader = pa_ipc.open_file(stream)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        # Not the random-access file format; try the streaming format
+        stream.seek(0)
+        batches = pa_ipc.open_stream(stream)
+    for batch in batches:
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
+
+def _batch_to_frame(batch):
+    table = pa.Table.from_batches([batch])
+    # SQLite has no DECIMAL type; store decimals as floats like CSV numbers
+    if any(pa.types.is_decimal(field.type) for field in table.schema):
+        table = table.cast(pa.schema([
+            pa.field(field.name, pa.float64()) if pa.types.is_decimal(field.type) else field
+            for field in table.schema
+        ]))
+    return table.to_pandas()
+
+def arrow_frames(stream, file_format, chunksize):
+    """Yield DataFrames of at most chunksize rows from a Parquet or Arrow IPC file"""
+    if pa is None:
+        raise ValueError("Parquet/Arrow uploads need the pyarrow package: pip install pyarrow")
+    for batch in _arrow_batches(stream, file_format, chunksize):
+        yield _batch_to_frame(batch)
+
+def read_frames(path, file_format, chunksize):
+    """Yield DataFrames of at most chunksize rows from a file of any upload format"""
+    if file_format == 'csv':
+        with pd.read_csv(path, chunksize=chunksize) as reader:
+            yield from reader
+    else:
+        with open(path, 'rb') as stream:
+            yield from arrow_frames(stream, file_format, chunksize)
+
+# Queues a worker process parses into, inherited when the process starts
+_parse_queues = []
+
+def set_parse_queues(queues):
+    """Worker process initializer: keep the queues parse_to_queue writes to"""
+    _parse_queues[:] = queues
+
+def parse_to_queue(path, file_format, chunksize, slot):
+    """Worker process entry point: stream a file's chunks into the bounded queue of slot.
+
+    Puts ('chunk', DataFrame) items, then ('done', None) or ('error', message).
+    The queue's maxsize keeps a parser from running far ahead of the writer.
+    """
+    queue = _parse_queues[slot]
+    try:
+        for frame in read_frames(path, file_format, chunksize):
+            queue.put(('chunk', frame))
+        queue.put(('done', None))
+    except Exception as e:
+        queue.put(('error', f"{type(e).__name__}: {str(e)}"))
+
+def _cell_kind(values):
+    """Column type of a sample of cell values: int, float, bool, datetime, text or None"""
+    values = [value for value in values if value is not None and value != '']
+    if not values:
+        return None
+    if all(isinstance(value, bool) for value in values):
+        return 'bool'
+    if any(isinstance(value, bool) for value in values):
+        return 'text'
+    if all(isinstance(value, int) for value in values):
+        return 'int'
+    if all(isinstance(value, (int, float)) for value in values):
+        return 'float'
+    if all(isinstance(value, (datetime.datetime, datetime.date)) for value in values):
+        return 'datetime'
+    return 'text'
+
+def _sheet_frame(rows, columns, kinds):
+    """Build one chunk, casting every column to the type chosen from the sample"""
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    for column, kind in zip(columns, kinds):
+        if kind in ('int', 'float'):
+            # A stray note in a numeric column (e.g. 'n/a') becomes NULL
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+        elif kind == 'datetime':
+            frame[column] = pd.to_datetime(frame[column], errors='coerce')
+        elif kind == 'text':
+            frame[column] = frame[column].map(lambda value: None if value is None else str(value))
+    return frame.infer_objects()
+
+def _sheet_header(row):
+    """Column names from a header row: blanks get positional names, repeats a suffix"""
+    while row and row[-1] in (None, ''):
+        row = row[:-1]
+    columns, seen = [], {}
+    for index, value in enumerate(row):
+        name = str(value).strip() if value not in (None, '') else f"column_{index + 1}"
+        seen[name] = seen.get(name, 0) + 1
+        columns.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return columns
+
+def _sheet_frames(worksheet, chunksize):
+    """Yield DataFrames of at most chunksize rows from a read-only worksheet"""
+    rows = (row for row in worksheet.iter_rows(values_only=True)
+            if any(value not in (None, '') for value in row))
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = _sheet_header(list(header))
+    width = len(columns)
+
+    def fit(row):
+        row = list(row[:width])
+        return row + [None] * (width - len(row))
+
+    batch = [fit(row) for _, row in zip(range(max(EXCEL_SAMPLE_ROWS, chunksize)), rows)]
+    kinds = [_cell_kind(column) for column in zip(*batch[:EXCEL_SAMPLE_ROWS])] if batch else [None] * width
+    while batch:
+        for start in range(0, len(batch), chunksize):
+            yield _sheet_frame(batch[start:start + chunksize], columns, kinds)
+        batch = [fit(row) for _, row in zip(range(chunksize), rows)]
+
+def table_name_for_sheet(base_name, sheet_name, sheet_count):
+    """Table for one sheet: the file name, plus the sheet name in multi-sheet workbooks"""
+    if sheet_count == 1:
+        return base_name
+    return f"{base_name}_{re.sub(r'[^0-9A-Za-z_]+', '_', sheet_name).strip('_') or 'sheet'}"
+
+def excel_sheets(stream, base_name, chunksize):
+    """Yield (sheet_name, table_name, frames) for every sheet of an .xlsx workbook.
+
+    The workbook is opened with read_only=True, so rows are streamed from
+    the file instead of being loaded into memory; each sheet's frames must
+    be consumed before moving on to the next sheet.
+    """
+    if openpyxl is None:
+        raise ValueError("Excel uploads need the openpyxl package: pip install openpyxl")
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for sheet_name in workbook.sheetnames:
+            table_name = table_name_for_sheet(base_name, sheet_name, len(workbook.sheetnames))
+            yield sheet_name, table_name, _sheet_frames(workbook[sheet_name], chunksize)
+    finally:
+        workbook.close()
@@ -1,15 +1,12 @@
-import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-from database import execute_query, save_conversation, get_recent_conversations, get_all_tables
+from database import execute_query, get_all_tables
 import re
+from result_summary import summarize_result
+from llm import get_backend
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-
 def clean_sql_query(sql):
     """Clean the SQL query by removing markdown formatting and extra whitespace"""
     # Remove markdown SQL code block if present
@@ -73,10 +70,9 @@ def process_question(question):
         Make sure to use proper table names and JOIN operations if needed.
         """
         
-        # Generate SQL query using Gemini
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(prompt)
-        sql_response = response.text.strip()
+        # Generate SQL query using the configured model backend (Gemini unless LLM_BACKEND=fake)
+        model = get_backend()
+        sql_response = model.generate(prompt).strip()
         
         # Check if Gemini detected an invalid query
         if sql_response.startswith("INVALID_QUERY"):
@@ -102,14 +98,14 @@ def process_question(question):
         # Generate explanation
         format_prompt = f"""
         Given this data:
-        {result_df.to_string()}
+        {summarize_result(result_df)}
         
         Provide a clear, concise explanation of these results in response to the question: "{question}"
         If the results seem unexpected or potentially incorrect, mention that in your explanation.
         Focus on the key insights and important numbers in the data.
         """
         
-        explanation = model.generate_content(format_prompt).text
+        explanation = model.generate(format_prompt)
         
         return {
             'data': result_df.to_dict('records'),
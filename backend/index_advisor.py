@@ -0,0 +1,244 @@
+import os
+import re
+import time
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from database import get_database, quote_identifier, schema_catalog
+from db import WorkspaceLocal
+from query_plan import IDENTIFIER, PLAN_AUTOMATIC_INDEX, PLAN_SCAN, explain, table_aliases, unquote
+
+# Queries that must hit an unindexed column before it gets an index
+INDEX_SCAN_THRESHOLD = int(os.getenv('INDEX_SCAN_THRESHOLD', 3))
+# Cap on advisor-built indexes per table; every index slows down writes
+INDEX_MAX_PER_TABLE = int(os.getenv('INDEX_MAX_PER_TABLE', 8))
+# Columns with fewer distinct values per row than this are not worth indexing
+INDEX_MIN_SELECTIVITY = float(os.getenv('INDEX_MIN_SELECTIVITY', 0.001))
+INDEX_PREFIX = 'auto_ix_'
+ACTION_LOG_LIMIT = 100
+
+# id, customer_id, product_key, ... and camelCase customerId / CustomerID
+KEY_NAME_PATTERN = re.compile(r'^id$|_id$|_key$', re.IGNORECASE)
+CAMEL_KEY_PATTERN = re.compile(r'[a-z0-9](Id|ID)$')
+
+# column <op> literal/parameter; column-to-column comparisons are joins, not filters
+FILTER_PREDICATE = re.compile(
+    rf'(?:({IDENTIFIER})\.)?({IDENTIFIER})\s*'
+    r'(?:==|=|!=|<>|<=|>=|<|>|\s(?:NOT\s+)?(?:LIKE|GLOB|IN|BETWEEN)\s)\s*(?=[\'\d(?:@$-])',
+    re.IGNORECASE)
+
+def is_key_column(column):
+    """Whether a column name looks like a primary or foreign key"""
+    return bool(KEY_NAME_PATTERN.search(column) or CAMEL_KEY_PATTERN.search(column))
+
+def index_candidates(sql_query, plan, schema):
+    """Return {(table, column): reason} for columns an index would have helped.
+
+    `plan` is the detail column of EXPLAIN QUERY PLAN. A SEARCH through an
+    AUTOMATIC index means SQLite built a throwaway index on a join key for
+    this one query; a SCAN means a full table scan, which an index on one of
+    its literal filter columns could avoid.
+    """
+    tables = {name.lower(): name for name in schema}
+    aliases = table_aliases(sql_query)
+
+    def resolve(name):
+        return tables.get(aliases.get(name.lower(), name).lower())
+
+    def column_of(table, column):
+        matches = [col for col in schema[table]['columns'] if col.lower() == column.lower()]
+        return matches[0] if matches else None
+
+    candidates = {}
+    scanned = set()
+    for detail in plan:
+        match = PLAN_AUTOMATIC_INDEX.match(detail)
+        if match:
+            table = resolve(match.group(2) or match.group(1))
+            column = table and column_of(table, match.group(3).strip())
+            if column:
+                candidates[(table, column)] = 'join column: SQLite built an automatic index'
+            continue
+        match = PLAN_SCAN.match(detail)
+        if match:
+            table = resolve(match.group(2) or match.group(1))
+            if table:
+                scanned.add(table)
+
+    for qualifier, column in FILTER_PREDICATE.findall(sql_query):
+        column = unquote(column)
+        if qualifier:
+            table = resolve(unquote(qualifier))
+            owners = [table] if table in scanned else []
+        else:
+            owners = [table for table in scanned if column_of(table, column)]
+        if len(owners) == 1 and column_of(owners[0], column):
+            key = (owners[0], column_of(owners[0], column))
+            candidates.setdefault(key, 'filter column on a full table scan')
+    return candidates
+
+
+class IndexAdvisor:
+    """Builds indexes for uploaded tables and learns from executed queries.
+
+    At upload time, columns named like keys (id, *_id, *Id, *_key) are
+    indexed unless they have too few distinct values to help. Afterwards
+    every executed query is checked with EXPLAIN QUERY PLAN, and columns that
+    keep needing an automatic index or filter a full table scan are indexed
+    once seen INDEX_SCAN_THRESHOLD times. Every decision is recorded in the
+    index_advisor_log table.
+    """
+
+    def __init__(self):
+        self._observations = Counter()
+        self._decided = set()
+        self._lock = threading.Lock()
+        # One background builder: index builds queue behind each other anyway
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index-builder')
+
+    def _indexed_columns(self, conn, table_name):
+        """Leading columns of the existing indexes on a table"""
+        leading = set()
+        for index in conn.execute(f"PRAGMA index_list({quote_identifier(table_name)})").fetchall():
+            columns = conn.execute(f"PRAGMA index_info({quote_identifier(index[1])})").fetchall()
+            if columns:
+                leading.add(min(columns)[2])
+        return leading
+
+    def _column_stats(self, table_name, columns):
+        """Return (row_count, {column: (non_null, distinct)}) in one table pass"""
+        parts = ["COUNT(*)"]
+        for column in columns:
+            quoted = quote_identifier(column)
+            parts.append(f"COUNT({quoted}), COUNT(DISTINCT {quoted})")
+        with get_database().reader() as conn:
+            row = conn.execute(f"SELECT {', '.join(parts)} FROM {quote_identifier(table_name)}").fetchone()
+        return row[0], {column: (row[1 + 2 * i], row[2 + 2 * i]) for i, column in enumerate(columns)}
+
+    def _build(self, table_name, column, source, reason, row_count, distinct):
+        """Create one index unless it exists or would not help; log the outcome"""
+        index_name = f"{INDEX_PREFIX}{table_name}_{column}"
+        start = time.perf_counter()
+        with get_database().writer() as conn:
+            advisor_indexes = conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name LIKE ?",
+                (table_name, INDEX_PREFIX + '%')).fetchone()[0]
+            if column in self._indexed_columns(conn, table_name):
+                status = 'exists'
+            elif distinct < 2 or distinct < row_count * INDEX_MIN_SELECTIVITY:
+                status, reason = 'skipped', f"{reason}; too few distinct values"
+            elif advisor_indexes >= INDEX_MAX_PER_TABLE:
+                status, reason = 'skipped', f"{reason}; table already has {advisor_indexes} advisor indexes"
+            else:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)} "
+                             f"ON {quote_identifier(table_name)} ({quote_identifier(column)})")
+                status = 'created'
+            build_ms = round((time.perf_counter() - start) * 1000, 1)
+            conn.execute('''
+            INSERT INTO index_advisor_log
+            (table_name, column_name, index_name, source, reason, status, row_count, distinct_count, build_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (table_name, column, index_name if status == 'created' else None, source, reason,
+                  status, row_count, distinct, build_ms))
+        print(f"Index advisor: {status} index on {table_name}.{column} ({reason}, {build_ms} ms)")
+        return {
+            'table': table_name,
+            'column': column,
+            'index': index_name if status == 'created' else None,
+            'status': status,
+            'reason': reason,
+            'build_ms': build_ms
+        }
+
+    def index_uploaded_table(self, table_name):
+        """Index the key-like columns of a freshly uploaded table"""
+        # A replaced table starts over: its old indexes were dropped with it
+        with self._lock:
+            for key in [key for key in self._observations if key[0] == table_name]:
+                del self._observations[key]
+            self._decided = {key for key in self._decided if key[0] != table_name}
+
+        info = schema_catalog.get_schema().get(table_name)
+        candidates = [column for column in (info or {}).get('columns', []) if is_key_column(column)]
+        if not candidates:
+            return []
+        row_count, stats = self._column_stats(table_name, candidates)
+        actions = []
+        for column in candidates:
+            non_null, distinct = stats[column]
+            if non_null and distinct == non_null == row_count:
+                reason = 'key column: every value is unique'
+            else:
+                reason = f'foreign key column: {distinct} distinct values'
+            actions.append(self._build(table_name, column, 'upload', reason, row_count, distinct))
+        return actions
+
+    def observe_query(self, sql_query):
+        """Record which columns an executed query needed an index on.
+
+        Columns reaching INDEX_SCAN_THRESHOLD are indexed in the background.
+        Never raises: a query the advisor cannot analyse is simply ignored.
+        """
+        try:
+            with get_database().reader() as conn:
+                plan = [detail for _, _, detail in explain(conn, sql_query)]
+            candidates = index_candidates(sql_query, plan, schema_catalog.get_schema())
+        except Exception as e:
+            print(f"Index advisor could not analyse query: {str(e)}")
+            return []
+
+        ready = []
+        with self._lock:
+            for key, reason in candidates.items():
+                if key in self._decided:
+                    continue
+                self._observations[key] += 1
+                if self._observations[key] >= INDEX_SCAN_THRESHOLD:
+                    self._decided.add(key)
+                    del self._observations[key]
+                    ready.append((key, reason))
+        for (table_name, column), reason in ready:
+            self._builder.submit(contextvars.copy_context().run, self._build_observed, table_name, column, reason)
+        return [key for key, _ in ready]
+
+    def _build_observed(self, table_name, column, reason):
+        try:
+            row_count, stats = self._column_stats(table_name, [column])
+            self._build(table_name, column, 'query', reason, row_count, stats[column][1])
+        except Exception as e:
+            print(f"Index advisor failed to index {table_name}.{column}: {str(e)}")
+
+    def report(self):
+        """Current indexes, recent advisor actions and pending observations"""
+        with get_database().reader() as conn:
+            indexes = conn.execute('''
+            SELECT tbl_name, name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL
+            ORDER BY tbl_name, name
+            ''').fetchall()
+            actions = conn.execute('''
+            SELECT table_name, column_name, index_name, source, reason, status,
+                   row_count, distinct_count, build_ms, created_at
+            FROM index_advisor_log
+            ORDER BY id DESC
+            LIMIT ?
+            ''', (ACTION_LOG_LIMIT,)).fetchall()
+        with self._lock:
+            observations = sorted(self._observations.items(), key=lambda item: -item[1])
+        return {
+            'indexes': [{'table': row[0], 'name': row[1], 'sql': row[2]} for row in indexes],
+            'actions': [
+                dict(zip(('table', 'column', 'index', 'source', 'reason', 'status',
+                          'row_count', 'distinct_count', 'build_ms', 'created_at'), row))
+                for row in actions
+            ],
+            'observations': [
+                {'table': table_name, 'column': column, 'count': count}
+                for (table_name, column), count in observations
+            ],
+            'threshold': INDEX_SCAN_THRESHOLD
+        }
+
+
+index_advisor = WorkspaceLocal(lambda workspace: IndexAdvisor())
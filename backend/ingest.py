@@ -0,0 +1,169 @@
+import os
+import time
+import itertools
+import pandas as pd
+from database import get_table_metadata, quote_identifier, schema_catalog
+from db import get_database
+from engines import get_engine
+from index_advisor import index_advisor, is_key_column
+from metrics import metrics
+from schema_index import schema_index
+from column_profiles import column_profiles
+from file_readers import COLUMNAR_FORMATS, EXCEL_EXTENSIONS, arrow_frames, excel_sheets
+
+# Rows parsed per chunk; bounds peak memory of an upload regardless of file size
+CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', 50000))
+
+def ingestion_stats(rows, num_bytes, seconds):
+    """Build the throughput report returned by the upload endpoints"""
+    seconds = max(seconds, 1e-9)
+    return {
+        'rows': rows,
+        'bytes': num_bytes,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(rows / seconds, 1),
+        'bytes_per_sec': round(num_bytes / seconds, 1)
+    }
+
+def parse_key_columns(value):
+    """Split a declared key ("order_id" or "order_id,product_id") into column names"""
+    return [col.strip() for col in (value or '').split(',') if col.strip()] or None
+
+def _is_unique(table_name, column, first):
+    """Whether a column has no repeated values, in the upload and in the existing table"""
+    values = first[column].dropna()
+    if len(values) != len(first) or not values.is_unique:
+        return False
+    if table_name not in schema_catalog.table_names():
+        return True
+    quoted = quote_identifier(column)
+    with get_database().reader() as conn:
+        total, distinct = conn.execute(
+            f"SELECT COUNT({quoted}), COUNT(DISTINCT {quoted}) FROM {quote_identifier(table_name)}").fetchone()
+    return total == distinct
+
+def resolve_key_columns(table_name, first, declared=None):
+    """Pick the upsert key: the declared one, the table's previous key, or a detected one.
+
+    Detection takes the first key-like column (id, *_id, *Id, *_key) whose
+    values are unique in both the first chunk and the existing table.
+    """
+    if declared:
+        return declared
+    metadata = get_table_metadata(table_name)
+    if metadata and metadata['key_columns']:
+        return metadata['key_columns']
+    for column in first.columns:
+        if is_key_column(str(column)) and _is_unique(table_name, column, first):
+            return [column]
+    raise ValueError(f"No unique key column found for upserting into {table_name}; "
+                     "declare one with the 'key' parameter")
+
+def _timed(chunks, timer):
+    """Pass chunks through, adding the time spent producing them (parsing) to timer[0]"""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        timer[0] += time.perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+def load_chunks(table_name, chunks, mode='replace', key_columns=None, file_format='csv'):
+    """Write chunks with the current engine, resolving the upsert key from the first chunk"""
+    # Parsing and writing interleave chunk by chunk, so they are timed apart
+    parse_seconds = [0.0]
+    chunks = _timed(chunks, parse_seconds)
+    start = time.perf_counter()
+    if mode == 'upsert':
+        first = next(chunks, None)
+        if first is not None:
+            key_columns = resolve_key_columns(table_name, first, key_columns)
+            chunks = itertools.chain([first], chunks)
+    created = table_name not in schema_catalog.table_names()
+    write = get_engine().load_table(table_name, chunks, mode, key_columns)
+    metrics.stage_seconds.observe(parse_seconds[0], pipeline='upload', stage='parse')
+    metrics.stage_seconds.observe(time.perf_counter() - start - parse_seconds[0], pipeline='upload', stage='write')
+    metrics.upload_rows.inc(write['rows'], format=file_format, mode=mode)
+    # Appends keep the table and its indexes; only new tables get indexed
+    with metrics.span('upload', 'index'):
+        write['indexes'] = index_advisor.index_uploaded_table(table_name) if mode == 'replace' or created else []
+    with metrics.span('upload', 'profile'):
+        column_profiles.profile_table(table_name)
+    with metrics.span('upload', 'schema_index'):
+        schema_index.refresh(table_name)
+    return write
+
+def upload_report(write, num_bytes, seconds):
+    """Throughput stats of an upload merged with its write stats"""
+    stats = ingestion_stats(write.pop('rows'), num_bytes, seconds)
+    stats.update(write)
+    return stats
+
+def ingest_csv(file, table_name, chunksize=None, mode='replace', key_columns=None):
+    """Stream an uploaded CSV into table_name in bounded chunks.
+
+    mode is 'replace', 'append' or 'upsert' (see write_table_from_chunks).
+    """
+    stream = getattr(file, 'stream', file)
+    start = time.perf_counter()
+
+    with pd.read_csv(stream, chunksize=chunksize or CSV_CHUNK_SIZE) as reader:
+        write = load_chunks(table_name, reader, mode, key_columns, 'csv')
+
+    elapsed = time.perf_counter() - start
+    metrics.stage_seconds.observe(elapsed, pipeline='upload', stage='total')
+    stats = upload_report(write, stream.tell(), elapsed)
+    print(f"Ingested {stats['rows']} rows into {table_name} ({mode}: {stats['inserted']} inserted, "
+          f"{stats['updated']} updated; {stats['rows_per_sec']} rows/s, {stats['bytes_per_sec']} bytes/s)")
+    return stats
+
+def ingest_columnar(file, table_name, file_format, chunksize=None, mode='replace', key_columns=None):
+    """Stream an uploaded Parquet or Arrow file into table_name in bounded chunks"""
+    stream = getattr(file, 'stream', file)
+    start = time.perf_counter()
+
+    frames = arrow_frames(stream, file_format, chunksize or CSV_CHUNK_SIZE)
+    write = load_chunks(table_name, frames, mode, key_columns, file_format)
+
+    elapsed = time.perf_counter() - start
+    metrics.stage_seconds.observe(elapsed, pipeline='upload', stage='total')
+    stats = upload_report(write, stream.seek(0, os.SEEK_END), elapsed)
+    print(f"Ingested {stats['rows']} rows from {file_format} into {table_name} ({mode}: "
+          f"{stats['inserted']} inserted, {stats['updated']} updated; "
+          f"{stats['rows_per_sec']} rows/s, {stats['bytes_per_sec']} bytes/s)")
+    return stats
+
+def ingest_excel(file, base_name, chunksize=None, mode='replace', key_columns=None):
+    """Stream every sheet of an uploaded .xlsx workbook into its own table.
+
+    Rows are read with openpyxl in read-only mode and written in bounded
+    chunks through the same path as CSV uploads; empty sheets are skipped.
+    """
+    stream = getattr(file, 'stream', file)
+    start = time.perf_counter()
+    num_bytes = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+
+    sheets = []
+    for sheet_name, table_name, frames in excel_sheets(stream, base_name, chunksize or CSV_CHUNK_SIZE):
+        first = next(frames, None)
+        if first is None:
+            print(f"Skipping empty sheet {sheet_name}")
+            continue
+        sheet_start = time.perf_counter()
+        write = load_chunks(table_name, itertools.chain([first], frames), mode, key_columns, 'excel')
+        stats = upload_report(write, 0, time.perf_counter() - sheet_start)
+        del stats['bytes'], stats['bytes_per_sec']
+        sheets.append({'sheet': sheet_name, 'table': table_name, **stats})
+        print(f"Ingested {stats['rows']} rows from sheet {sheet_name} into {table_name} "
+              f"({mode}: {stats['inserted']} inserted, {stats['updated']} updated; {stats['rows_per_sec']} rows/s)")
+    if not sheets:
+        raise ValueError("The workbook has no sheets with data")
+
+    elapsed = time.perf_counter() - start
+    metrics.stage_seconds.observe(elapsed, pipeline='upload', stage='total')
+    stats = ingestion_stats(sum(sheet['rows'] for sheet in sheets), num_bytes, elapsed)
+    stats['sheets'] = sheets
+    return stats
@@ -0,0 +1,82 @@
+import os
+import asyncio
+import threading
+
+MODEL_NAME = 'gemini-2.0-flash'
+
+class GeminiBackend:
+    """Text generation through the Google Gemini API"""
+
+    def __init__(self, model_name=MODEL_NAME, api_key=None):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key or os.getenv('GEMINI_API_KEY'))
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self._model.generate_content(prompt).text
+
+    async def generate_async(self, prompt):
+        response = await self._model.generate_content_async(prompt)
+        return response.text
+
+    async def generate_stream_async(self, prompt):
+        response = await self._model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+
+class FakeBackend:
+    """Deterministic offline backend for tests and benchmarks.
+
+    `responses` maps a substring of the prompt to the text (or a callable
+    taking the prompt) that should be returned; the first match wins. Every
+    prompt is recorded in `calls`. `latency` (seconds) simulates a slow model.
+    """
+
+    def __init__(self, responses=None, default='', latency=0.0):
+        self.responses = dict(responses or {})
+        self.default = default
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self._lock:
+            self.calls.append(prompt)
+        for marker, response in self.responses.items():
+            if marker in prompt:
+                return response(prompt) if callable(response) else response
+        return self.default(prompt) if callable(self.default) else self.default
+
+    async def generate_async(self, prompt):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.generate(prompt)
+
+    async def generate_stream_async(self, prompt, chunk_words=4):
+        words = (await self.generate_async(prompt)).split(' ')
+        for start in range(0, len(words), chunk_words):
+            end = start + chunk_words
+            yield " ".join(words[start:end]) + (" " if end < len(words) else "")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Return the process-wide model backend, creating it on first use"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if os.getenv('LLM_BACKEND', 'gemini').lower() == 'fake':
+                _backend = FakeBackend()
+            else:
+                _backend = GeminiBackend()
+        return _backend
+
+def set_backend(backend):
+    """Swap the model backend (e.g. install a FakeBackend for offline runs)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
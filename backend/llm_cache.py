@@ -0,0 +1,173 @@
+import os
+import re
+import time
+import uuid
+import json
+import hashlib
+import threading
+from db import Database
+from query_plan import sql_tokens, table_aliases
+
+CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'llm_cache.db'))
+CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL', 24 * 60 * 60))
+CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 1000))
+# Hits whose last-used time is written back in one transaction
+TOUCH_BATCH_SIZE = 100
+
+# Filler words that do not change what a question asks for. Negations and
+# comparison words are deliberately absent.
+STOP_WORDS = {
+    'a', 'an', 'the', 'me', 'my', 'our', 'us', 'please', 'can', 'could', 'would',
+    'you', 'show', 'tell', 'give', 'list', 'display', 'find', 'get', 'what',
+    'which', 'is', 'are', 'was', 'were', 'of', 'for', 'in', 'on', 'to', 'do',
+    'does', 'i', 'want', 'see', 'know', 'let', 'all'
+}
+
+def normalize_question(question):
+    """Reduce a question to a canonical form (case, whitespace, punctuation, stop words)"""
+    words = re.findall(r'[a-z0-9_]+', question.lower())
+    return " ".join(word for word in words if word not in STOP_WORDS)
+
+def fingerprint(*parts):
+    """Stable hash of the given key parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def tables_in_sql(sql, table_names):
+    """Return the known tables a SQL statement reads from (FROM and JOIN clauses).
+
+    Aliases, columns and string literals that happen to share a table's
+    name do not count.
+    """
+    # Blank out literals and comments so "... = 'from orders'" is not a reference
+    code = " ".join("''" if token.startswith("'") else token for token, _, _ in sql_tokens(sql))
+    referenced = {table.lower() for table in table_aliases(code).values()}
+    return sorted(name for name in table_names if name.lower() in referenced)
+
+class LLMCache:
+    """Persistent LRU/TTL cache for model responses.
+
+    Entries live in a small SQLite file so they survive restarts. Each entry
+    records the tables it was derived from; invalidate_table() removes those
+    entries and bumps the table's stamp, so results computed against the old
+    data can no longer be keyed.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = Database(path)
+        self._touched = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        with self._db.writer() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                response TEXT NOT NULL,
+                tables TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS table_stamps (
+                table_name TEXT PRIMARY KEY,
+                stamp TEXT NOT NULL
+            )
+            ''')
+
+    def data_fingerprint(self, tables):
+        """Fingerprint of the current data version of the given tables"""
+        if not tables:
+            return ''
+        with self._db.reader() as conn:
+            placeholders = ", ".join("?" for _ in tables)
+            stamps = dict(conn.execute(
+                f"SELECT table_name, stamp FROM table_stamps WHERE table_name IN ({placeholders})",
+                list(tables)).fetchall())
+        return fingerprint(*(f"{name}={stamps.get(name, '')}" for name in sorted(tables)))
+
+    def get(self, key):
+        """The cached response for key, or None.
+
+        Lookups only read; the last-used times of hits are written back in
+        batches (and before every eviction), and expired entries are removed
+        by put().
+        """
+        now = time.time()
+        with self._db.reader() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None or now - row[1] > self.ttl:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self._touched[key] = now
+            flush = len(self._touched) >= TOUCH_BATCH_SIZE
+        if flush:
+            with self._lock, self._db.writer() as conn:
+                self._flush_touched(conn)
+        return row[0]
+
+    def _flush_touched(self, conn):
+        # Called with the lock and the writer held
+        if self._touched:
+            conn.executemany("UPDATE llm_cache SET last_used = ? WHERE key = ?",
+                             [(used, key) for key, used in self._touched.items()])
+            self._touched = {}
+
+    def put(self, key, kind, response, tables=()):
+        now = time.time()
+        with self._lock, self._db.writer() as conn:
+            self._flush_touched(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, kind, response, tables, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, response, json.dumps(sorted(tables)), now, now))
+            # Evict expired entries, then the least recently used beyond capacity
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            conn.execute('''
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+            ''', (self.max_entries,))
+
+    def invalidate_table(self, table_name, schema_changed=True):
+        """Drop entries derived from table_name and give it a new data stamp.
+
+        When only the rows changed, generated SQL stays valid (its key covers
+        the schema) and just the explanations of old results are dropped.
+        """
+        kinds = None if schema_changed else ('explanation',)
+        with self._lock, self._db.writer() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO table_stamps (table_name, stamp) VALUES (?, ?)",
+                (table_name, uuid.uuid4().hex))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE EXISTS "
+                "(SELECT 1 FROM json_each(llm_cache.tables) WHERE value = ?)"
+                + (" AND kind IN (" + ", ".join("?" for _ in kinds) + ")" if kinds else ""),
+                (table_name, *(kinds or ())))
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock, self._db.writer() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def get_stats(self):
+        with self._lock, self._db.reader() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'entries': entries,
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,175 @@
+"""Load test for the /query pipeline against a local stub model server.
+
+    python loadtest.py --requests 200 --threads 8 --latency 0.5
+
+Starts an HTTP server that imitates the model (fixed latency, canned SQL and
+explanations), loads the sample dataset into a scratch database and then
+fires the same batch of distinct questions two ways:
+
+* threaded: the Flask /query route on a pool of --threads worker threads,
+  i.e. the classic one-request-per-thread deployment;
+* async: the ASGI application, all requests in flight on one event loop.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import tempfile
+import threading
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dummy_data_DataChat_AI', 'sample_data_2')
+CANNED_SQL = "SELECT product_id, SUM(quantity) AS units_sold FROM orders GROUP BY product_id ORDER BY units_sold DESC"
+CANNED_EXPLANATION = "Units sold per product, highest first."
+
+
+class StubModelServer:
+    """Tiny asyncio HTTP server answering POST {"prompt": ...} with {"text": ...}"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+
+    async def _handle(self, reader, writer):
+        headers = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1').lower()
+        length = int(headers.split('content-length:')[1].split('\r\n')[0])
+        prompt = json.loads(await reader.readexactly(length))['prompt']
+        await asyncio.sleep(self.latency)
+        text = CANNED_SQL if 'Write a SQL query' in prompt else CANNED_EXPLANATION
+        body = json.dumps({'text': text}).encode('utf-8')
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+        await writer.drain()
+        writer.close()
+
+    def start(self):
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, '127.0.0.1', 0, backlog=4096))
+        self.port = server.sockets[0].getsockname()[1]
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.port}/generate"
+
+
+class StubServerBackend:
+    """Model backend that calls the stub server over HTTP"""
+
+    def __init__(self, url):
+        self.url = url
+        self.host, port_path = url.split('://')[1].split(':')
+        self.port = int(port_path.split('/')[0])
+
+    def generate(self, prompt):
+        request = urllib.request.Request(self.url, json.dumps({'prompt': prompt}).encode('utf-8'),
+                                         {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())['text']
+
+    async def generate_async(self, prompt):
+        body = json.dumps({'prompt': prompt}).encode('utf-8')
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(b"POST /generate HTTP/1.1\r\nHost: stub\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return json.loads(response.partition(b"\r\n\r\n")[2])['text']
+
+
+def summarize(label, latencies, elapsed, statuses):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return {
+        'mode': label,
+        'requests': len(latencies),
+        'ok': sum(1 for status in statuses if status == 200),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(p95 * 1000, 1),
+    }
+
+
+def run_threaded(app, questions, threads):
+    client = app.test_client()
+
+    def one(question):
+        start = time.perf_counter()
+        response = client.post('/query', json={'question': question})
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, questions))
+    return summarize(f'threaded ({threads} threads)', [r[0] for r in results],
+                     time.perf_counter() - start, [r[1] for r in results])
+
+
+async def run_async(application, questions):
+    async def one(question):
+        body = json.dumps({'question': question}).encode('utf-8')
+        scope = {'type': 'http', 'method': 'POST', 'path': '/query', 'headers': []}
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        start = time.perf_counter()
+        await application(scope, receive, send)
+        return time.perf_counter() - start, sent[0]['status']
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(q) for q in questions))
+    return summarize('async (1 event loop)', [r[0] for r in results],
+                     time.perf_counter() - start, [r[1] for r in results])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.5, help='stub model latency (s)')
+    args = parser.parse_args()
+
+    # Scratch database and cache; must be configured before the app is imported
+    workdir = tempfile.mkdtemp(prefix='datachat-loadtest-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'data.db')
+    os.environ['LLM_CACHE_PATH'] = os.path.join(workdir, 'llm_cache.db')
+    os.environ.setdefault('LLM_MAX_CONCURRENCY', str(args.requests))
+
+    from llm import set_backend
+    from database import init_database
+    from ingest import ingest_csv
+    from app import app
+    from asgi import application
+
+    # Keep stdout for the JSON report; the app's progress prints go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        set_backend(StubServerBackend(StubModelServer(args.latency).start()))
+        init_database()
+        for name in sorted(os.listdir(SAMPLE_DIR)):
+            with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+                ingest_csv(f, os.path.splitext(name)[0])
+
+        # Distinct questions so the response cache never short-circuits the model
+        threaded = run_threaded(app, [f"units sold per product run a {i}"
+                                      for i in range(args.requests)], args.threads)
+        concurrent = asyncio.run(run_async(application, [f"units sold per product run b {i}"
+                                                         for i in range(args.requests)]))
+    json.dump({'latency_s': args.latency, 'results': [threaded, concurrent]}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import os
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'datachat_'
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Upper bounds (estimated tokens) of the prompt size histogram buckets
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+# Recent observations per series that the p50/p95/p99 estimates are taken over
+QUANTILE_WINDOW = int(os.getenv('METRICS_QUANTILE_WINDOW', 1000))
+QUANTILES = (0.5, 0.95, 0.99)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    """Bucketed distribution per label combination, plus recent quantiles.
+
+    Rendered twice: as a Prometheus histogram (aggregatable across
+    processes) and as a summary `<name>_recent` with p50/p95/p99 over the last
+    QUANTILE_WINDOW observations, readable without a Prometheus server.
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0,
+                    'recent': deque(maxlen=QUANTILE_WINDOW)
+                }
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+            series['recent'].append(value)
+
+    def quantiles(self, **labels):
+        """{0.5: ..., 0.95: ..., 0.99: ...} over the recent observations of one series"""
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            recent = sorted(self._series[key]['recent']) if key in self._series else []
+        return self._quantiles(recent)
+
+    def _quantiles(self, ordered):
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+    def render(self):
+        with self._lock:
+            series = sorted(
+                (key, list(s['buckets']), s['sum'], s['count'], sorted(s['recent']))
+                for key, s in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, buckets, total, count, _ in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(float(bound)))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+
+        recent_name = f"{self.name}_recent"
+        lines += [f"# HELP {recent_name} {self.help} (last {QUANTILE_WINDOW} observations)",
+                  f"# TYPE {recent_name} summary"]
+        for key, _, _, _, recent in series:
+            for q, value in self._quantiles(recent).items():
+                lines.append(f"{recent_name}{_labels(self.labelnames, key, [('quantile', q)])} {_number(value)}")
+            lines.append(f"{recent_name}_sum{_labels(self.labelnames, key)} {_number(float(sum(recent)))}")
+            lines.append(f"{recent_name}_count{_labels(self.labelnames, key)} {len(recent)}")
+        return lines
+
+
+class Metrics:
+    """Process-wide metrics, served in Prometheus text format at /metrics.
+
+    Pipeline code times its stages with span(); values owned by other
+    components (cache sizes, governor outcomes) are read at scrape time
+    through collectors registered with add_collector().
+    """
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            'stage_duration_seconds', 'Time spent in each stage of the query and upload pipelines',
+            ('pipeline', 'stage'))
+        self.llm_calls = Counter('llm_calls_total', 'Model calls by purpose', ('kind',))
+        self.llm_tokens = Counter(
+            'llm_tokens_total', 'Estimated model tokens by purpose and direction', ('kind', 'direction'))
+        self.prompt_tokens = Histogram(
+            'llm_prompt_tokens', 'Estimated size of each model prompt by purpose', ('kind',), TOKEN_BUCKETS)
+        self.cache_lookups = Counter(
+            'llm_cache_lookups_total', 'LLM cache lookups by entry kind and result', ('kind', 'result'))
+        self.upload_rows = Counter('upload_rows_total', 'Rows received by uploads', ('format', 'mode'))
+        self.sql_validations = Counter(
+            'sql_validations_total', 'Generated SQL checked before execution, by outcome', ('outcome',))
+        self.sql_repairs = Counter('sql_repairs_total', 'Local fixes applied to generated SQL by kind', ('kind',))
+        self._families = [self.stage_seconds, self.llm_calls, self.llm_tokens, self.prompt_tokens,
+                          self.cache_lookups, self.upload_rows, self.sql_validations, self.sql_repairs]
+        self._collectors = []
+
+    @contextmanager
+    def span(self, pipeline, stage):
+        """Time the block into stage_duration_seconds{pipeline, stage}"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, pipeline=pipeline, stage=stage)
+
+    def add_collector(self, collect):
+        """Register collect() -> [(name, type, help, {label_tuple: value}, labelnames)]"""
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for family in self._families:
+            lines += family.render()
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, metric_type, help_text, values, labelnames in families:
+                name = METRIC_PREFIX + name
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+                lines += [f"{name}{_labels(labelnames, key)} {_number(value)}"
+                          for key, value in sorted(values.items())]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
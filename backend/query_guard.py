@@ -0,0 +1,197 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from query_plan import PLAN_ANY_SCAN, explain, table_aliases
+from metrics import metrics
+
+# Per-query execution budgets for generated SQL
+QUERY_TIMEOUT_SECONDS = float(os.getenv('QUERY_TIMEOUT', 30))
+QUERY_MAX_VM_INSTRUCTIONS = int(os.getenv('QUERY_MAX_VM_INSTRUCTIONS', 5000000000))
+# Nested full scans whose row counts multiply past this are rejected up front
+QUERY_MAX_JOIN_ROWS = int(os.getenv('QUERY_MAX_JOIN_ROWS', 100000000))
+# SQLite calls the progress handler every this many VM instructions
+PROGRESS_INTERVAL = 100000
+COST_HISTORY = 200
+
+
+class QueryTooExpensive(Exception):
+    """Generated SQL was rejected or stopped for exceeding a budget.
+
+    `reason` is one of 'cross_join', 'timeout' or 'vm_budget'.
+    """
+
+    def __init__(self, reason, message, cost=None):
+        super().__init__(message)
+        self.reason = reason
+        self.cost = cost or {}
+
+    def to_dict(self):
+        return {
+            'error': 'Query too expensive',
+            'reason': self.reason,
+            'detail': str(self),
+            'cost': self.cost
+        }
+
+
+def _estimated_rows(conn, table_name):
+    # MAX(rowid) is an O(log n) stand-in for COUNT(*) on append-only tables
+    quoted = '"' + table_name.replace('"', '""') + '"'
+    try:
+        return conn.execute(f"SELECT MAX(rowid) FROM {quoted}").fetchone()[0] or 0
+    except sqlite3.Error:
+        return 0
+
+
+class QueryGovernor:
+    """Budgets and cost accounting for generated SQL.
+
+    Before a query runs on SQLite its plan is checked for nested full table
+    scans (a cross join or a missing join predicate) whose estimated row
+    combinations exceed QUERY_MAX_JOIN_ROWS. While it runs, a progress handler
+    aborts it once it passes QUERY_TIMEOUT_SECONDS of wall-clock time or
+    QUERY_MAX_VM_INSTRUCTIONS virtual machine instructions. Either way the
+    caller gets a QueryTooExpensive, and every query's cost is recorded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=COST_HISTORY)
+        self._statuses = Counter()
+
+    def check_plan(self, conn, sql_query):
+        """Return plan statistics, raising QueryTooExpensive for runaway joins"""
+        aliases = table_aliases(sql_query)
+        scans_by_parent = {}
+        for _, parent, detail in explain(conn, sql_query):
+            match = PLAN_ANY_SCAN.match(detail)
+            if match:
+                name = match.group(2) or match.group(1)
+                scans_by_parent.setdefault(parent, []).append(aliases.get(name.lower(), name))
+
+        full_scans = sum(len(tables) for tables in scans_by_parent.values())
+        worst_rows, worst_tables = 0, []
+        # Sibling full scans in one plan loop are nested: their row counts multiply
+        for tables in scans_by_parent.values():
+            if len(tables) < 2:
+                continue
+            rows = 1
+            for table_name in tables:
+                rows *= max(_estimated_rows(conn, table_name), 1)
+            if rows > worst_rows:
+                worst_rows, worst_tables = rows, tables
+        stats = {'full_scans': full_scans, 'estimated_join_rows': worst_rows}
+        if worst_rows > QUERY_MAX_JOIN_ROWS:
+            raise QueryTooExpensive(
+                'cross_join',
+                f"Joining {' x '.join(worst_tables)} without a usable join condition would "
+                f"visit about {worst_rows:,} row combinations (limit {QUERY_MAX_JOIN_ROWS:,})",
+                stats)
+        return stats
+
+    def _record(self, cost):
+        with self._lock:
+            self._recent.append(cost)
+            self._statuses[cost['status']] += 1
+
+    @contextmanager
+    def _measure(self, engine, sql_query):
+        cost = {'engine': engine, 'sql': sql_query[:500], 'status': 'ok', 'started_at': time.time()}
+        start = time.perf_counter()
+        try:
+            yield cost
+        except QueryTooExpensive as e:
+            cost.update(e.cost, status=e.reason)
+            e.cost = cost
+            raise
+        except Exception:
+            cost['status'] = 'error'
+            raise
+        finally:
+            cost['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            self._record(cost)
+
+    @contextmanager
+    def sqlite_limits(self, conn, sql_query):
+        """Check the plan, then run the block under the SQLite budgets.
+
+        Yields the cost dict; the caller may add fields such as 'rows'.
+        """
+        with self._measure('sqlite', sql_query) as cost:
+            cost.update(self.check_plan(conn, sql_query))
+            deadline = time.perf_counter() + QUERY_TIMEOUT_SECONDS
+            max_calls = QUERY_MAX_VM_INSTRUCTIONS // PROGRESS_INTERVAL
+            calls, stopped = 0, None
+
+            def progress():
+                nonlocal calls, stopped
+                calls += 1
+                if calls > max_calls:
+                    stopped = 'vm_budget'
+                elif time.perf_counter() > deadline:
+                    stopped = 'timeout'
+                return stopped is not None
+
+            conn.set_progress_handler(progress, PROGRESS_INTERVAL)
+            try:
+                yield cost
+            except Exception as e:
+                # sqlite3 reports 'interrupted'; pandas re-wraps it in its own error type
+                if stopped == 'timeout':
+                    raise QueryTooExpensive(
+                        'timeout', f"The query ran longer than {QUERY_TIMEOUT_SECONDS:g} seconds") from e
+                if stopped == 'vm_budget':
+                    raise QueryTooExpensive(
+                        'vm_budget', f"The query needed more than {QUERY_MAX_VM_INSTRUCTIONS:,} "
+                                     "SQLite VM instructions") from e
+                raise
+            finally:
+                conn.set_progress_handler(None, 0)
+                cost['vm_instructions'] = calls * PROGRESS_INTERVAL
+
+    @contextmanager
+    def timeout_limits(self, engine, interrupt, sql_query, interrupted_error):
+        """Run the block under QUERY_TIMEOUT_SECONDS for engines without a progress hook.
+
+        interrupt() is called from a timer thread when the budget runs out;
+        the resulting interrupted_error exception becomes QueryTooExpensive.
+        """
+        with self._measure(engine, sql_query) as cost:
+            timer = threading.Timer(QUERY_TIMEOUT_SECONDS, interrupt)
+            timer.daemon = True
+            timer.start()
+            try:
+                yield cost
+            except interrupted_error as e:
+                raise QueryTooExpensive(
+                    'timeout', f"The query ran longer than {QUERY_TIMEOUT_SECONDS:g} seconds") from e
+            finally:
+                timer.cancel()
+
+    def collect_metrics(self):
+        """Query outcome counts for the /metrics endpoint"""
+        with self._lock:
+            statuses = {(status,): count for status, count in self._statuses.items()}
+        return [('queries_total', 'counter', 'Generated queries run, by governor outcome', statuses, ('status',))]
+
+    def report(self):
+        """Budgets, outcome counts and the most recent query costs"""
+        with self._lock:
+            recent = list(self._recent)
+            statuses = dict(self._statuses)
+        return {
+            'limits': {
+                'timeout_seconds': QUERY_TIMEOUT_SECONDS,
+                'max_vm_instructions': QUERY_MAX_VM_INSTRUCTIONS,
+                'max_join_rows': QUERY_MAX_JOIN_ROWS
+            },
+            'statuses': statuses,
+            'recent': recent[::-1]
+        }
+
+
+query_governor = QueryGovernor()
+metrics.add_collector(query_governor.collect_metrics)
@@ -0,0 +1,587 @@
+import os
+import time
+import uuid
+import asyncio
+import weakref
+import threading
+import contextvars
+from database import schema_catalog
+from schema_catalog import prompt_tables
+from db import DEFAULT_WORKSPACE, current_workspace
+from gemini_service import is_valid_query
+from llm import get_backend
+from llm_cache import LLMCache, normalize_question, fingerprint, tables_in_sql
+from result_summary import summarize_result, estimate_tokens
+from result_format import format_frame
+from result_store import ResultExpired
+from index_advisor import index_advisor
+from engines import get_engine
+from query_guard import QueryTooExpensive
+from metrics import metrics
+from schema_index import schema_index
+from aggregate_cache import aggregate_cache
+from conversation_store import conversation_history, clean_session_id
+from sql_validator import InvalidSQL, sql_validator
+
+# Upper bound on in-flight model calls per event loop, and per-call timeout
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 32))
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT', 60))
+
+# Rows per 'rows' event when streaming results
+ROW_BATCH_SIZE = int(os.getenv('ROW_BATCH_SIZE', 500))
+# Leading rows of a large result that the explanation summary is computed from
+SUMMARY_ROW_LIMIT = int(os.getenv('SUMMARY_ROW_LIMIT', 50000))
+# LOG_LEVEL=DEBUG prints every full prompt; otherwise only their sizes
+LOG_PROMPTS = os.getenv('LOG_LEVEL', 'INFO').upper() == 'DEBUG'
+
+# Cache of generated SQL and explanations; replaced tables invalidate their entries
+llm_cache = LLMCache()
+
+def cache_tables(tables):
+    """Table names as the LLM cache records them: workspaces share the cache, not their tables"""
+    workspace = current_workspace()
+    if workspace == DEFAULT_WORKSPACE:
+        return list(tables)
+    return [f"{workspace}/{table_name}" for table_name in tables]
+
+schema_catalog.add_listener(
+    lambda table_name, changed: llm_cache.invalidate_table(cache_tables([table_name])[0], changed))
+
+def _cache_metrics():
+    stats = llm_cache.get_stats()
+    return [('llm_cache_entries', 'gauge', 'Entries in the LLM cache', {(): stats['entries']}, ()),
+            ('llm_cache_invalidations_total', 'counter', 'Tables whose LLM cache entries were invalidated',
+             {(): stats['invalidations']}, ())]
+
+metrics.add_collector(_cache_metrics)
+
+_semaphores = weakref.WeakKeyDictionary()
+
+def run_in_thread(func, *args):
+    """Run func in the loop's default executor, in the caller's workspace"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+# Jobs started with run_in_background, referenced until they finish
+_background_jobs = set()
+
+def run_in_background(func, *args):
+    """Start func like run_in_thread without waiting for it; failures are logged"""
+    future = run_in_thread(func, *args)
+    _background_jobs.add(future)
+
+    def done(future):
+        _background_jobs.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Background {func.__name__} failed: {str(future.exception())}")
+
+    future.add_done_callback(done)
+    return future
+
+def _model_semaphore():
+    # asyncio primitives are bound to one event loop, so keep one per loop
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return semaphore
+
+_background_loop = None
+_background_lock = threading.Lock()
+
+def run_sync(coro):
+    """Run a pipeline coroutine from synchronous (WSGI) code.
+
+    All sync callers share one long-lived event loop in a daemon thread, so
+    loop-bound clients and the model semaphore are reused across requests.
+    """
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, daemon=True,
+                             name='query-pipeline-loop').start()
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop).result()
+
+def iterate_sync(agen):
+    """Iterate an async generator from synchronous code via run_sync()"""
+    try:
+        while True:
+            yield run_sync(agen.__anext__())
+    except StopAsyncIteration:
+        pass
+    finally:
+        run_sync(agen.aclose())
+
+def log_prompt(label, prompt):
+    """Log a prompt's size, and the prompt itself at LOG_LEVEL=DEBUG"""
+    print(f"{label} prompt: {len(prompt)} chars (~{estimate_tokens(prompt)} tokens)")
+    if LOG_PROMPTS:
+        print(prompt)
+
+def _count_tokens(kind, prompt, response):
+    prompt_tokens = estimate_tokens(prompt)
+    metrics.llm_calls.inc(kind=kind)
+    metrics.llm_tokens.inc(prompt_tokens, kind=kind, direction='prompt')
+    metrics.prompt_tokens.observe(prompt_tokens, kind=kind)
+    metrics.llm_tokens.inc(estimate_tokens(response), kind=kind, direction='completion')
+
+async def generate(prompt, kind='sql'):
+    """Call the model with bounded concurrency and a timeout"""
+    async with _model_semaphore():
+        with metrics.span('llm', kind):
+            response = await asyncio.wait_for(get_backend().generate_async(prompt), LLM_TIMEOUT_SECONDS)
+    _count_tokens(kind, prompt, response)
+    return response
+
+async def generate_stream(prompt, kind='explanation'):
+    """Yield model output chunks as they arrive; the timeout applies per chunk"""
+    backend = get_backend()
+    if not hasattr(backend, 'generate_stream_async'):
+        yield await generate(prompt, kind)
+        return
+    async with _model_semaphore():
+        parts = []
+        with metrics.span('llm', kind):
+            chunks = backend.generate_stream_async(prompt).__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), LLM_TIMEOUT_SECONDS)
+                except StopAsyncIteration:
+                    break
+                parts.append(chunk)
+                yield chunk
+        _count_tokens(kind, prompt, "".join(parts))
+
+def build_sql_prompt(question, schema_str, dialect_hint='', history=''):
+    """Prompt asking the model for a SQL query that answers the question.
+
+    history recaps earlier turns of the conversation for follow-up questions.
+    """
+    history_section = f"""
+            Earlier in this conversation (the question may refer to it):
+            {history}
+""" if history else ""
+    return f"""
+            Given these database tables and their structure:
+            {schema_str}
+{history_section}
+            Write a SQL query to answer this question: "{question}"
+
+            Analysis Guidelines:
+            1. Schema Analysis:
+               - Examine table relationships through foreign key columns
+               - Understand data types and their meaning:
+                 * Percentage fields (like discounts) are stored as numbers (e.g., 10 means 10%)
+                 * Price/monetary fields need decimal precision
+                 * Dates may need formatting
+               - Identify required tables and their relationships
+               - Notes after a column's type describe its stored values (ranges, date
+                 formats, common values); match filters and conversions to them
+
+            2. Data Operations:
+               - For calculations with percentages:
+                 * Always divide percentage values by 100
+                 * Example: 10% should be calculated as value/100
+                 * Use (1 - discount/100) for discount calculations
+               - For monetary calculations:
+                 * Use ROUND() for consistent decimal places
+                 * Maintain proper calculation order
+               - For counting and aggregations:
+                 * Choose appropriate functions (SUM, AVG, COUNT)
+                 * Group results as needed
+                 * Use LEFT JOIN when counting from reference tables
+                 * Include all records from main entity
+                - For table relationships:
+                 * ALWAYS use LEFT JOIN from primary entity to preserve all records
+                 * Start FROM the table containing all records needed (e.g., customers for customer queries)
+                 * Chain additional LEFT JOINs for related data
+                 * Use COALESCE/IFNULL for NULL values (e.g., COALESCE(SUM(...), 0))
+                 * Show zero/empty values for missing data
+
+            3. Query Structure:
+              - Start with the main entity table
+              - Use LEFT JOIN (not regular JOIN) to preserve all records
+              - Apply filters in WHERE clause after joins
+              - Group by main entity identifiers
+              - Order results meaningfully
+
+            4. Result Formatting:
+               - Use clear column aliases
+               - Ensure proper ordering
+               - Format output for readability
+               - Include supporting metrics when:
+                 * Counting items (show the count)
+                 * Finding maximums (show the value)
+                 * Calculating totals (show the total)
+                 * Comparing data (show relevant measures)
+               - Name columns descriptively (e.g., number_of_orders instead of count)
+               - For empty results:
+                 * Return meaningful message instead of empty set
+                 * Show relevant thresholds or criteria
+                 * Indicate why no results were found
+               - Include all relevant information in results
+
+            Generate a focused SQL query that provides complete information to answer the question.
+            Return only the SQL query, no explanations.
+            {dialect_hint}
+            """
+
+def build_explanation_prompt(question, sql_query, result_summary):
+    """Prompt asking the model to explain a query result"""
+    return f"""
+            Based on the original question: "{question}"
+
+            And the SQL query used to retrieve the data: {sql_query}
+            
+            And the result data retrieved: {result_summary}
+
+            Provide a clear analysis that:
+            1. Directly answers the question with key insights and findings
+            2. Uses proper markdown formatting for better readability:
+               - Use bullet points for listing items
+               - Use tables for structured data when relevant
+               - Use bold and italics for emphasis
+            3. Formats numbers appropriately:
+               - Currency with ₹ and two decimal places
+               - Percentages with two decimal places
+               - Large numbers with comma separators
+            4. Provides relevant context or trends when helpful
+            
+            Keep the focus on answering the user's question clearly and concisely.
+            Only mention SQL or technical details if there's a specific issue that affects the results.
+            """
+
+def build_rewrite_prompt(question, schema_str, sql_query, problem, dialect_hint=''):
+    """Prompt asking the model for a cheaper version of a rejected query"""
+    return f"""
+            Given these database tables and their structure:
+            {schema_str}
+
+            This SQL query was written to answer the question "{question}":
+            {sql_query}
+
+            It was stopped because it is too expensive to run: {problem}
+
+            Rewrite it to answer the same question more cheaply:
+            - Join tables only through matching key columns (e.g. ON a.customer_id = b.customer_id)
+            - Never combine tables without a join condition
+            - Filter and aggregate large tables before joining them where possible
+            - Return only the rows and columns the answer needs
+
+            Return only the SQL query, no explanations.
+            {dialect_hint}
+            """
+
+def build_repair_prompt(question, sql_query, problem, dialect_hint=''):
+    """Prompt asking the model to fix a query that failed validation; only the error is sent"""
+    return f"""
+            This SQL query was written to answer the question "{question}":
+            {sql_query}
+
+            It cannot run: {problem}
+
+            Fix only that problem. Return a single read-only SELECT statement and nothing else.
+            {dialect_hint}
+            """
+
+def clean_sql(sql_query):
+    """Strip markdown code fences from a model response"""
+    return sql_query.replace('```sql', '').replace('```', '').strip()
+
+def check_question(question):
+    """Validate the question and load the prompt schema.
+
+    Returns (schema_str, None) on success or (None, (payload, status)) when
+    the question cannot be answered.
+    """
+    # Validate the question first
+    is_valid, error_message = is_valid_query(question)
+    if not is_valid:
+        return None, ({
+            'error': error_message,
+            'suggestion': "Try asking something like: 'What are the total sales?' or 'Show me orders from January 2024'"
+        }, 400)
+
+    # Get the cached prompt schema with error checking
+    try:
+        schema_str = schema_catalog.prompt_schema()
+    except Exception as e:
+        print(f"Error getting schema: {str(e)}")
+        return None, ({
+            'error': 'Database error',
+            'suggestion': 'There was an error accessing the database'
+        }, 500)
+
+    if not schema_str:
+        return None, ({
+            'error': 'No tables found in database',
+            'suggestion': 'Please upload some data files first'
+        }, 400)
+    return schema_str, None
+
+async def generate_sql(question, schema_str, engine, history=''):
+    """Return (sql_query, cache_key, cached) for the question"""
+    # The column hints in schema_str change with every append; the key only
+    # covers the structure of the prompt's tables, so cached SQL survives them
+    structure = schema_catalog.structure(prompt_tables(schema_str))
+    sql_cache_key = fingerprint('sql', normalize_question(question), fingerprint(structure), engine.name)
+    if history:
+        # A follow-up means something different after a different conversation
+        sql_cache_key = fingerprint(sql_cache_key, history)
+    sql_query = llm_cache.get(sql_cache_key)
+    metrics.cache_lookups.inc(kind='sql', result='miss' if sql_query is None else 'hit')
+    if sql_query is not None:
+        return sql_query, sql_cache_key, True
+
+    sql_prompt = build_sql_prompt(question, schema_str, engine.dialect_hint, history)
+    log_prompt('SQL', sql_prompt)
+    sql_query = clean_sql((await generate(sql_prompt, 'sql')).strip())
+    return sql_query, sql_cache_key, False
+
+async def rewrite_sql(question, schema_str, sql_query, problem, engine):
+    """Ask the model for a cheaper rewrite of a query the governor stopped"""
+    prompt = build_rewrite_prompt(question, schema_str, sql_query, problem, engine.dialect_hint)
+    log_prompt('Rewrite', prompt)
+    return clean_sql((await generate(prompt, 'rewrite')).strip())
+
+async def validate_sql(question, sql_query, engine):
+    """Check generated SQL before it runs: fix it locally, or ask the model once.
+
+    Returns the SQL to execute; raises InvalidSQL when the model's second
+    attempt is still not valid.
+    """
+    try:
+        with metrics.span('query', 'sql_validation'):
+            sql_query, repairs = sql_validator.validate(sql_query, engine.name)
+        metrics.sql_validations.inc(outcome='repaired' if repairs else 'valid')
+        return sql_query
+    except InvalidSQL as e:
+        print(f"Generated SQL is not valid ({e.reason}): {e}")
+        problem = str(e)
+    prompt = build_repair_prompt(question, sql_query, problem, engine.dialect_hint)
+    log_prompt('Repair', prompt)
+    sql_query = clean_sql((await generate(prompt, 'repair')).strip())
+    try:
+        with metrics.span('query', 'sql_validation'):
+            sql_query, _ = sql_validator.validate(sql_query, engine.name)
+    except InvalidSQL:
+        metrics.sql_validations.inc(outcome='rejected')
+        raise
+    metrics.sql_validations.inc(outcome='reprompted')
+    return sql_query
+
+async def explain(question, sql_query, result, tables, stream=False):
+    """Yield the explanation for a query result, reusing a cached one if possible.
+
+    With stream=True the text is yielded in chunks as the model produces it;
+    otherwise it arrives as a single chunk.
+    """
+    key = fingerprint('explanation', normalize_question(question), sql_query,
+                      llm_cache.data_fingerprint(cache_tables(tables)))
+    explanation = llm_cache.get(key)
+    metrics.cache_lookups.inc(kind='explanation', result='miss' if explanation is None else 'hit')
+    if explanation is not None:
+        yield explanation
+        return
+
+    # The model sees a bounded summary of the result, never every row
+    start = time.perf_counter()
+    try:
+        df = await run_in_thread(result.frame, SUMMARY_ROW_LIMIT)
+    except ResultExpired as e:
+        print(f"{e}; summarizing the first {len(result.preview)} rows only")
+        df = result.preview
+    result_summary = summarize_result(df, total_rows=result.row_count)
+    prompt = build_explanation_prompt(question, sql_query, result_summary)
+    print(f"Summarized {result.row_count} rows in {(time.perf_counter() - start) * 1000:.1f} ms")
+    log_prompt('Explanation', prompt)
+    if stream:
+        parts = []
+        async for chunk in generate_stream(prompt, 'explanation'):
+            parts.append(chunk)
+            yield chunk
+        explanation = "".join(parts)
+    else:
+        explanation = await generate(prompt, 'explanation')
+        yield explanation
+    llm_cache.put(key, 'explanation', explanation, cache_tables(tables))
+
+async def stream_answer(question, stream=True, session_id=None):
+    """Run the question -> SQL -> results -> explanation pipeline as events.
+
+    Yields dicts tagged by 'type': 'sql' first, then 'rows' (formatted
+    DataFrames, in batches of ROW_BATCH_SIZE when streaming), then
+    'explanation' text chunks and finally 'done'. Only the first
+    INITIAL_ROW_CAP rows are sent; 'done' carries the total row count and,
+    for larger results, the result_id to page through the rest via
+    /query/<result_id>/rows, plus the query's execution cost. Generated SQL
+    is validated and repaired locally before it runs; what cannot be fixed
+    locally goes back to the model once with just the error. SQL stopped by
+    the query governor is rewritten by the model once before giving up. A
+    failure at any stage yields a single 'error' event carrying the HTTP
+    status the non-streaming endpoint would use. Serialize events with
+    result_format.dumps().
+
+    Model calls are awaited and the query engine runs in a worker thread, so many
+    questions can be in flight on one event loop. Every stage is timed into
+    the stage_duration_seconds metric.
+
+    Answers are recorded in the conversation history under session_id (a
+    new one is created when it is missing and returned in 'done'), and a
+    follow-up question is shown a recap of the session's last turns.
+    Tables, caches and history are those of the current workspace.
+    """
+    session_id = clean_session_id(session_id) or uuid.uuid4().hex
+    events = _answer_events(question, stream, session_id)
+    with metrics.span('query', 'total'):
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+async def _answer_events(question, stream, session_id):
+    print(f"Processing question: {question}")
+    with metrics.span('query', 'validate'):
+        schema_str, error = check_question(question)
+    if error:
+        payload, status = error
+        yield {'type': 'error', 'status': status, **payload}
+        return
+    # Large workspaces only show the model the tables relevant to the question
+    with metrics.span('query', 'schema_retrieval'):
+        schema_str = schema_index.relevant_schema(question, schema_str)
+    with metrics.span('query', 'history'):
+        history = conversation_history.context(session_id, question)
+
+    sql_query = None
+    try:
+        # Generate SQL query using Gemini
+        engine = get_engine()
+        with metrics.span('query', 'sql_generation'):
+            sql_query, sql_cache_key, sql_cached = await generate_sql(question, schema_str, engine, history)
+        print("Generated SQL query:", sql_query)
+        # Unknown names, prose around the SQL and writes are caught here, not by the engine
+        validated = await validate_sql(question, sql_query, engine)
+        if validated != sql_query:
+            sql_query, sql_cached = validated, False
+
+        # Execute the query with error handling
+        try:
+            with metrics.span('query', 'sql_execution'):
+                result = await run_in_thread(aggregate_cache.execute, engine, sql_query)
+        except QueryTooExpensive as e:
+            # One retry with a rewrite; a second rejection is reported below
+            print(f"Query too expensive ({e.reason}): {e}; asking for a cheaper rewrite")
+            with metrics.span('query', 'sql_rewrite'):
+                sql_query = await rewrite_sql(question, schema_str, sql_query, str(e), engine)
+                sql_query = await validate_sql(question, sql_query, engine)
+            sql_cached = False
+            print("Rewritten SQL query:", sql_query)
+            with metrics.span('query', 'sql_execution'):
+                result = await run_in_thread(aggregate_cache.execute, engine, sql_query)
+        print(f"Query executed successfully on {engine.name}, row count:", result.row_count)
+        # Let the index advisor learn from the plan without delaying the answer
+        if engine.name == 'sqlite':
+            run_in_background(index_advisor.observe_query, sql_query)
+
+        # Only SQL that actually ran is worth reusing
+        tables = tables_in_sql(sql_query, schema_catalog.table_names())
+        if not sql_cached:
+            llm_cache.put(sql_cache_key, 'sql', sql_query, cache_tables(tables))
+
+        if result.row_count == 0:
+            yield {
+                'type': 'error',
+                'status': 404,
+                'error': 'No results found',
+                'sql_query': sql_query,
+                'suggestion': 'Try modifying your question'
+            }
+            return
+
+        yield {'type': 'sql', 'sql_query': sql_query}
+
+        with metrics.span('query', 'formatting'):
+            formatted = format_frame(result.preview)
+        batch_size = ROW_BATCH_SIZE if stream else len(formatted)
+        for start in range(0, len(formatted), batch_size):
+            yield {'type': 'rows', 'rows': formatted.iloc[start:start + batch_size]}
+
+        # Generate detailed explanation
+        explanation = []
+        with metrics.span('query', 'explanation'):
+            async for chunk in explain(question, sql_query, result, tables, stream=stream):
+                explanation.append(chunk)
+                yield {'type': 'explanation', 'text': chunk}
+        # Queued in memory; written to the database in batches off the request path
+        conversation_history.record(session_id, question, sql_query, result.preview,
+                                    result.row_count, "".join(explanation))
+
+        yield {
+            'type': 'done',
+            'row_count': result.row_count,
+            'result_id': result.result_id,
+            'has_more': result.has_more,
+            'truncated': result.truncated,
+            'cost': result.cost,
+            'session_id': session_id
+        }
+
+    except QueryTooExpensive as e:
+        print(f"Query too expensive ({e.reason}): {e}")
+        yield {
+            'type': 'error',
+            'status': 422,
+            **e.to_dict(),
+            'sql_query': sql_query,
+            'suggestion': 'Try narrowing your question, e.g. to a time period, category or top results'
+        }
+
+    except InvalidSQL as e:
+        yield {
+            'type': 'error',
+            'status': 400,
+            **e.to_dict(),
+            'sql_query': sql_query,
+            'suggestion': 'Try naming the tables and columns you are asking about'
+        }
+
+    except asyncio.TimeoutError:
+        print("Model call timed out")
+        yield {
+            'type': 'error',
+            'status': 504,
+            'error': 'The AI model took too long to respond',
+            'sql_query': sql_query,
+            'suggestion': 'Please try again in a moment'
+        }
+
+    except Exception as e:
+        print(f"SQL execution error: {str(e)}")
+        yield {
+            'type': 'error',
+            'status': 400,
+            'error': 'Error executing the query',
+            'sql_query': sql_query,
+            'suggestion': 'There might be an issue with the generated SQL query'
+        }
+
+async def answer_question(question, session_id=None):
+    """Run the pipeline to completion and return (payload, status)"""
+    payload = {'explanation': ''}
+    async for event in stream_answer(question, stream=False, session_id=session_id):
+        kind = event.pop('type')
+        if kind == 'error':
+            status = event.pop('status')
+            return event, status
+        if kind == 'sql':
+            payload['sql_query'] = event['sql_query']
+        elif kind == 'rows':
+            payload['data'] = event['rows']
+        elif kind == 'explanation':
+            payload['explanation'] += event['text']
+        elif kind == 'done':
+            payload.update(event)
+    return payload, 200
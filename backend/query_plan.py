@@ -0,0 +1,65 @@
+import re
+
+# Helpers for reading SQL text and SQLite's EXPLAIN QUERY PLAN output
+
+IDENTIFIER = r'"(?:[^"]|"")+"|\w+'
+TABLE_REFERENCE = re.compile(
+    rf'\b(?:FROM|JOIN)\s+({IDENTIFIER})(?:\s+(?:AS\s+)?({IDENTIFIER}))?', re.IGNORECASE)
+FROM_LIST_ITEM = re.compile(rf'\s*,\s*({IDENTIFIER})(?:\s+(?:AS\s+)?({IDENTIFIER}))?', re.IGNORECASE)
+# Full table scan ("SCAN t", or "SCAN TABLE t AS x" on older SQLite)
+PLAN_SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)(?: AS (\S+))?$')
+# Any full pass over a table, including "SCAN t USING COVERING INDEX ..."
+PLAN_ANY_SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)(?: AS (\S+))?')
+PLAN_AUTOMATIC_INDEX = re.compile(
+    r'^SEARCH (?:TABLE )?(\S+)(?: AS (\S+))? USING AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \(([^=]+)=')
+SQL_TOKEN = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/|\w+|\s+|.", re.DOTALL)
+SQL_KEYWORDS = {
+    'on', 'where', 'left', 'right', 'inner', 'outer', 'cross', 'full', 'natural', 'join',
+    'using', 'group', 'order', 'having', 'limit', 'union', 'except', 'intersect', 'window',
+}
+
+def unquote(name):
+    """Strip SQL double quotes from an identifier"""
+    if name.startswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name
+
+def sql_tokens(sql):
+    """(text, start, depth) of every SQL token outside whitespace and comments"""
+    depth = 0
+    for match in SQL_TOKEN.finditer(sql):
+        text = match.group()
+        if text.isspace() or text.startswith(('--', '/*')):
+            continue
+        if text == ')':
+            depth -= 1
+        yield text, match.start(), depth
+        if text == '(':
+            depth += 1
+
+def table_aliases(sql_query):
+    """Map every name a table is referenced by in the query to the table"""
+    aliases = {}
+
+    def add(table, alias):
+        table = unquote(table)
+        aliases[table.lower()] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[unquote(alias).lower()] = table
+            return True
+        return False
+
+    for match in TABLE_REFERENCE.finditer(sql_query):
+        end = match.end() if add(*match.groups()) else match.end(1)
+        # Comma joins: FROM a x, b y, ...
+        while True:
+            item = FROM_LIST_ITEM.match(sql_query, end)
+            if item is None:
+                break
+            end = item.end() if add(*item.groups()) else item.end(1)
+    return aliases
+
+def explain(conn, sql_query):
+    """Return the EXPLAIN QUERY PLAN rows as (id, parent, detail) tuples"""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql_query}")]
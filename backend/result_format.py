@@ -0,0 +1,101 @@
+import re
+import json
+import numpy as np
+import pandas as pd
+
+# Column classification rules, checked in order; the first matching rule
+# wins. Monetary patterns match anywhere in the column name (unitprice,
+# totalrevenue), the others only as whole segments (order_count, not
+# account_id). Extend with add_format_rule() or by editing the list.
+FORMAT_RULES = [
+    {'kind': 'monetary', 'patterns': ['price', 'amount', 'sales', 'revenue', 'spent', 'cost'], 'substring': True},
+    {'kind': 'percentage', 'patterns': ['percent', 'percentage', 'pct', 'discount']},
+    {'kind': 'count', 'patterns': ['count', 'number_of', 'num_', 'quantity', 'qty']},
+]
+
+CURRENCY_SYMBOL = '₹'
+
+def add_format_rule(kind, patterns, index=None, substring=False):
+    """Register extra column-name patterns for a kind of formatting"""
+    rule = {'kind': kind, 'patterns': [p.lower() for p in patterns], 'substring': substring}
+    FORMAT_RULES.insert(len(FORMAT_RULES) if index is None else index, rule)
+
+def _name_segments(name):
+    # unit_price, UnitPrice and "unit price" all become "_unit_price_"
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', str(name))
+    return '_' + re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_') + '_'
+
+def _matches(segments, pattern, substring=False):
+    """Whether a pattern is a whole segment (or run of segments) of a column name, plural or not,
+    or anywhere in it for substring rules"""
+    pattern = pattern.strip('_')
+    if substring:
+        return pattern in segments.replace('_', '') or pattern in segments
+    return f"_{pattern}_" in segments or f"_{pattern}s_" in segments
+
+def classify_columns(df, rules=None):
+    """Return {column: kind} for the numeric columns matched by a rule.
+
+    Substring rules match anywhere in the name (UnitPrice, totalspent);
+    the rest match whole name segments: order_count is a count, account_id
+    is not.
+    """
+    rules = FORMAT_RULES if rules is None else rules
+    kinds = {}
+    for col in df.select_dtypes(include='number').columns:
+        segments = _name_segments(col)
+        for rule in rules:
+            if any(_matches(segments, pattern, rule.get('substring', False)) for pattern in rule['patterns']):
+                kinds[col] = rule['kind']
+                break
+    return kinds
+
+def _fixed_2dp(series, prefix='', suffix=''):
+    values = pd.Series(series.to_numpy(dtype=float, na_value=np.nan), index=series.index)
+    pattern = prefix.replace('%', '%%') + '%.2f' + suffix.replace('%', '%%')
+    # One map over the column's present values; missing values stay None
+    present = values.notna()
+    text = values[present].map(pattern.__mod__).reindex(series.index).astype(object)
+    return text.where(present, None)
+
+def _as_count(series):
+    values = series.dropna()
+    if pd.api.types.is_float_dtype(series) and (values % 1 == 0).all():
+        return series.astype('Int64')
+    return series
+
+FORMATTERS = {
+    'monetary': lambda series: _fixed_2dp(series, prefix=CURRENCY_SYMBOL),
+    'percentage': lambda series: _fixed_2dp(series, suffix='%'),
+    'count': _as_count,
+}
+
+def format_frame(df, rules=None):
+    """Format a query result column by column.
+
+    Columns are classified once per result set and each formatter runs as a
+    vectorized operation over the whole column. Unmatched columns are
+    returned unchanged.
+    """
+    kinds = classify_columns(df, rules)
+    if not kinds:
+        return df
+    formatted = df.copy()
+    for col, kind in kinds.items():
+        formatted[col] = FORMATTERS[kind](df[col])
+    return formatted
+
+def records_json(df):
+    """Serialize a DataFrame as a JSON array of row objects"""
+    return df.to_json(orient='records', force_ascii=False, double_precision=15,
+                      date_format='iso')
+
+def dumps(payload):
+    """Serialize a response payload, writing DataFrame values via records_json()"""
+    frames = {key: value for key, value in payload.items() if isinstance(value, pd.DataFrame)}
+    rest = {key: value for key, value in payload.items() if key not in frames}
+    text = json.dumps(rest, ensure_ascii=False, default=str)
+    if not frames:
+        return text
+    parts = [f"{json.dumps(key)}: {records_json(frame)}" for key, frame in frames.items()]
+    return text[:-1] + (", " if rest else "") + ", ".join(parts) + "}"
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import pandas as pd
+from db import Database, current_workspace, get_database
+
+RESULTS_PATH = os.getenv('RESULTS_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.db'))
+# Rows returned with the first response; the rest is fetched page by page
+INITIAL_ROW_CAP = int(os.getenv('RESULT_INITIAL_ROWS', 1000))
+MAX_PAGE_SIZE = int(os.getenv('RESULT_MAX_PAGE_SIZE', 1000))
+# Hard limit on rows kept for one result set
+MAX_RESULT_ROWS = int(os.getenv('RESULT_MAX_ROWS', 1000000))
+RESULT_TTL_SECONDS = int(os.getenv('RESULT_TTL', 30 * 60))
+FETCH_BATCH_SIZE = 10000
+CLEANUP_INTERVAL_SECONDS = 60
+
+class ResultExpired(LookupError):
+    """The spilled rows of a result set were dropped (RESULT_TTL_SECONDS unread)"""
+
+    def __init__(self, result_id):
+        super().__init__(f"Result set {result_id} has expired; ask the question again")
+        self.result_id = result_id
+
+
+class ResultSet:
+    """A query result: the first rows in memory, the rest spilled to disk"""
+
+    def __init__(self, columns, preview, row_count, result_id=None, truncated=False):
+        self.columns = columns
+        self.preview = preview
+        self.row_count = row_count
+        self.result_id = result_id
+        self.truncated = truncated
+        # Execution cost recorded by the query governor
+        self.cost = None
+
+    @property
+    def has_more(self):
+        return self.row_count > len(self.preview)
+
+    def frame(self, limit):
+        """Up to `limit` leading rows as a DataFrame (for summaries).
+
+        Raises ResultExpired when the spilled rows are gone.
+        """
+        if self.result_id is None or limit <= len(self.preview):
+            return self.preview.head(limit)
+        page = result_store.fetch_rows(self.result_id, 0, limit)
+        if page is None:
+            raise ResultExpired(self.result_id)
+        return page['rows']
+
+
+class ResultStore:
+    """Spills large query results into a scratch database for paged reads.
+
+    Results that fit in INITIAL_ROW_CAP rows never touch disk. Larger ones
+    are streamed from the cursor into their own table (at most
+    MAX_RESULT_ROWS rows) and addressed by a result id until they have not
+    been read for RESULT_TTL_SECONDS.
+    """
+
+    def __init__(self, path=RESULTS_PATH):
+        self.path = path
+        self._database = None
+        self._open_lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self._cleanup_lock = threading.Lock()
+
+    @property
+    def _db(self):
+        # Opened on first use, so importing the module creates no file
+        if self._database is None:
+            with self._open_lock:
+                if self._database is None:
+                    self._database = self._open()
+        return self._database
+
+    def _open(self):
+        database = Database(self.path)
+        with database.writer() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS result_sets (
+                id TEXT PRIMARY KEY,
+                workspace TEXT NOT NULL DEFAULT '',
+                columns TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                truncated INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            ''')
+            # Result databases created before results were tied to a workspace
+            if 'workspace' not in [row[1] for row in conn.execute("PRAGMA table_info(result_sets)")]:
+                conn.execute("ALTER TABLE result_sets ADD COLUMN workspace TEXT NOT NULL DEFAULT ''")
+        return database
+
+    def execute(self, sql_query, database=None):
+        """Execute sql_query once and return a ResultSet"""
+        database = database or get_database()
+        with database.reader() as conn:
+            return self.collect(conn.execute(sql_query))
+
+    def collect(self, cursor):
+        """Build a ResultSet from an executed DB-API cursor (any engine)"""
+        self.cleanup_expired()
+        columns = [description[0] for description in cursor.description or []]
+        first = cursor.fetchmany(INITIAL_ROW_CAP + 1)
+        preview = pd.DataFrame.from_records(first[:INITIAL_ROW_CAP], columns=columns)
+        if len(first) <= INITIAL_ROW_CAP:
+            return ResultSet(columns, preview, len(first))
+        return self._spill(cursor, columns, first, preview)
+
+    def _spill(self, cursor, columns, first, preview):
+        result_id = uuid.uuid4().hex
+        table = f"r_{result_id}"
+        placeholders = ", ".join("?" for _ in columns)
+        row_count, truncated = 0, False
+        with self._db.writer() as conn:
+            conn.execute(f"CREATE TABLE {table} ({', '.join(f'c{i}' for i in range(len(columns)))})")
+            batch = first
+            while batch:
+                kept = batch[:MAX_RESULT_ROWS - row_count]
+                conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", kept)
+                row_count += len(kept)
+                if row_count >= MAX_RESULT_ROWS:
+                    # Rows cut from this batch were already read from the cursor
+                    truncated = len(kept) < len(batch) or cursor.fetchone() is not None
+                    break
+                batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+            now = time.time()
+            conn.execute(
+                "INSERT INTO result_sets (id, workspace, columns, row_count, truncated, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (result_id, current_workspace(), json.dumps(columns), row_count, int(truncated), now, now))
+        print(f"Spilled {row_count} result rows to {table}" + (" (truncated)" if truncated else ""))
+        return ResultSet(columns, preview, row_count, result_id, truncated)
+
+    def fetch_rows(self, result_id, offset, limit):
+        """Return a page of a spilled result, or None if it expired or belongs to another workspace"""
+        with self._db.reader() as conn:
+            meta = conn.execute(
+                "SELECT columns, row_count, truncated FROM result_sets WHERE id = ? AND workspace = ?",
+                (result_id, current_workspace())).fetchone()
+            if meta is None:
+                return None
+            columns = json.loads(meta[0])
+            try:
+                # rowids are assigned 1..n in insert order, so a page is a rowid range
+                rows = conn.execute(
+                    f"SELECT * FROM r_{result_id} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (offset, limit)).fetchall()
+            except sqlite3.OperationalError:
+                # Dropped by cleanup_expired() since the lookup above
+                return None
+        with self._db.writer() as conn:
+            conn.execute("UPDATE result_sets SET last_access = ? WHERE id = ?", (time.time(), result_id))
+        return {
+            'rows': pd.DataFrame.from_records(rows, columns=columns),
+            'row_count': meta[1],
+            'truncated': bool(meta[2]),
+        }
+
+    def cleanup_expired(self, force=False):
+        """Drop result sets that have not been read for RESULT_TTL_SECONDS"""
+        now = time.time()
+        with self._cleanup_lock:
+            if not force and now - self._last_cleanup < CLEANUP_INTERVAL_SECONDS:
+                return 0
+            self._last_cleanup = now
+        with self._db.writer() as conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT id FROM result_sets WHERE last_access < ?", (now - RESULT_TTL_SECONDS,))]
+            for result_id in expired:
+                conn.execute(f"DROP TABLE IF EXISTS r_{result_id}")
+                conn.execute("DELETE FROM result_sets WHERE id = ?", (result_id,))
+        if expired:
+            print(f"Dropped {len(expired)} expired result sets")
+        return len(expired)
+
+
+result_store = ResultStore()
@@ -0,0 +1,127 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Approximate size limit for the result section of the explanation prompt
+EXPLANATION_TOKEN_BUDGET = int(os.getenv('EXPLANATION_TOKEN_BUDGET', 3000))
+CHARS_PER_TOKEN = 4
+HEAD_ROWS = 10
+TAIL_ROWS = 5
+SAMPLE_ROWS = 20
+TOP_K = 5
+# Categorical columns with at most this many values are used to stratify the sample
+STRATIFY_MAX_GROUPS = 20
+
+def estimate_tokens(text):
+    """Rough token count used for prompt budgeting"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def column_statistics(df):
+    """Per-column statistics computed with vectorized pandas operations"""
+    stats = {}
+    null_rates = df.isna().mean()
+    counts = df.count()
+
+    numeric = df.select_dtypes(include='number')
+    if not numeric.empty:
+        described = numeric.agg(['min', 'max', 'mean'])
+        quantiles = numeric.quantile([0.25, 0.5, 0.75])
+        for col in numeric.columns:
+            stats[col] = {
+                'type': 'numeric',
+                'count': int(counts[col]),
+                'null_rate': round(float(null_rates[col]), 4),
+                'min': described.at['min', col],
+                'max': described.at['max', col],
+                'mean': round(float(described.at['mean', col]), 4),
+                'p25': quantiles.at[0.25, col],
+                'median': quantiles.at[0.5, col],
+                'p75': quantiles.at[0.75, col],
+            }
+
+    for col in df.columns.difference(numeric.columns, sort=False):
+        values = df[col].dropna().astype(str)
+        top = values.value_counts().head(TOP_K)
+        stats[col] = {
+            'type': 'categorical',
+            'count': int(counts[col]),
+            'null_rate': round(float(null_rates[col]), 4),
+            'distinct': int(values.nunique()),
+            'top': {str(k): int(v) for k, v in top.items()},
+        }
+        if not values.empty:
+            stats[col]['min'] = values.min()
+            stats[col]['max'] = values.max()
+    return stats
+
+def _stratified_sample(df, size):
+    """Sample rows spread across the groups of a low-cardinality column"""
+    if len(df) <= size:
+        return df
+    candidates = [
+        col for col in df.select_dtypes(exclude='number').columns
+        if 1 < df[col].nunique() <= STRATIFY_MAX_GROUPS
+    ]
+    if candidates:
+        col = candidates[0]
+        per_group = max(1, size // df[col].nunique())
+        return (df.groupby(col, group_keys=False, dropna=False)
+                  .apply(lambda group: group.head(per_group))
+                  .head(size))
+    # No grouping column: evenly spaced rows
+    return df.iloc[np.linspace(0, len(df) - 1, size).astype(int)]
+
+def _render_rows(df):
+    return df.to_csv(index=False).strip()
+
+def _render_stats(stats):
+    lines = []
+    for col, info in stats.items():
+        details = ", ".join(f"{key}={value}" for key, value in info.items() if key != 'type')
+        lines.append(f"  - {col} ({info['type']}): {details}")
+    return "\n".join(lines)
+
+def summarize_result(df, token_budget=None, total_rows=None):
+    """Render a query result for the explanation prompt within a token budget.
+
+    Small results are included verbatim. Larger ones are reduced to column
+    statistics plus the first and last rows and a stratified sample; the
+    sample (and if needed the head/tail) shrinks until the text fits.
+    `total_rows` is the full result size when df holds only its leading rows.
+    """
+    token_budget = token_budget or EXPLANATION_TOKEN_BUDGET
+    partial = total_rows is not None and total_rows > len(df)
+    # Extrapolate from the first rows before rendering a large result in full
+    probe = _render_rows(df.head(50))
+    if not partial and estimate_tokens(probe) * len(df) / max(len(df.head(50)), 1) <= token_budget * 2:
+        full = _render_rows(df)
+        if estimate_tokens(full) <= token_budget:
+            return f"{len(df)} rows (complete):\n{full}"
+
+    stats_text = _render_stats(column_statistics(df))
+    head_rows, tail_rows, sample_rows = HEAD_ROWS, TAIL_ROWS, SAMPLE_ROWS
+    while True:
+        middle = df.iloc[head_rows:len(df) - tail_rows]
+        sections = [
+            (f"{total_rows} rows in total; showing a summary of the first {len(df)}."
+             if partial else f"{len(df)} rows in total; showing a summary."),
+            f"Column statistics:\n{stats_text}",
+            f"First {head_rows} rows:\n{_render_rows(df.head(head_rows))}",
+        ]
+        if tail_rows:
+            sections.append(f"Last {tail_rows} rows:\n{_render_rows(df.tail(tail_rows))}")
+        if sample_rows and not middle.empty:
+            sample = _stratified_sample(middle, sample_rows)
+            sections.append(f"Sample of {len(sample)} other rows:\n{_render_rows(sample)}")
+        text = "\n\n".join(sections)
+        if estimate_tokens(text) <= token_budget:
+            return text
+        if head_rows <= 1:
+            # Very wide results: the statistics alone exceed the budget
+            return text[:token_budget * CHARS_PER_TOKEN]
+        if sample_rows:
+            sample_rows //= 2
+        elif tail_rows:
+            tail_rows //= 2
+        else:
+            head_rows //= 2
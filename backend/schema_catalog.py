@@ -0,0 +1,224 @@
+import re
+import threading
+
+# Bookkeeping tables that are never shown to the model
+INTERNAL_TABLES = {
+    'conversation_history', 'sqlite_sequence', 'data', 'index_advisor_log', 'table_metadata', 'column_profiles'
+}
+# Summary tables maintained by the aggregate cache
+INTERNAL_PREFIXES = ('agg_mv_',)
+
+def is_internal_table(table_name):
+    """Whether a table is bookkeeping rather than uploaded data"""
+    return table_name in INTERNAL_TABLES or table_name.startswith(INTERNAL_PREFIXES)
+
+def render_table_schema(table_name, columns, types, hints=None):
+    """Render one table the way it appears in the SQL generation prompt.
+
+    hints maps column names to a short description of their values.
+    """
+    hints = hints or {}
+    lines = [f"\nTable: {table_name}\n"]
+    for col, col_type in zip(columns, types):
+        hint = hints.get(col)
+        lines.append(f"  - {col} ({col_type}): {hint}\n" if hint else f"  - {col} ({col_type})\n")
+    return "".join(lines)
+
+def prompt_tables(schema_text):
+    """Names of the tables in a rendered prompt schema, in order"""
+    return re.findall(r'^Table: (.*)$', schema_text, re.MULTILINE)
+
+class SchemaCatalog:
+    """In-process, versioned cache of the database schema.
+
+    The catalog is built once from sqlite_master and then kept current by the
+    upload/remove paths calling refresh_table() / drop_table(). Changes made by
+    other processes are picked up by comparing SQLite's PRAGMA schema_version
+    with the value seen at the last sync.
+    """
+
+    def __init__(self, connect):
+        # connect() returns a context manager yielding a connection
+        self._connect = connect
+        self._lock = threading.RLock()
+        self._tables = {}
+        self._fragments = {}
+        self._table_versions = {}
+        self._table_sql = {}
+        self._prompt_text = None
+        self._schema_version = None
+        self._listeners = []
+        self._hint_source = None
+        self.version = 0
+
+    def add_listener(self, callback):
+        """Register callback(table_name, schema_changed), called whenever a table changes.
+
+        schema_changed is False when only the rows changed (e.g. an append).
+        """
+        self._listeners.append(callback)
+
+    def set_hint_source(self, source):
+        """Use source(table_name) -> {column: hint} to annotate the prompt schema"""
+        with self._lock:
+            self._hint_source = source
+            for table_name in list(self._fragments):
+                self._render(table_name)
+
+    def _render(self, table_name):
+        info = self._tables[table_name]
+        hints = {}
+        if self._hint_source is not None:
+            try:
+                hints = self._hint_source(table_name)
+            except Exception as e:
+                print(f"Could not load column hints for {table_name}: {str(e)}")
+        self._fragments[table_name] = render_table_schema(table_name, info['columns'], info['types'], hints)
+        self._prompt_text = None
+
+    def refresh_hints(self, table_name):
+        """Re-render a table's prompt schema after its column hints changed"""
+        with self._lock:
+            if table_name in self._fragments:
+                self._render(table_name)
+
+    def _notify(self, table_name, schema_changed=True):
+        for callback in self._listeners:
+            callback(table_name, schema_changed)
+
+    def _read_table(self, cursor, table_name):
+        quoted = '"' + table_name.replace('"', '""') + '"'
+        cursor.execute(f"PRAGMA table_info({quoted});")
+        columns = cursor.fetchall()
+        return {
+            'columns': [col[1] for col in columns],
+            'types': [col[2] for col in columns]
+        }
+
+    def _store(self, table_name, info):
+        self._tables[table_name] = info
+        if is_internal_table(table_name):
+            self._fragments.pop(table_name, None)
+        else:
+            self._render(table_name)
+        self.version += 1
+        self._table_versions[table_name] = self.version
+        self._prompt_text = None
+
+    def _forget(self, table_name):
+        self._tables.pop(table_name, None)
+        self._table_sql.pop(table_name, None)
+        self._fragments.pop(table_name, None)
+        self.version += 1
+        self._table_versions[table_name] = self.version
+        self._prompt_text = None
+
+    def reload(self):
+        """Rebuild the whole catalog from sqlite_master"""
+        with self._lock:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                schema_version = cursor.execute("PRAGMA schema_version;").fetchone()[0]
+                cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+                table_sql = dict(cursor.fetchall())
+                names = list(table_sql)
+                self._table_sql = table_sql
+                changed = set(self._tables) - set(names)
+                for table_name in changed:
+                    self._forget(table_name)
+                for table_name in names:
+                    info = self._read_table(cursor, table_name)
+                    if self._tables.get(table_name) != info:
+                        self._store(table_name, info)
+                        changed.add(table_name)
+                initial_load = self._schema_version is None
+                self._schema_version = schema_version
+            if not initial_load:
+                for table_name in changed:
+                    self._notify(table_name)
+
+    def _sync(self):
+        """Reload if the database schema changed behind the catalog's back"""
+        with self._connect() as conn:
+            schema_version = conn.execute("PRAGMA schema_version;").fetchone()[0]
+        if schema_version != self._schema_version:
+            self.reload()
+
+    def refresh_table(self, table_name):
+        """Re-read a single table after its rows or columns were written.
+
+        Other tables whose definition changed meanwhile (DDL committed by
+        another connection) are picked up by a full reload.
+        """
+        with self._lock:
+            if self._schema_version is None:
+                self.reload()
+                schema_changed = True
+                others_changed = False
+            else:
+                with self._connect() as conn:
+                    cursor = conn.cursor()
+                    schema_version = cursor.execute("PRAGMA schema_version;").fetchone()[0]
+                    table_sql = dict(cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';"))
+                    info = self._read_table(cursor, table_name)
+                schema_changed = self._tables.get(table_name) != info
+                if info['columns']:
+                    self._store(table_name, info)
+                    self._table_sql[table_name] = table_sql.get(table_name)
+                else:
+                    self._forget(table_name)
+                others = {name: sql for name, sql in table_sql.items() if name != table_name}
+                known = {name: sql for name, sql in self._table_sql.items() if name != table_name}
+                others_changed = others != known
+                if not others_changed:
+                    self._schema_version = schema_version
+            self._notify(table_name, schema_changed)
+            if others_changed:
+                self.reload()
+
+    def drop_table(self, table_name):
+        """Forget a table after it was dropped"""
+        self.refresh_table(table_name)
+
+    def get_schema(self):
+        """Return {table: {'columns': [...], 'types': [...]}} for every user table"""
+        with self._lock:
+            self._sync()
+            return {
+                name: {'columns': list(info['columns']), 'types': list(info['types'])}
+                for name, info in self._tables.items()
+                if not is_internal_table(name)
+            }
+
+    def prompt_schema(self):
+        """Return the pre-rendered schema text for user tables"""
+        with self._lock:
+            self._sync()
+            if self._prompt_text is None:
+                self._prompt_text = "".join(self._fragments.values())
+            return self._prompt_text
+
+    def structure(self, table_names):
+        """Schema text of table_names without column hints, which change with the rows"""
+        with self._lock:
+            self._sync()
+            return "".join(render_table_schema(name, self._tables[name]['columns'], self._tables[name]['types'])
+                           for name in table_names if name in self._tables)
+
+    def table_version(self, table_name):
+        """Version stamp of the last change to table_name (0 if never seen)"""
+        with self._lock:
+            self._sync()
+            return self._table_versions.get(table_name, 0)
+
+    def table_versions(self):
+        """{table: version stamp} for the user tables shown to the model"""
+        with self._lock:
+            self._sync()
+            return {name: self._table_versions.get(name, 0) for name in self._fragments}
+
+    def table_names(self):
+        """Names of the user tables shown to the model"""
+        with self._lock:
+            self._sync()
+            return list(self._fragments)
@@ -0,0 +1,257 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import threading
+from collections import Counter
+from database import get_database, quote_identifier, schema_catalog
+from db import WorkspaceLocal
+from schema_catalog import render_table_schema
+from index_advisor import is_key_column
+from metrics import metrics
+from column_profiles import column_profiles
+
+# Schemas with fewer tables than this are sent to the model whole
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv('SCHEMA_PRUNE_MIN_TABLES', 10))
+# Best-matching tables kept in the prompt, plus up to this many join neighbours
+SCHEMA_TOP_TABLES = int(os.getenv('SCHEMA_TOP_TABLES', 5))
+SCHEMA_MAX_NEIGHBORS = int(os.getenv('SCHEMA_MAX_NEIGHBORS', 5))
+# Wider tables list only their key, matching and leading columns
+SCHEMA_MAX_COLUMNS = int(os.getenv('SCHEMA_MAX_COLUMNS', 40))
+# Leading rows, and distinct values per text column, indexed from each table
+SCHEMA_SAMPLE_ROWS = 200
+SCHEMA_SAMPLE_VALUES = 20
+# Longer cell values (notes, descriptions) are not worth indexing
+MAX_VALUE_LENGTH = 60
+
+# BM25 parameters; names count more than sampled values
+BM25_K1 = 1.2
+BM25_B = 0.75
+TABLE_NAME_WEIGHT = 3
+COLUMN_NAME_WEIGHT = 2
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'by', 'did', 'do', 'does', 'each', 'for', 'from', 'give',
+    'how', 'i', 'in', 'is', 'it', 'list', 'me', 'many', 'much', 'of', 'on', 'or', 'our', 'per',
+    'show', 'tell', 'than', 'that', 'the', 'their', 'there', 'to', 'was', 'we', 'were', 'what',
+    'when', 'where', 'which', 'who', 'with',
+}
+
+def _stem(token):
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    """Lower-case word stems of text; snake_case and camelCase names are split"""
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', str(text))
+    return [_stem(token) for token in re.findall(r'[a-z0-9]+', text.lower()) if token not in STOP_WORDS]
+
+def join_keys(table_name, columns):
+    """Key column names a table can be joined on, e.g. customer_id.
+
+    A bare `id` is generic, so it stands for `<table>_id` instead
+    (customers.id joins orders.customer_id).
+    """
+    keys = {column.lower() for column in columns if is_key_column(column) and column.lower() != 'id'}
+    if any(column.lower() == 'id' for column in columns):
+        keys.add(f"{_stem(table_name.lower())}_id")
+    return keys
+
+
+class SchemaIndex:
+    """BM25 index over table names, column names and sampled values.
+
+    Each user table is a document, stamped with the catalog version it was
+    built from. Uploads re-index their table right after writing it, and a
+    question first re-indexes any table whose catalog version moved on
+    (e.g. written by another process), then only scores its own terms.
+    relevant_schema() keeps the best-matching tables plus the tables they
+    join to through shared key columns, so prompts for large workspaces
+    stay small.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._postings = {}
+        self._total_length = 0
+
+    def _sample_values(self, table_name, columns, types):
+        text_columns = [column for column, col_type in zip(columns, types)
+                        if col_type.upper() in ('TEXT', '')]
+        if not text_columns:
+            return {}
+        query = (f"SELECT {', '.join(quote_identifier(column) for column in text_columns)} "
+                 f"FROM {quote_identifier(table_name)} LIMIT {SCHEMA_SAMPLE_ROWS}")
+        try:
+            with get_database().reader() as conn:
+                rows = conn.execute(query).fetchall()
+        except sqlite3.Error as e:
+            print(f"Could not sample {table_name} for the schema index: {str(e)}")
+            return {}
+        values = {}
+        for column, cells in zip(text_columns, zip(*rows)):
+            distinct = dict.fromkeys(cell for cell in cells
+                                     if isinstance(cell, str) and 0 < len(cell) <= MAX_VALUE_LENGTH)
+            values[column] = list(distinct)[:SCHEMA_SAMPLE_VALUES]
+        return values
+
+    def _build(self, table_name, columns, types, version):
+        values = self._sample_values(table_name, columns, types)
+        column_terms = {}
+        for column in columns:
+            terms = tokenize(column) * COLUMN_NAME_WEIGHT
+            for value in values.get(column, []):
+                terms += tokenize(value)
+            column_terms[column] = Counter(terms)
+        terms = Counter(tokenize(table_name) * TABLE_NAME_WEIGHT)
+        for counts in column_terms.values():
+            terms.update(counts)
+        return {
+            'columns': columns,
+            'types': types,
+            'version': version,
+            'terms': terms,
+            'length': sum(terms.values()),
+            'column_terms': column_terms,
+            'keys': join_keys(table_name, columns)
+        }
+
+    def _remove(self, table_name):
+        doc = self._docs.pop(table_name, None)
+        if doc is None:
+            return
+        self._total_length -= doc['length']
+        for term in doc['terms']:
+            postings = self._postings[term]
+            postings.pop(table_name, None)
+            if not postings:
+                del self._postings[term]
+
+    def _add(self, table_name, doc):
+        self._docs[table_name] = doc
+        self._total_length += doc['length']
+        for term, count in doc['terms'].items():
+            self._postings.setdefault(term, {})[table_name] = count
+
+    def _replace(self, table_name, doc):
+        with self._lock:
+            current = self._docs.get(table_name)
+            # A concurrent refresh may already have indexed a newer version
+            if current is None or current['version'] <= doc['version']:
+                self._remove(table_name)
+                self._add(table_name, doc)
+
+    def refresh(self, table_name):
+        """Re-index one table after it was written; called on the upload path"""
+        versions = schema_catalog.table_versions()
+        info = schema_catalog.get_schema().get(table_name)
+        if table_name not in versions or info is None:
+            with self._lock:
+                self._remove(table_name)
+            return
+        self._replace(table_name, self._build(table_name, info['columns'], info['types'], versions[table_name]))
+
+    def _sync(self):
+        """Index tables that are new or changed since they were last indexed.
+
+        The catalog is never called with the index lock held, because the
+        catalog calls back into other components while holding its own lock.
+        """
+        versions = schema_catalog.table_versions()
+        with self._lock:
+            for table_name in [name for name in self._docs if name not in versions]:
+                self._remove(table_name)
+            stale = [name for name, version in versions.items()
+                     if name not in self._docs or self._docs[name]['version'] < version]
+        if not stale:
+            return
+        start = time.perf_counter()
+        schema = schema_catalog.get_schema()
+        for table_name in stale:
+            if table_name in schema:
+                info = schema[table_name]
+                self._replace(table_name, self._build(table_name, info['columns'], info['types'],
+                                                      versions[table_name]))
+        print(f"Schema index: indexed {len(stale)} tables in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def _idf(self, term):
+        matches = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self._docs) - matches + 0.5) / (matches + 0.5))
+
+    def rank(self, question):
+        """[(table, score)] of the tables matching the question, best first"""
+        self._sync()
+        with self._lock:
+            if not self._docs:
+                return []
+            average_length = self._total_length / len(self._docs)
+            scores = Counter()
+            for term in set(tokenize(question)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = self._idf(term)
+                for table_name, count in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._docs[table_name]['length'] / average_length)
+                    scores[table_name] += idf * count * (BM25_K1 + 1) / (count + norm)
+            return scores.most_common()
+
+    def _neighbors(self, selected, scores):
+        """Tables sharing a join key with the selected ones, best-scoring first"""
+        keys = set().union(*(self._docs[name]['keys'] for name in selected))
+        candidates = [name for name, doc in self._docs.items()
+                      if name not in selected and doc['keys'] & keys]
+        candidates.sort(key=lambda name: (-scores.get(name, 0), name))
+        return candidates[:SCHEMA_MAX_NEIGHBORS]
+
+    def _render(self, table_name, terms):
+        doc = self._docs[table_name]
+        columns, types = doc['columns'], doc['types']
+        hints = column_profiles.column_hints(table_name)
+        if len(columns) <= SCHEMA_MAX_COLUMNS:
+            return render_table_schema(table_name, columns, types, hints)
+        # Keys first, then columns matching the question, then the leading ones
+        matched = {column for column, counts in doc['column_terms'].items() if terms & counts.keys()}
+        ranked = sorted(range(len(columns)), key=lambda i: (
+            not is_key_column(columns[i]), columns[i] not in matched, i))
+        keep = sorted(ranked[:SCHEMA_MAX_COLUMNS])
+        return (render_table_schema(table_name, [columns[i] for i in keep], [types[i] for i in keep], hints)
+                + f"  - ... {len(columns) - len(keep)} more columns not shown\n")
+
+    def relevant_schema(self, question, full_schema):
+        """Prompt schema text with only the tables relevant to the question.
+
+        Falls back to full_schema for small workspaces and for questions
+        that match no table at all.
+        """
+        start = time.perf_counter()
+        ranked = self.rank(question)
+        with self._lock:
+            if len(self._docs) < SCHEMA_PRUNE_MIN_TABLES or not ranked:
+                return full_schema
+            scores = dict(ranked)
+            selected = [name for name, _ in ranked[:SCHEMA_TOP_TABLES]]
+            selected += self._neighbors(selected, scores)
+            terms = set(tokenize(question))
+            schema_str = "".join(self._render(name, terms) for name in selected)
+            total = len(self._docs)
+        print(f"Schema retrieval: kept {len(selected)}/{total} tables, {len(schema_str)} of "
+              f"{len(full_schema)} chars in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return schema_str
+
+    def collect_metrics(self):
+        """Indexed table and term counts for the /metrics endpoint"""
+        with self._lock:
+            return [('schema_index_tables', 'gauge', 'Tables in the schema retrieval index',
+                     {(): len(self._docs)}, ()),
+                    ('schema_index_terms', 'gauge', 'Distinct terms in the schema retrieval index',
+                     {(): len(self._postings)}, ())]
+
+
+schema_index = WorkspaceLocal(lambda workspace: SchemaIndex())
+metrics.add_collector(lambda: schema_index.collect_metrics())
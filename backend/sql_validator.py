@@ -0,0 +1,316 @@
+import re
+import sqlite3
+import difflib
+import threading
+from database import quote_identifier, schema_catalog
+from db import WorkspaceLocal
+from query_plan import sql_tokens, table_aliases, unquote
+from schema_catalog import is_internal_table
+from metrics import metrics
+
+# Misspelled names fixed locally per query before it goes back to the model
+MAX_LOCAL_REPAIRS = 5
+# How close (difflib ratio) a wrong name must be to a real one to be replaced by it
+REPAIR_SIMILARITY = 0.8
+# Real names listed when telling the model about an unknown one
+MAX_LISTED_NAMES = 40
+
+FENCED_BLOCK = re.compile(r'```[a-z]*[ \t]*\n?(.*?)```', re.IGNORECASE | re.DOTALL)
+STATEMENT_START = re.compile(r'^[ \t]*(?:SELECT|WITH)\b', re.IGNORECASE | re.MULTILINE)
+WRITE_START = re.compile(
+    r'^[ \t]*(?:INSERT|UPDATE|DELETE|REPLACE|UPSERT|MERGE|CREATE|DROP|ALTER|TRUNCATE|ATTACH|DETACH|'
+    r'PRAGMA|VACUUM|REINDEX|ANALYZE|BEGIN|COMMIT|ROLLBACK)\b', re.IGNORECASE | re.MULTILINE)
+UNKNOWN_NAME = re.compile(r'^no such (table|column): (.+)$')
+SIMPLE_NAME = re.compile(r'^[A-Za-z_]\w*$')
+# Words a paragraph of the same SELECT statement can start with
+CONTINUATION_WORDS = {
+    'FROM', 'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET', 'JOIN', 'LEFT', 'RIGHT', 'INNER',
+    'OUTER', 'CROSS', 'FULL', 'NATURAL', 'ON', 'USING', 'AND', 'OR', 'NOT', 'UNION', 'EXCEPT',
+    'INTERSECT', 'WINDOW', 'SELECT', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'AS',
+}
+READ_ONLY_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+                     sqlite3.SQLITE_RECURSIVE}
+# Functions that load code or touch files (SQLite's and DuckDB's), whatever the engine
+DENIED_FUNCTIONS = {
+    'load_extension', 'readfile', 'writefile', 'edit', 'fts3_tokenizer', 'read_csv', 'read_csv_auto',
+    'read_parquet', 'parquet_scan', 'read_json', 'read_json_auto', 'read_ndjson', 'read_text', 'read_blob',
+}
+# The database's own catalog and table-valued pragmas are not uploaded data
+DENIED_TABLE_PREFIXES = ('sqlite_', 'pragma_')
+READ_ONLY_MESSAGE = "Only a single read-only SELECT statement over the uploaded tables can be run"
+
+
+class InvalidSQL(Exception):
+    """Generated SQL that cannot run; the message is what the model is told.
+
+    `reason` is one of 'no_sql', 'not_read_only', 'multiple_statements',
+    'unknown_table', 'unknown_column' or 'invalid'.
+    """
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            'error': 'The generated SQL is not valid',
+            'reason': self.reason,
+            'detail': str(self)
+        }
+
+
+def extract_statement(text):
+    """The single SELECT statement in a model response, and the clean-ups made.
+
+    Drops code fences, an explanatory preamble and trailing prose; raises
+    InvalidSQL when there is no SELECT, a write, or more than one statement.
+    """
+    repairs = []
+    fenced = FENCED_BLOCK.search(text)
+    if fenced:
+        if (text[:fenced.start()] + text[fenced.end():]).strip():
+            repairs.append('prose')
+        text = fenced.group(1)
+    start = STATEMENT_START.search(text)
+    if start is None or WRITE_START.search(text[:start.start()]):
+        if start is None and not WRITE_START.search(text):
+            raise InvalidSQL('no_sql', "The response contains no SELECT statement")
+        raise InvalidSQL('not_read_only', READ_ONLY_MESSAGE)
+    if text[:start.start()].strip():
+        repairs.append('prose')
+    text = text[start.start():]
+
+    end = next((position for token, position, depth in sql_tokens(text) if token == ';' and depth == 0), None)
+    if end is not None:
+        rest = text[end + 1:]
+        text = text[:end]
+        if STATEMENT_START.search(rest) or WRITE_START.search(rest):
+            raise InvalidSQL('multiple_statements',
+                             "The response contains several statements; return exactly one SELECT statement")
+        if rest.strip():
+            repairs.append('prose')
+    else:
+        # Without a semicolon, prose follows after a blank line ("This query joins ...")
+        paragraphs = re.split(r'\n[ \t]*\n', text)
+        kept = paragraphs[:1]
+        for paragraph in paragraphs[1:]:
+            words = paragraph.split(None, 1)
+            if words and words[0].upper() not in CONTINUATION_WORDS and words[0][0] not in '(),':
+                repairs.append('prose')
+                break
+            kept.append(paragraph)
+        text = "\n\n".join(kept)
+    return text.strip(), list(dict.fromkeys(repairs))
+
+
+def _identifier(token):
+    """The name an identifier token refers to, or None for literals and punctuation"""
+    if token[0] in '"`[':
+        return unquote(token) if token[0] == '"' else token[1:-1]
+    if token[0].isalpha() or token[0] == '_':
+        return token
+    return None
+
+def calls_denied_function(sql):
+    """Whether sql calls one of DENIED_FUNCTIONS, even one the compiling SQLite does not know"""
+    tokens = list(sql_tokens(sql))
+    return any((_identifier(token) or '').lower() in DENIED_FUNCTIONS and following == '('
+               for (token, _, _), (following, _, _) in zip(tokens, tokens[1:]))
+
+def output_aliases(sql):
+    """Names the top-level select list gives its columns with AS"""
+    tables = table_aliases(sql)
+    tokens = list(sql_tokens(sql))
+    aliases = []
+    for (token, _, depth), (following, _, _) in zip(tokens, tokens[1:]):
+        name = _identifier(following) if depth == 0 and token.upper() == 'AS' else None
+        if name is not None and name.lower() not in tables:
+            aliases.append(name)
+    return aliases
+
+def _normal(name):
+    # customer_name, CustomerName and "customer names" all match
+    return re.sub(r'[^a-z0-9]', '', name.lower()).rstrip('s')
+
+def closest_name(name, candidates):
+    """The one candidate a misspelled name most likely means, or None"""
+    same = [candidate for candidate in candidates if _normal(candidate) == _normal(name)]
+    if len(same) == 1:
+        return same[0]
+    scored = sorted(((difflib.SequenceMatcher(None, name.lower(), candidate.lower()).ratio(), candidate)
+                     for candidate in candidates), reverse=True)
+    if not scored or scored[0][0] < REPAIR_SIMILARITY:
+        return None
+    if len(scored) > 1 and scored[1][0] == scored[0][0]:
+        return None
+    return scored[0][1]
+
+def replace_name(sql, old, new, qualifier=None):
+    """Replace references to an identifier, leaving string literals and functions alone"""
+    tokens = list(sql_tokens(sql))
+    edits = []
+    for i, (token, start, _) in enumerate(tokens):
+        name = _identifier(token)
+        if name is None or name.lower() != old.lower():
+            continue
+        if i + 1 < len(tokens) and tokens[i + 1][0] == '(':
+            continue
+        qualified = i >= 2 and tokens[i - 1][0] == '.'
+        if qualifier is not None and not (qualified and (_identifier(tokens[i - 2][0]) or '').lower()
+                                          == qualifier.lower()):
+            continue
+        quoted = token[0] in '"`[' or not SIMPLE_NAME.match(new)
+        edits.append((start, start + len(token), quote_identifier(new) if quoted else new))
+    for start, end, text in reversed(edits):
+        sql = sql[:start] + text + sql[end:]
+    return sql
+
+
+class SQLValidator:
+    """Checks generated SQL locally before it runs, fixing what it can.
+
+    Statements are compiled with EXPLAIN against an in-memory database of
+    empty copies of the uploaded tables, kept in step with the schema
+    catalog's table versions, under an authorizer that only allows reads of
+    those tables and no extension or file functions.
+    That finds unknown tables and columns, syntax errors and anything but a
+    single read-only SELECT in well under a millisecond without touching
+    the data. Near-miss table and column names are replaced with the real
+    ones; anything else raises InvalidSQL with a message precise enough to
+    send back to the model.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        if hasattr(self._conn, 'setconfig'):
+            # Python 3.12+: a misspelled "quoted name" is an error, not a string literal
+            self._conn.setconfig(sqlite3.SQLITE_DBCONFIG_DQS_DML, False)
+        self._versions = {}
+        self._columns = {}
+
+    def _sync(self):
+        # The catalog is read before taking the lock (it calls out under its own lock)
+        versions = {name: version for name, version in schema_catalog.table_versions().items()
+                    if not is_internal_table(name)}
+        with self._lock:
+            stale = [name for name, version in versions.items() if self._versions.get(name) != version]
+            removed = [name for name in self._versions if name not in versions]
+        if not stale and not removed:
+            return
+        schema = schema_catalog.get_schema()
+        with self._lock:
+            for table_name in removed + stale:
+                self._conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+                self._versions.pop(table_name, None)
+                self._columns.pop(table_name, None)
+            for table_name in stale:
+                info = schema.get(table_name)
+                if info is None:
+                    continue
+                columns = ", ".join(f"{quote_identifier(column)} {col_type}".strip()
+                                    for column, col_type in zip(info['columns'], info['types']))
+                self._conn.execute(f"CREATE TABLE {quote_identifier(table_name)} ({columns})")
+                self._versions[table_name] = versions[table_name]
+                self._columns[table_name] = list(info['columns'])
+
+    @staticmethod
+    def _authorize(action, arg1, arg2, *args):
+        if action == sqlite3.SQLITE_READ:
+            table_name = (arg1 or '').lower()
+            if table_name.startswith(DENIED_TABLE_PREFIXES) or is_internal_table(table_name):
+                return sqlite3.SQLITE_DENY
+        elif action == sqlite3.SQLITE_FUNCTION and (arg2 or '').lower() in DENIED_FUNCTIONS:
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK if action in READ_ONLY_ACTIONS else sqlite3.SQLITE_DENY
+
+    def _compile(self, sql):
+        """The error compiling sql raises, or None"""
+        with self._lock:
+            self._conn.set_authorizer(self._authorize)
+            try:
+                self._conn.execute(f"EXPLAIN {sql}").close()
+                return None
+            except (sqlite3.Error, sqlite3.Warning) as e:
+                return str(e)
+            finally:
+                self._conn.set_authorizer(None)
+
+    def _tables_in(self, sql, qualifier=None):
+        """Known tables the query reads, or the one a qualifier refers to"""
+        known = {name.lower(): name for name in self._columns}
+        aliases = table_aliases(sql)
+        if qualifier is not None:
+            table = known.get(aliases.get(qualifier.lower(), qualifier).lower())
+            if table is not None:
+                return [table]
+        return list(dict.fromkeys(known[name.lower()] for name in aliases.values() if name.lower() in known))
+
+    def _repair(self, sql, kind, name):
+        """(sql with the name fixed, replacement) or None"""
+        with self._lock:
+            if kind == 'table':
+                qualifier, target = None, closest_name(name, list(self._columns))
+            else:
+                qualifier, _, name = name.rpartition('.')
+                qualifier = qualifier or None
+                candidates = [column for table in self._tables_in(sql, qualifier) for column in self._columns[table]]
+                if qualifier is None:
+                    # e.g. ORDER BY a misspelled output alias
+                    candidates += output_aliases(sql)
+                target = closest_name(name, list(dict.fromkeys(candidates)))
+        if target is None:
+            return None
+        fixed = replace_name(sql, name, target, qualifier)
+        return (fixed, target) if fixed != sql else None
+
+    def _describe_unknown(self, sql, kind, name):
+        with self._lock:
+            if kind == 'table':
+                names = list(self._columns)
+                return (f"no such table: {name}. The tables are: "
+                        f"{', '.join(names[:MAX_LISTED_NAMES])}")
+            qualifier = name.rpartition('.')[0] or None
+            tables = self._tables_in(sql, qualifier)
+            listed = "; ".join(f"{table} has columns {', '.join(self._columns[table][:MAX_LISTED_NAMES])}"
+                               for table in tables)
+        return f"no such column: {name}" + (f". {listed}" if listed else "")
+
+    def validate(self, text, dialect='sqlite'):
+        """Return (sql, repairs) for a model response, or raise InvalidSQL.
+
+        repairs lists the local fixes made, e.g. ['prose', 'column']. For
+        other dialects (DuckDB) only names and read-only access are checked;
+        syntax SQLite does not know is left to the engine.
+        """
+        self._sync()
+        sql, repairs = extract_statement(text)
+        if calls_denied_function(sql):
+            raise InvalidSQL('not_read_only', READ_ONLY_MESSAGE)
+        for _ in range(MAX_LOCAL_REPAIRS + 1):
+            error = self._compile(sql)
+            if error is None:
+                break
+            # A denied function or action is "not authorized", a denied table read "prohibited"
+            if 'not authorized' in error or 'prohibited' in error:
+                raise InvalidSQL('not_read_only', READ_ONLY_MESSAGE)
+            unknown = UNKNOWN_NAME.match(error)
+            if unknown is None:
+                if dialect != 'sqlite':
+                    break
+                raise InvalidSQL('invalid', error)
+            kind, name = unknown.groups()
+            repaired = self._repair(sql, kind, name)
+            if repaired is None:
+                raise InvalidSQL(f'unknown_{kind}', self._describe_unknown(sql, kind, name))
+            sql = repaired[0]
+            repairs.append(kind)
+            print(f"Repaired unknown {kind} {name} -> {repaired[1]}")
+        else:
+            raise InvalidSQL('invalid', error)
+        for kind in repairs:
+            metrics.sql_repairs.inc(kind=kind)
+        return sql, repairs
+
+
+sql_validator = WorkspaceLocal(lambda workspace: SQLValidator())
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+# Every database the app opens goes to a scratch directory, and the model is
+# the offline FakeBackend; both must be set before the backend modules import
+SCRATCH_DIR = tempfile.mkdtemp(prefix='datachat-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(SCRATCH_DIR, 'data.db')
+os.environ['LLM_CACHE_PATH'] = os.path.join(SCRATCH_DIR, 'llm_cache.db')
+os.environ['RESULTS_DB_PATH'] = os.path.join(SCRATCH_DIR, 'results.db')
+os.environ['COLUMNAR_DB_PATH'] = os.path.join(SCRATCH_DIR, 'data.duckdb')
+os.environ['WORKSPACES_DIR'] = os.path.join(SCRATCH_DIR, 'workspaces')
+os.environ['LLM_BACKEND'] = 'fake'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import itertools  # noqa: E402
+import pytest  # noqa: E402
+from db import use_workspace  # noqa: E402
+import llm  # noqa: E402
+from llm import FakeBackend  # noqa: E402
+
+_workspaces = itertools.count()
+
+
+@pytest.fixture
+def workspace(request):
+    """Run the test in a fresh, empty workspace; yields its name"""
+    name = f"{request.module.__name__.rpartition('.')[2].replace('test_', '')}-{next(_workspaces)}"
+    with use_workspace(name):
+        yield name
+
+
+@pytest.fixture
+def client(workspace):
+    """Flask test client whose requests go to the test's workspace"""
+    from app import app
+    app.testing = True
+    with app.test_client() as client:
+        client.environ_base['HTTP_X_WORKSPACE'] = workspace
+        yield client
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Install an empty FakeBackend; set .responses in the test"""
+    backend = FakeBackend()
+    monkeypatch.setattr(llm, '_backend', backend)
+    return backend
@@ -0,0 +1,98 @@
+import threading
+import pandas as pd
+import pytest
+import aggregate_cache as aggregate_cache_module
+import query_guard
+from aggregate_cache import AggregateCache, parse_aggregate
+from database import write_table_from_chunks
+from db import use_workspace
+from engines import SQLiteEngine
+
+TOTALS = "SELECT region, SUM(amount) AS total FROM sales GROUP BY region"
+
+
+@pytest.fixture
+def cache(monkeypatch, workspace):
+    monkeypatch.setattr(aggregate_cache_module, 'AGG_CACHE_MIN_RUNS', 1)
+    monkeypatch.setattr(aggregate_cache_module, 'AGG_CACHE_MIN_MS', 0)
+    write_table_from_chunks([pd.DataFrame({'region': ['north', 'south', 'north', 'west'],
+                                           'amount': [10.0, 20.0, 5.0, 1.0]})], 'sales')
+    return AggregateCache()
+
+
+def run(cache, sql_query):
+    result = cache.execute(SQLiteEngine(), sql_query)
+    cache._builder.submit(lambda: None).result()  # wait for a queued build
+    return result
+
+
+def test_order_and_limit_variants_share_a_shape():
+    top = parse_aggregate(TOTALS + " ORDER BY total DESC LIMIT 5;")
+    assert top['key'] == parse_aggregate(TOTALS.lower() + " order by 2 limit 10")['key']
+    assert top['core'] == TOTALS
+    assert top['limit'] == '5'
+    assert parse_aggregate("SELECT region FROM sales ORDER BY region") is None
+    assert parse_aggregate("SELECT COUNT(*) FROM sales WHERE day < date('now')") is None
+    assert parse_aggregate("SELECT SUM(amount) * RANDOM() FROM sales") is None
+
+
+def test_variants_read_the_summary_table(cache):
+    run(cache, TOTALS)
+    result = run(cache, TOTALS + " ORDER BY total DESC LIMIT 2")
+    assert result.cost['materialized'].startswith('agg_mv_')
+    assert result.frame(100).values.tolist() == [['south', 20.0], ['north', 15.0]]
+    by_position = run(cache, TOTALS + " ORDER BY 1")
+    assert by_position.frame(100)['region'].tolist() == ['north', 'south', 'west']
+    # An ORDER BY over the source tables cannot be answered from the summary
+    assert 'materialized' not in run(cache, TOTALS + " ORDER BY MAX(amount)").cost
+    assert cache.report()['lookups']['hit'] == 2
+
+
+def test_writes_make_the_summary_stale_until_rebuilt(cache):
+    run(cache, TOTALS)
+    write_table_from_chunks([pd.DataFrame({'region': ['west'], 'amount': [100.0]})], 'sales', mode='append')
+    stale = cache.execute(SQLiteEngine(), TOTALS + " ORDER BY total DESC")
+    assert 'materialized' not in stale.cost
+    assert stale.frame(100).values.tolist()[0] == ['west', 101.0]
+    cache._builder.submit(lambda: None).result()
+    fresh = run(cache, TOTALS + " ORDER BY total DESC")
+    assert fresh.cost['materialized'] and fresh.frame(100).values.tolist()[0] == ['west', 101.0]
+
+
+def test_builds_over_the_governor_budget_are_dropped(cache, monkeypatch):
+    run(cache, TOTALS)
+    # Hold the builder so the budget shrinks between the query and its build
+    hold = threading.Event()
+    cache._builder.submit(hold.wait)
+    cache.execute(SQLiteEngine(), "SELECT a.region, COUNT(*) FROM sales a, sales b GROUP BY a.region")
+    monkeypatch.setattr(query_guard, 'QUERY_MAX_JOIN_ROWS', 10)
+    hold.set()
+    cache._builder.submit(lambda: None).result()
+    report = cache.report()
+    assert report['build_failures'] == {'cross_join': 1}
+    assert [shape['unusable'] for shape in report['candidates']] == ['over budget (cross_join)']
+    assert len(report['tables']) == 1
+
+
+def test_metrics_cover_every_workspace():
+    with use_workspace('aggregates-metrics'):
+        aggregate_cache_module.aggregate_cache.report()
+    families = {name: (values, labels) for name, _, _, values, labels
+                in aggregate_cache_module.aggregate_cache.collect_metrics()}
+    values, labels = families['aggregate_cache_tables']
+    assert labels == ('workspace',)
+    assert ('aggregates-metrics',) in values
+
+
+def test_a_closed_cache_still_answers_without_building(cache):
+    cache.close()
+    result = cache.execute(SQLiteEngine(), TOTALS)
+    assert result.frame(100)['region'].tolist() == ['north', 'south', 'west']
+    assert cache.report()['tables'] == [] and not cache._pending
+
+
+def test_dropping_a_workspace_stops_its_builder(workspace):
+    cache = aggregate_cache_module.aggregate_cache.current()
+    aggregate_cache_module.aggregate_cache._forget(workspace)
+    with pytest.raises(RuntimeError):
+        cache._builder.submit(lambda: None)
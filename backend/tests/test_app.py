@@ -0,0 +1,58 @@
+import io
+import json
+import query_pipeline
+
+
+def upload(client, body, **values):
+    return client.post('/upload/csv', data={'file': (io.BytesIO(body), 'items.csv'), **values},
+                       content_type='multipart/form-data')
+
+
+def test_upload_rejects_an_unknown_mode(client):
+    response = upload(client, b'id,price\n1,10\n', mode='merge')
+    assert response.status_code == 400
+    assert 'Unknown upload mode' in response.get_json()['error']
+
+
+def test_upload_rejects_a_missing_upsert_key_as_a_bad_request(client):
+    assert upload(client, b'id,price\n1,10\n').status_code == 200
+    response = upload(client, b'id,price\n1,12\n', mode='upsert', key='sku')
+    assert response.status_code == 400
+    assert 'sku' in response.get_json()['error']
+
+
+def stream(client, question):
+    response = client.post('/query/stream', json={'question': question})
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_stream_sends_sql_then_row_batches_then_explanation_then_done(client, fake_llm, monkeypatch):
+    monkeypatch.setattr(query_pipeline, 'ROW_BATCH_SIZE', 2)
+    fake_llm.responses = {'Write a SQL query': 'SELECT id, price FROM items ORDER BY id',
+                          'Provide a clear analysis': 'Five items, the priciest costs fifty rupees.'}
+    upload(client, b'id,price\n1,10\n2,20\n3,30\n4,40\n5,50\n')
+    events = stream(client, 'List every item with its price')
+    kinds = [event['type'] for event in events]
+    assert kinds == ['sql', 'rows', 'rows', 'rows', 'explanation', 'explanation', 'done']
+    assert events[0]['sql_query'] == 'SELECT id, price FROM items ORDER BY id'
+    assert [row['id'] for event in events[1:4] for row in event['rows']] == [1, 2, 3, 4, 5]
+    assert events[1]['rows'][0]['price'] == '₹10.00'
+    assert ''.join(event['text'] for event in events[4:6]) == 'Five items, the priciest costs fifty rupees.'
+    assert events[-1]['row_count'] == 5 and events[-1]['session_id']
+
+
+def test_stream_reports_a_failed_query_as_one_error_event(client, fake_llm):
+    fake_llm.responses = {'Write a SQL query': 'SELECT id FROM items WHERE price > 100'}
+    upload(client, b'id,price\n1,10\n')
+    assert stream(client, 'Which items cost more than a hundred?') == [{
+        'type': 'error', 'status': 404, 'error': 'No results found',
+        'sql_query': 'SELECT id FROM items WHERE price > 100', 'suggestion': 'Try modifying your question'}]
+
+
+def test_stream_reports_sql_the_model_cannot_fix(client, fake_llm):
+    fake_llm.default = 'SELECT colour FROM items'
+    upload(client, b'id,price\n1,10\n')
+    events = stream(client, 'What colour is each item?')
+    assert [(event['type'], event['status']) for event in events] == [('error', 400)]
+    assert events[0]['sql_query'] == 'SELECT colour FROM items'
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+import conversation_store
+from conversation_store import ConversationHistory, is_follow_up
+from db import use_workspace
+
+@pytest.fixture
+def history(workspace):
+    return ConversationHistory()
+
+
+def record(history, session_id, number):
+    results = pd.DataFrame({'city': [f"city{i}" for i in range(10)], 'orders': list(range(10))})
+    history.record(session_id, f"question {number}", f"SELECT {number}", results, len(results), 'explained')
+
+
+@pytest.mark.parametrize('question', [
+    'And for 2023?', 'what about Delhi', 'show those by month', 'Same but only returns', 'sort them by total'])
+def test_follow_ups_are_recognized(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize('question', ['Total sales by city', 'Which customers ordered in March?'])
+def test_standalone_questions_are_not_follow_ups(question):
+    assert not is_follow_up(question)
+
+
+def test_context_recaps_the_last_turns_oldest_first(history):
+    for number in range(5):
+        record(history, 's1', number)
+    context = history.context('s1', 'and for 2023?')
+    lines = context.splitlines()
+    assert [line for line in lines if line.startswith('Question:')] == [
+        'Question: question 2', 'Question: question 3', 'Question: question 4']
+    assert lines[1] == 'SQL: SELECT 2'
+    # A few sample rows, never the whole result
+    assert "10 rows of (city, orders), first rows [['city0', 0], ['city1', 1], ['city2', 2]]" in lines[2]
+    assert history.context('s1', 'Total sales by city') == ''
+    assert history.context(None, 'and for 2023?') == ''
+
+
+def test_context_reads_written_turns(history):
+    record(history, 's1', 1)
+    history.flush()
+    record(history, 's1', 2)
+    assert history.context('s1', 'same by month').count('Question:') == 2
+
+
+def test_context_stays_in_its_session_and_workspace(history):
+    record(history, 's1', 1)
+    record(history, 's2', 2)
+    history.flush()
+    assert 'question 2' not in history.context('s1', 'and those?')
+    with use_workspace('history-other'):
+        assert history.context('s1', 'and those?') == ''
+        assert history.recent('s1') == []
+
+
+def test_context_skips_old_turns(history, monkeypatch):
+    record(history, 's1', 1)
+    monkeypatch.setattr(conversation_store, 'HISTORY_CONTEXT_MINUTES', -1)
+    assert history.context('s1', 'and for 2023?') == ''
@@ -0,0 +1,65 @@
+import datetime
+import decimal
+import pandas as pd
+import pytest
+from engines import DuckDBEngine, _PlainValueCursor
+
+pytestmark = pytest.mark.usefixtures('workspace')
+
+
+@pytest.fixture
+def engine(tmp_path):
+    pytest.importorskip('duckdb')
+    engine = DuckDBEngine(str(tmp_path / 'columnar.duckdb'))
+    yield engine
+    engine.close()
+
+
+def duckdb_rows(engine, sql_query):
+    return engine._cursor().execute(sql_query).fetchall()
+
+
+def test_uploads_are_mirrored_into_duckdb(engine):
+    engine.load_table('items', [pd.DataFrame({'id': [1, 2], 'price': [10.0, 20.0]}),
+                                pd.DataFrame({'id': [3], 'price': [30.0]})])
+    assert duckdb_rows(engine, "SELECT id, price FROM items ORDER BY id") == [(1, 10.0), (2, 20.0), (3, 30.0)]
+    result = engine.execute("SELECT SUM(price) AS total FROM items")
+    assert result.preview['total'].tolist() == [60.0]
+
+
+def test_upserts_and_appends_are_merged_into_duckdb(engine):
+    engine.load_table('items', [pd.DataFrame({'id': [1, 2], 'price': [10.0, 20.0]})])
+    engine.load_table('items', [pd.DataFrame({'id': [2, 3, 3], 'price': [25.0, 30.0, 35.0], 'color': ['red', None, 'blue']})],
+                      mode='upsert', key_columns=['id'])
+    engine.load_table('items', [pd.DataFrame({'id': [4], 'price': [40.0]})], mode='append')
+    assert duckdb_rows(engine, "SELECT id, price, color FROM items ORDER BY id") == [
+        (1, 10.0, None), (2, 25.0, 'red'), (3, 35.0, 'blue'), (4, 40.0, None)]
+    assert engine.execute("SELECT COUNT(*) AS n FROM items").preview['n'].tolist() == [4]
+
+
+def test_queries_duckdb_rejects_fall_back_to_sqlite(engine, capsys):
+    engine.load_table('items', [pd.DataFrame({'id': [1, 2], 'price': [10.0, 20.0]})])
+    result = engine.execute("SELECT sqlite_version() IS NOT NULL AS ok, COUNT(*) AS n FROM items")
+    assert result.preview.values.tolist() == [[1, 2]]
+    assert 'falling back to SQLite' in capsys.readouterr().out
+
+
+class FakeCursor:
+    description = [('price', 'DECIMAL(10,2)'), ('sold_at', 'TIMESTAMP'), ('name', 'VARCHAR')]
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def test_plain_value_cursor_returns_sqlite_values():
+    cursor = _PlainValueCursor(FakeCursor([
+        (decimal.Decimal('9.99'), datetime.datetime(2024, 1, 5, 12, 30), 'a'),
+        (None, None, 'b'),
+    ]))
+    assert cursor.fetchone() == (9.99, '2024-01-05 12:30:00', 'a')
+    assert cursor.fetchmany(10) == [(None, None, 'b')]
+    assert cursor.fetchone() is None
@@ -0,0 +1,65 @@
+import datetime
+import io
+import pytest
+from db import get_database
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+def workbook(sheets):
+    book = openpyxl.Workbook()
+    book.remove(book.active)
+    for name, rows in sheets.items():
+        sheet = book.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    stream = io.BytesIO()
+    book.save(stream)
+    stream.seek(0)
+    return stream
+
+
+def upload(client, stream, **values):
+    return client.post('/upload/excel', data={'file': (stream, 'report.xlsx'), **values},
+                       content_type='multipart/form-data')
+
+
+def rows(table_name):
+    with get_database().reader() as conn:
+        return conn.execute(f"SELECT * FROM {table_name}").fetchall()
+
+
+def test_every_sheet_with_data_becomes_its_own_table(client):
+    response = upload(client, workbook({
+        'Sales 2024': [['id', 'amount', 'sold_on'], [1, 9.5, datetime.datetime(2024, 1, 2)], [2, 3, None]],
+        'Empty': [],
+        'Notes': [[None, None], ['note', None], ['first', None]],
+    }))
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['tables'] == ['report_Sales_2024', 'report_Notes']
+    assert [(sheet['sheet'], sheet['rows']) for sheet in payload['ingestion']['sheets']] == [
+        ('Sales 2024', 2), ('Notes', 1)]
+    assert rows('report_Sales_2024') == [(1, 9.5, '2024-01-02 00:00:00'), (2, 3.0, None)]
+    assert rows('report_Notes') == [('first',)]
+    assert payload['schema']['report_Sales_2024']['types'] == ['INTEGER', 'REAL', 'TIMESTAMP']
+
+
+def test_ragged_rows_and_headers_are_evened_out(client):
+    response = upload(client, workbook({'Budget': [
+        ['dept', None, 'amount', 'amount'],
+        ['A', 1, 10, 'n/a'],
+        ['B', 2, 'n/a', 5, 'extra'],
+        ['C'],
+    ]}))
+    assert response.status_code == 200
+    assert response.get_json()['tables'] == ['report']
+    assert response.get_json()['schema']['report']['columns'] == ['dept', 'column_2', 'amount', 'amount_2']
+    # Columns mixing numbers and text in the sample are stored as text
+    assert rows('report') == [('A', 1, '10', 'n/a'), ('B', 2, 'n/a', '5'), ('C', None, None, None)]
+
+
+def test_a_workbook_without_data_is_rejected(client):
+    response = upload(client, workbook({'Empty': [], 'Blank': [[None, None]]}))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'The workbook has no sheets with data'
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+import index_advisor as index_advisor_module
+from database import write_table_from_chunks
+from db import get_database
+from index_advisor import IndexAdvisor, index_candidates, is_key_column
+
+pytestmark = pytest.mark.usefixtures('workspace')
+
+
+def indexes(table_name):
+    with get_database().reader() as conn:
+        return sorted(row[1] for row in conn.execute(f"PRAGMA index_list({table_name})"))
+
+
+def test_key_column_names():
+    assert [column for column in ['id', 'customer_id', 'productKey', 'CustomerID', 'sku_key', 'paid', 'identity']
+            if is_key_column(column)] == ['id', 'customer_id', 'CustomerID', 'sku_key']
+
+
+def test_uploaded_key_columns_are_indexed_unless_too_repetitive():
+    write_table_from_chunks([pd.DataFrame({'order_id': range(100), 'customer_id': [i % 10 for i in range(100)],
+                                           'status_id': [1] * 100, 'amount': [1.0] * 100})], 'orders')
+    actions = {action['column']: action for action in IndexAdvisor().index_uploaded_table('orders')}
+    assert set(actions) == {'order_id', 'customer_id', 'status_id'}
+    assert actions['order_id']['reason'] == 'key column: every value is unique'
+    assert actions['customer_id']['status'] == 'created'
+    assert actions['status_id']['status'] == 'skipped'
+    assert indexes('orders') == ['auto_ix_orders_customer_id', 'auto_ix_orders_order_id']
+
+
+def test_filter_columns_are_indexed_after_the_scan_threshold(monkeypatch):
+    monkeypatch.setattr(index_advisor_module, 'INDEX_SCAN_THRESHOLD', 3)
+    write_table_from_chunks([pd.DataFrame({'city': [f'c{i % 50}' for i in range(500)], 'amount': range(500)})],
+                            'sales')
+    advisor = IndexAdvisor()
+    sql_query = "SELECT SUM(amount) FROM sales WHERE city = 'c7'"
+    assert advisor.observe_query(sql_query) == []
+    assert advisor.observe_query(sql_query) == []
+    assert advisor.observe_query(sql_query) == [('sales', 'city')]
+    advisor._builder.shutdown(wait=True)
+    assert indexes('sales') == ['auto_ix_sales_city']
+    assert advisor.report()['actions'][0]['source'] == 'query'
+    # Decided columns are not counted again
+    assert advisor.observe_query(sql_query) == []
+
+
+def test_automatic_join_indexes_are_candidates():
+    schema = {'orders': {'columns': ['order_id', 'customer_id'], 'types': ['INTEGER', 'INTEGER']},
+              'customers': {'columns': ['customer_id', 'name'], 'types': ['INTEGER', 'TEXT']}}
+    plan = ['SCAN c', 'SEARCH o USING AUTOMATIC COVERING INDEX (customer_id=?)']
+    sql_query = "SELECT c.name, COUNT(*) FROM customers c JOIN orders o ON o.customer_id = c.customer_id GROUP BY c.name"
+    assert index_candidates(sql_query, plan, schema) == {
+        ('orders', 'customer_id'): 'join column: SQLite built an automatic index'}
@@ -0,0 +1,75 @@
+import time
+import pytest
+from llm_cache import LLMCache, fingerprint, normalize_question, tables_in_sql
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(str(tmp_path / 'llm_cache.db'), ttl=60, max_entries=3)
+
+
+def test_normalize_question_ignores_case_punctuation_and_filler():
+    assert normalize_question("Show me the  TOTAL sales, please!") == "total sales"
+    assert normalize_question("total sales") == normalize_question("What are the total sales?")
+
+
+def test_normalize_question_keeps_negations_and_comparisons():
+    assert normalize_question("orders not shipped") != normalize_question("orders shipped")
+    assert normalize_question("sales above 100") != normalize_question("sales below 100")
+
+
+def test_fingerprint_separates_parts():
+    assert fingerprint('ab', 'c') != fingerprint('a', 'bc')
+
+
+def test_get_miss_then_hit(cache):
+    assert cache.get('k') is None
+    cache.put('k', 'sql', 'SELECT 1')
+    assert cache.get('k') == 'SELECT 1'
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+    assert stats['hit_rate'] == 0.5
+
+
+def test_expired_entries_miss(cache):
+    cache.put('k', 'sql', 'SELECT 1')
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get('k') is None
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for key in ('a', 'b', 'c'):
+        cache.put(key, 'sql', key)
+        time.sleep(0.01)
+    assert cache.get('a') == 'a'      # a is now more recent than b
+    cache.put('d', 'sql', 'd')
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in ('a', 'c', 'd')] == ['a', 'c', 'd']
+
+
+def test_invalidate_table_drops_entries_and_changes_stamp(cache):
+    cache.put('sql', 'sql', 'SELECT * FROM orders', ['orders'])
+    cache.put('other', 'sql', 'SELECT * FROM customers', ['customers'])
+    before = cache.data_fingerprint(['orders'])
+    cache.invalidate_table('orders')
+    assert cache.get('sql') is None
+    assert cache.get('other') == 'SELECT * FROM customers'
+    assert cache.data_fingerprint(['orders']) != before
+
+
+def test_data_only_change_keeps_generated_sql(cache):
+    cache.put('sql', 'sql', 'SELECT * FROM orders', ['orders'])
+    cache.put('explanation', 'explanation', 'Explained.', ['orders'])
+    cache.invalidate_table('orders', schema_changed=False)
+    assert cache.get('sql') == 'SELECT * FROM orders'
+    assert cache.get('explanation') is None
+
+
+def test_tables_in_sql_only_counts_from_and_join():
+    tables = ['orders', 'customers', 'products']
+    sql = ("SELECT c.name, o.order_id AS orders FROM customers c JOIN orders o ON o.customer_id = c.id "
+           "WHERE c.note <> 'products'")
+    assert tables_in_sql(sql, tables) == ['customers', 'orders']
+    assert tables_in_sql("SELECT 'from products' AS orders FROM customers", tables) == ['customers']
+    assert tables_in_sql('SELECT * FROM "Orders"', tables) == ['orders']
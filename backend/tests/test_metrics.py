@@ -0,0 +1,76 @@
+import io
+import pytest
+import metrics as metrics_module
+from metrics import Counter, Histogram, Metrics
+
+
+def test_histogram_quantiles_cover_the_recent_window(monkeypatch):
+    monkeypatch.setattr(metrics_module, 'QUANTILE_WINDOW', 100)
+    histogram = Histogram('latency_seconds', 'Latency', ('stage',))
+    for value in range(1, 101):
+        histogram.observe(float(value), stage='sql')
+    assert histogram.quantiles(stage='sql') == {0.5: 51.0, 0.95: 96.0, 0.99: 100.0}
+    # Older observations fall out of the window
+    for _ in range(100):
+        histogram.observe(1000.0, stage='sql')
+    assert histogram.quantiles(stage='sql') == {0.5: 1000.0, 0.95: 1000.0, 0.99: 1000.0}
+    assert histogram.quantiles(stage='other') == {0.5: 0.0, 0.95: 0.0, 0.99: 0.0}
+
+
+def test_histogram_renders_cumulative_buckets_and_a_summary():
+    histogram = Histogram('latency_seconds', 'Latency', ('stage',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, stage='sql')
+    lines = histogram.render()
+    assert lines[:7] == [
+        '# HELP datachat_latency_seconds Latency',
+        '# TYPE datachat_latency_seconds histogram',
+        'datachat_latency_seconds_bucket{stage="sql",le="0.1"} 1',
+        'datachat_latency_seconds_bucket{stage="sql",le="1.0"} 2',
+        'datachat_latency_seconds_bucket{stage="sql",le="+Inf"} 3',
+        'datachat_latency_seconds_sum{stage="sql"} 5.55',
+        'datachat_latency_seconds_count{stage="sql"} 3',
+    ]
+    assert '# TYPE datachat_latency_seconds_recent summary' in lines
+    assert 'datachat_latency_seconds_recent{stage="sql",quantile="0.5"} 0.5' in lines
+    assert 'datachat_latency_seconds_recent_count{stage="sql"} 3' in lines
+
+
+def test_counter_labels_are_escaped():
+    counter = Counter('errors_total', 'Errors', ('message',))
+    counter.inc(message='bad "quote"\n')
+    counter.inc(2, message='bad "quote"\n')
+    assert counter.render()[-1] == 'datachat_errors_total{message="bad \\"quote\\"\\n"} 3'
+
+
+def test_spans_time_stages_even_when_they_fail():
+    metrics = Metrics()
+    with metrics.span('query', 'sql_generation'):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.span('query', 'sql_generation'):
+            raise RuntimeError('model unavailable')
+    assert 'datachat_stage_duration_seconds_count{pipeline="query",stage="sql_generation"} 2' in metrics.render()
+
+
+def test_collectors_are_rendered_and_failures_skipped(capsys):
+    metrics = Metrics()
+    metrics.add_collector(lambda: [('cache_entries', 'gauge', 'Entries', {('sql',): 3}, ('kind',))])
+    metrics.add_collector(lambda: 1 / 0)
+    text = metrics.render()
+    assert '# TYPE datachat_cache_entries gauge\ndatachat_cache_entries{kind="sql"} 3\n' in text
+    assert 'Metrics collector failed' in capsys.readouterr().out
+
+
+def test_metrics_endpoint_reports_query_stages(client, fake_llm):
+    fake_llm.responses = {'Write a SQL query': 'SELECT COUNT(*) AS n FROM orders',
+                          'Provide a clear analysis': 'Two orders.'}
+    client.post('/upload/csv', data={'file': (io.BytesIO(b'order_id,qty\n1,5\n2,6\n'), 'orders.csv')},
+                content_type='multipart/form-data')
+    assert client.post('/query', json={'question': 'How many orders are there?'}).status_code == 200
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    for stage in ('total', 'sql_generation', 'sql_execution', 'explanation'):
+        assert f'datachat_stage_duration_seconds_count{{pipeline="query",stage="{stage}"}}' in text
+    assert 'datachat_stage_duration_seconds_count{pipeline="upload",stage="index"}' in text
@@ -0,0 +1,57 @@
+import sqlite3
+import pytest
+import query_guard
+from query_guard import QueryGovernor, QueryTooExpensive
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, customer_id INTEGER, amount REAL)")
+    conn.execute("CREATE TABLE customers (customer_id INTEGER PRIMARY KEY, city TEXT)")
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?)", [(i, i % 50, i * 1.0) for i in range(1, 2001)])
+    conn.executemany("INSERT INTO customers VALUES (?, ?)", [(i, f"city{i % 7}") for i in range(1, 501)])
+    return conn
+
+
+def test_join_on_a_key_passes(conn, monkeypatch):
+    monkeypatch.setattr(query_guard, 'QUERY_MAX_JOIN_ROWS', 10000)
+    stats = QueryGovernor().check_plan(
+        conn, "SELECT c.city, SUM(o.amount) FROM orders o JOIN customers c ON c.customer_id = o.customer_id "
+              "GROUP BY c.city")
+    assert stats['estimated_join_rows'] == 0
+    assert stats['full_scans'] == 1
+
+
+def test_cross_join_over_the_budget_is_rejected(conn, monkeypatch):
+    monkeypatch.setattr(query_guard, 'QUERY_MAX_JOIN_ROWS', 10000)
+    with pytest.raises(QueryTooExpensive) as raised:
+        QueryGovernor().check_plan(conn, "SELECT COUNT(*) FROM orders o, customers c WHERE o.amount > length(c.city)")
+    assert raised.value.reason == 'cross_join'
+    assert raised.value.cost['estimated_join_rows'] == 2000 * 500
+    assert 'orders' in str(raised.value) and 'customers' in str(raised.value)
+
+
+def test_cross_join_under_the_budget_passes(conn):
+    stats = QueryGovernor().check_plan(conn, "SELECT COUNT(*) FROM orders, customers")
+    assert stats['estimated_join_rows'] == 2000 * 500
+
+
+def test_vm_budget_stops_a_runaway_query(conn, monkeypatch):
+    monkeypatch.setattr(query_guard, 'QUERY_MAX_VM_INSTRUCTIONS', 200000)
+    governor = QueryGovernor()
+    sql = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 10000000) "
+           "SELECT COUNT(*) FROM n")
+    with pytest.raises(QueryTooExpensive) as raised:
+        with governor.sqlite_limits(conn, sql):
+            conn.execute(sql).fetchall()
+    assert raised.value.reason == 'vm_budget'
+    assert governor.report()['statuses'] == {'vm_budget': 1}
+
+
+def test_costs_are_recorded(conn):
+    governor = QueryGovernor()
+    with governor.sqlite_limits(conn, "SELECT COUNT(*) FROM orders") as cost:
+        cost['rows'] = len(conn.execute("SELECT COUNT(*) FROM orders").fetchall())
+    recent = governor.report()['recent'][0]
+    assert (recent['status'], recent['rows'], recent['full_scans']) == ('ok', 1, 1)
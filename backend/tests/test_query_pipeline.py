@@ -0,0 +1,43 @@
+import asyncio
+import pandas as pd
+from database import schema_catalog
+from db import use_workspace
+from engines import get_engine
+from ingest import load_chunks
+import query_pipeline
+from query_pipeline import cache_tables, generate_sql, llm_cache, run_in_background
+
+
+def test_appended_rows_keep_the_sql_cache_key():
+    with use_workspace('pipeline-append'):
+        load_chunks('orders', iter([pd.DataFrame({'id': [1, 2], 'region': ['north', 'south']})]))
+        before = schema_catalog.prompt_schema()
+        sql, key, cached = asyncio.run(generate_sql('How many orders per region?', before, get_engine()))
+        llm_cache.put(key, 'sql', sql, cache_tables(['orders']))
+
+        load_chunks('orders', iter([pd.DataFrame({'id': [3], 'region': ['west']})]), mode='append')
+        after = schema_catalog.prompt_schema()
+        assert after != before  # the column hints list the new value
+        assert asyncio.run(generate_sql('How many orders per region?', after, get_engine())) == (sql, key, True)
+
+
+def test_new_columns_change_the_sql_cache_key():
+    with use_workspace('pipeline-columns'):
+        load_chunks('orders', iter([pd.DataFrame({'id': [1], 'region': ['north']})]))
+        _, key, _ = asyncio.run(generate_sql('How many orders?', schema_catalog.prompt_schema(), get_engine()))
+        load_chunks('orders', iter([pd.DataFrame({'id': [2], 'amount': [5.0]})]), mode='append')
+        _, new_key, _ = asyncio.run(generate_sql('How many orders?', schema_catalog.prompt_schema(), get_engine()))
+        assert new_key != key
+
+
+def test_background_failures_are_logged(capsys):
+    def observe_query(sql_query):
+        raise RuntimeError(f"cannot explain {sql_query}")
+
+    async def run():
+        await asyncio.wait([run_in_background(observe_query, 'SELECT 1')])
+        await asyncio.sleep(0)  # done callbacks run on the next loop iteration
+
+    asyncio.run(run())
+    assert 'Background observe_query failed: cannot explain SELECT 1' in capsys.readouterr().out
+    assert not query_pipeline._background_jobs
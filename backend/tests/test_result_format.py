@@ -0,0 +1,33 @@
+import pandas as pd
+from result_format import classify_columns, format_frame
+
+
+def test_count_pattern_matches_whole_segments_only():
+    df = pd.DataFrame({'account_id': [1], 'discount_rate': [5.0], 'order_count': [3.0],
+                       'num_orders': [2], 'NumberOfItems': [1], 'counts': [4]})
+    kinds = classify_columns(df)
+    assert 'account_id' not in kinds
+    assert kinds['discount_rate'] == 'percentage'
+    assert kinds['order_count'] == 'count'
+    assert kinds['num_orders'] == 'count'
+    assert kinds['NumberOfItems'] == 'count'
+    assert kinds['counts'] == 'count'
+
+
+def test_monetary_and_percentage_columns():
+    df = pd.DataFrame({'UnitPrice': [14.5], 'total sales': [10.0], 'pct_returned': [12.345]})
+    kinds = classify_columns(df)
+    assert kinds == {'UnitPrice': 'monetary', 'total sales': 'monetary', 'pct_returned': 'percentage'}
+    formatted = format_frame(df)
+    assert formatted['UnitPrice'][0] == '₹14.50'
+    assert formatted['pct_returned'][0] == '12.35%'
+
+
+def test_monetary_patterns_match_anywhere_in_the_name():
+    # The original formatter tested 'price' in key.lower(); keep every name it matched
+    df = pd.DataFrame({'unitprice': [3.0], 'totalrevenue': [1234.5], 'totalspent': [float('nan')],
+                       'AmountDue': [7], 'account_id': [42]})
+    assert classify_columns(df) == {'unitprice': 'monetary', 'totalrevenue': 'monetary',
+                                    'totalspent': 'monetary', 'AmountDue': 'monetary'}
+    formatted = format_frame(df)
+    assert formatted.iloc[0].tolist() == ['₹3.00', '₹1234.50', None, '₹7.00', 42]
@@ -0,0 +1,74 @@
+import os
+import sys
+import sqlite3
+import subprocess
+import pytest
+import result_store as result_store_module
+from db import use_workspace
+from result_store import ResultExpired, ResultStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    monkeypatch.setattr(result_store_module, 'result_store', store)
+    monkeypatch.setattr(result_store_module, 'INITIAL_ROW_CAP', 100)
+    return store
+
+
+def rows_cursor(count):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER, amount REAL)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", [(i, i * 1.5) for i in range(count)])
+    return conn.execute("SELECT id, amount FROM t ORDER BY id")
+
+
+def test_small_results_stay_in_memory(store):
+    result = store.collect(rows_cursor(100))
+    assert result.result_id is None
+    assert (result.row_count, len(result.preview), result.has_more) == (100, 100, False)
+
+
+def test_large_results_are_spilled_and_paged(store):
+    result = store.collect(rows_cursor(250))
+    assert result.result_id is not None
+    assert (result.row_count, len(result.preview), result.has_more) == (250, 100, True)
+    page = store.fetch_rows(result.result_id, 240, 50)
+    assert page['row_count'] == 250
+    assert page['rows']['id'].tolist() == list(range(240, 250))
+    assert result.frame(150)['id'].tolist() == list(range(150))
+
+
+def test_results_beyond_the_row_limit_are_truncated(store, monkeypatch):
+    monkeypatch.setattr(result_store_module, 'MAX_RESULT_ROWS', 200)
+    result = store.collect(rows_cursor(250))
+    assert (result.row_count, result.truncated) == (200, True)
+
+
+def test_expired_results_report_a_clear_error(store, monkeypatch):
+    result = store.collect(rows_cursor(250))
+    monkeypatch.setattr(result_store_module, 'RESULT_TTL_SECONDS', -1)
+    assert store.cleanup_expired(force=True) == 1
+    assert store.fetch_rows(result.result_id, 0, 10) is None
+    assert result.frame(50)['id'].tolist() == list(range(50))
+    with pytest.raises(ResultExpired, match='expired'):
+        result.frame(150)
+
+
+def test_results_are_only_readable_from_their_workspace(store):
+    with use_workspace('results-owner'):
+        result = store.collect(rows_cursor(250))
+    with use_workspace('results-other'):
+        assert store.fetch_rows(result.result_id, 0, 10) is None
+        with pytest.raises(ResultExpired):
+            result.frame(150)
+    with use_workspace('results-owner'):
+        assert store.fetch_rows(result.result_id, 0, 10)['rows']['id'].tolist() == list(range(10))
+
+
+def test_importing_creates_no_database(tmp_path):
+    path = tmp_path / 'results.db'
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', 'import result_store'], cwd=backend, check=True,
+                   env={**os.environ, 'RESULTS_DB_PATH': str(path)})
+    assert not path.exists()
@@ -0,0 +1,44 @@
+import pandas as pd
+from result_summary import _stratified_sample, column_statistics, estimate_tokens, summarize_result
+
+
+def sales(rows):
+    regions = ['north', 'south', 'east', 'west']
+    return pd.DataFrame({'order_id': range(rows), 'region': [regions[i % 4] for i in range(rows)],
+                         'amount': [float(i % 97) for i in range(rows)]})
+
+
+def test_small_results_are_included_verbatim():
+    text = summarize_result(sales(5))
+    assert text.startswith('5 rows (complete):\norder_id,region,amount\n0,north,0.0')
+
+
+def test_large_results_are_summarized_within_the_token_budget():
+    for budget in (3000, 800, 300):
+        text = summarize_result(sales(20000), token_budget=budget)
+        assert estimate_tokens(text) <= budget
+        assert text.startswith('20000 rows in total; showing a summary.')
+        assert 'Column statistics:\n  - order_id (numeric): count=20000' in text
+
+
+def test_partial_results_mention_the_full_row_count():
+    text = summarize_result(sales(100), total_rows=50000)
+    assert text.startswith('50000 rows in total; showing a summary of the first 100.')
+
+
+def test_sample_covers_every_group_of_a_categorical_column():
+    df = sales(1000).sort_values('region')
+    sample = _stratified_sample(df, 20)
+    assert len(sample) == 20
+    assert sample['region'].value_counts().to_dict() == {'east': 5, 'north': 5, 'south': 5, 'west': 5}
+
+
+def test_sample_without_a_grouping_column_is_evenly_spaced():
+    df = pd.DataFrame({'id': range(100)})
+    assert _stratified_sample(df, 5)['id'].tolist() == [0, 24, 49, 74, 99]
+
+
+def test_categorical_statistics():
+    stats = column_statistics(pd.DataFrame({'region': ['north', 'north', 'south', None]}))
+    assert stats['region'] == {'type': 'categorical', 'count': 3, 'null_rate': 0.25, 'distinct': 2,
+                               'top': {'north': 2, 'south': 1}, 'min': 'north', 'max': 'south'}
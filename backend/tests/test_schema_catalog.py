@@ -0,0 +1,50 @@
+from db import Database
+from schema_catalog import SchemaCatalog
+
+
+def make_catalog(tmp_path):
+    database = Database(str(tmp_path / 'catalog.db'))
+    with database.writer() as conn:
+        conn.execute("CREATE TABLE a (x INTEGER)")
+        conn.execute("CREATE TABLE b (y TEXT)")
+    catalog = SchemaCatalog(database.reader)
+    catalog.reload()
+    return database, catalog
+
+
+def test_refresh_table_picks_up_ddl_from_other_connections(tmp_path):
+    database, catalog = make_catalog(tmp_path)
+    other = Database(database.path)
+    with other.writer() as conn:
+        conn.execute("ALTER TABLE b ADD COLUMN z REAL")
+    with database.writer() as conn:
+        conn.execute("ALTER TABLE a ADD COLUMN w TEXT")
+    catalog.refresh_table('a')
+    schema = catalog.get_schema()
+    assert schema['a']['columns'] == ['x', 'w']
+    assert schema['b']['columns'] == ['y', 'z']
+
+
+def test_listeners_hear_about_the_refreshed_table(tmp_path):
+    database, catalog = make_catalog(tmp_path)
+    changes = []
+    catalog.add_listener(lambda table_name, schema_changed: changes.append((table_name, schema_changed)))
+    with database.writer() as conn:
+        conn.execute("INSERT INTO a VALUES (1)")
+    catalog.refresh_table('a')
+    with database.writer() as conn:
+        conn.execute("ALTER TABLE a ADD COLUMN w TEXT")
+    catalog.refresh_table('a')
+    assert changes == [('a', False), ('a', True)]
+    assert catalog.table_version('a') > catalog.table_version('b')
+
+
+def test_schema_lists_only_user_tables(tmp_path):
+    database, catalog = make_catalog(tmp_path)
+    with database.writer() as conn:
+        conn.execute("CREATE TABLE table_metadata (table_name TEXT)")
+        conn.execute("CREATE TABLE index_advisor_log (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+        conn.execute("INSERT INTO index_advisor_log DEFAULT VALUES")
+        conn.execute("CREATE TABLE agg_mv_0123 (total REAL)")
+    catalog.reload()
+    assert sorted(catalog.get_schema()) == ['a', 'b']
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+import schema_index as schema_index_module
+from database import schema_catalog, write_table_from_chunks
+from schema_catalog import prompt_tables
+from schema_index import SchemaIndex, join_keys, tokenize
+
+pytestmark = pytest.mark.usefixtures('workspace')
+
+FILLER_TABLES = ['weather', 'inventory', 'payroll', 'shipments', 'campaigns', 'tickets', 'suppliers', 'budgets']
+
+
+def load(table_name, **columns):
+    write_table_from_chunks([pd.DataFrame(columns)], table_name)
+
+
+@pytest.fixture
+def workspace_tables():
+    load('customers', id=[1, 2], name=['Asha', 'Ravi'], city=['Pune', 'Delhi'])
+    load('orders', order_id=[10, 11], customer_id=[1, 2], amount=[99.5, 12.0])
+    load('order_items', item_id=[1, 2], order_id=[10, 11], product=['tea', 'rice'])
+    for name in FILLER_TABLES:
+        load(name, **{f'{name}_code': ['a', 'b'], f'{name}_value': [1, 2]})
+    return schema_catalog.prompt_schema()
+
+
+def test_tokens_and_join_keys():
+    assert tokenize('How many orderItems per customerId in the cities?') == ['order', 'item', 'customer', 'id', 'city']
+    assert join_keys('customers', ['id', 'name', 'region_id']) == {'customer_id', 'region_id'}
+
+
+def test_small_workspaces_get_the_full_schema(workspace_tables, monkeypatch):
+    monkeypatch.setattr(schema_index_module, 'SCHEMA_PRUNE_MIN_TABLES', 12)
+    assert SchemaIndex().relevant_schema('Total order amount per city', workspace_tables) == workspace_tables
+
+
+def test_large_workspaces_keep_matching_tables_and_their_join_neighbours(workspace_tables, monkeypatch):
+    monkeypatch.setattr(schema_index_module, 'SCHEMA_TOP_TABLES', 1)
+    schema_str = SchemaIndex().relevant_schema('Which city spends the most?', workspace_tables)
+    # customers matches the question; orders joins it through customer_id,
+    # order_items only through orders, so it is left out
+    assert prompt_tables(schema_str) == ['customers', 'orders']
+    assert len(schema_str) < len(workspace_tables)
+
+
+def test_questions_matching_no_table_get_the_full_schema(workspace_tables):
+    assert SchemaIndex().relevant_schema('Anything interesting?', workspace_tables) == workspace_tables
+
+
+def test_changed_tables_are_reindexed(workspace_tables):
+    index = SchemaIndex()
+    assert index.rank('Which warehouse holds tea?')[0][0] == 'order_items'
+    load('weather', warehouse=['north depot'], reading=[1])
+    assert index.rank('Which warehouse?')[0][0] == 'weather'
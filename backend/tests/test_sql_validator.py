@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+from database import write_table_from_chunks
+from db import use_workspace
+from sql_validator import InvalidSQL, SQLValidator, extract_statement
+
+
+@pytest.fixture(scope='module')
+def validator():
+    with use_workspace('validator'):
+        write_table_from_chunks([pd.DataFrame({'order_id': [1], 'customer_name': ['a'], 'amount': [1.0]})], 'orders')
+        yield SQLValidator()
+
+
+def reason(validator, sql, dialect='sqlite'):
+    with pytest.raises(InvalidSQL) as raised:
+        validator.validate(sql, dialect)
+    return raised.value.reason
+
+
+def test_prose_and_fences_are_dropped():
+    text = "Here is the query:\n```sql\nSELECT amount FROM orders;\n```\nIt sums nothing."
+    assert extract_statement(text) == ('SELECT amount FROM orders', ['prose'])
+    assert extract_statement("SELECT amount\nFROM orders\n\nThis lists amounts.") == (
+        'SELECT amount\nFROM orders', ['prose'])
+
+
+def test_writes_and_several_statements_are_rejected(validator):
+    assert reason(validator, "DELETE FROM orders") == 'not_read_only'
+    assert reason(validator, "SELECT 1; DROP TABLE orders") == 'multiple_statements'
+    assert reason(validator, "The table is empty.") == 'no_sql'
+
+
+def test_near_miss_names_are_repaired(validator):
+    assert validator.validate("SELECT custmer_name, amout FROM ordrs") == (
+        'SELECT customer_name, amount FROM orders', ['table', 'column', 'column'])
+    assert validator.validate("SELECT o.amout FROM orders o")[0] == 'SELECT o.amount FROM orders o'
+
+
+def test_misspelled_output_aliases_are_repaired(validator):
+    sql, repairs = validator.validate(
+        "SELECT customer_name, COUNT(*) AS number FROM orders GROUP BY customer_name ORDER BY numbr DESC")
+    assert sql.endswith("ORDER BY number DESC") and repairs == ['column']
+
+
+def test_unknown_names_list_the_real_ones(validator):
+    with pytest.raises(InvalidSQL) as raised:
+        validator.validate("SELECT region FROM orders")
+    assert raised.value.reason == 'unknown_column'
+    assert 'orders has columns order_id, customer_name, amount' in str(raised.value)
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT load_extension('/tmp/evil.so')",
+    "SELECT readfile('/etc/passwd')",
+    "SELECT writefile('/tmp/x', customer_name) FROM orders",
+    "SELECT name, sql FROM sqlite_master",
+    "SELECT * FROM pragma_table_info('orders')",
+])
+def test_extensions_files_and_the_catalog_are_off_limits(validator, sql):
+    assert reason(validator, sql) == 'not_read_only'
+
+
+def test_bookkeeping_tables_are_not_uploaded_data(validator):
+    with pytest.raises(InvalidSQL) as raised:
+        validator.validate("SELECT question FROM conversation_history")
+    assert raised.value.reason == 'unknown_table'
+    assert 'table_metadata' not in str(raised.value)
+
+
+def test_other_dialects_still_cannot_read_files(validator):
+    assert reason(validator, "SELECT * FROM read_csv_auto('/etc/passwd')", 'duckdb') == 'not_read_only'
+    # Syntax SQLite does not know is left to the engine
+    sql = "SELECT amount::INTEGER FROM orders"
+    assert validator.validate(sql, 'duckdb') == (sql, [])
+
+
+def test_ordinary_functions_are_allowed(validator):
+    sql = "SELECT customer_name FROM orders WHERE customer_name GLOB 'a*' AND customer_name LIKE 'a%'"
+    assert validator.validate(sql) == (sql, [])
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+from database import write_table_from_chunks, get_table_metadata
+from db import get_database
+
+pytestmark = pytest.mark.usefixtures('workspace')
+
+
+def rows(table_name):
+    with get_database().reader() as conn:
+        return conn.execute(f"SELECT * FROM {table_name} ORDER BY id").fetchall()
+
+
+def test_upsert_inserts_new_keys_and_updates_changed_rows():
+    write_table_from_chunks([pd.DataFrame({'id': [1, 2, 3], 'price': [10.0, 20.0, 30.0]})],
+                            'items', mode='upsert', key_columns=['id'])
+    stats = write_table_from_chunks(
+        [pd.DataFrame({'id': [2, 3], 'price': [20.0, 35.0]}), pd.DataFrame({'id': [4], 'price': [40.0]})],
+        'items', mode='upsert', key_columns=['id'])
+    assert (stats['rows'], stats['inserted'], stats['updated'], stats['unchanged']) == (3, 1, 1, 1)
+    assert stats['table_rows'] == 4
+    assert rows('items') == [(1, 10.0), (2, 20.0), (3, 35.0), (4, 40.0)]
+    metadata = get_table_metadata('items')
+    assert (metadata['version'], metadata['key_columns'], metadata['row_count']) == (2, ['id'], 4)
+
+
+def test_upsert_adds_new_columns():
+    write_table_from_chunks([pd.DataFrame({'id': [1, 2], 'price': [10.0, 20.0]})], 'items')
+    stats = write_table_from_chunks([pd.DataFrame({'id': [2], 'price': [25.0], 'color': ['red']})],
+                                    'items', mode='upsert', key_columns=['id'])
+    assert stats['added_columns'] == ['color']
+    assert rows('items') == [(1, 10.0, None), (2, 25.0, 'red')]
+
+
+def test_upsert_rejects_a_key_with_existing_duplicates():
+    write_table_from_chunks([pd.DataFrame({'id': [1, 1], 'price': [10.0, 11.0]})], 'items')
+    with pytest.raises(ValueError, match='duplicate values'):
+        write_table_from_chunks([pd.DataFrame({'id': [1], 'price': [12.0]})],
+                                'items', mode='upsert', key_columns=['id'])
+    assert rows('items') == [(1, 10.0), (1, 11.0)]
+
+
+def test_append_conflicting_with_an_upsert_key_leaves_the_table_untouched():
+    write_table_from_chunks([pd.DataFrame({'id': [1], 'price': [10.0]})], 'items', mode='upsert', key_columns=['id'])
+    with pytest.raises(ValueError, match='conflict'):
+        write_table_from_chunks([pd.DataFrame({'id': [2, 1], 'price': [20.0, 11.0]})], 'items', mode='append')
+    assert rows('items') == [(1, 10.0)]
+    assert get_table_metadata('items')['version'] == 1
+
+
+def test_upsert_needs_key_columns_in_the_data():
+    with pytest.raises(ValueError, match='not in the uploaded data'):
+        write_table_from_chunks([pd.DataFrame({'sku': [1]})], 'items', mode='upsert', key_columns=['id'])
@@ -0,0 +1,144 @@
+import gc
+import sqlite3
+import threading
+import pandas as pd
+import pytest
+import engines
+from database import schema_catalog, write_table_from_chunks
+from db import Database, WorkspaceLocal, Workspaces, get_database, use_workspace, workspaces
+from engines import get_engine
+
+
+def test_workspaces_keep_their_own_tables():
+    for workspace, cities in (('tenant-a', ['Pune']), ('tenant-b', ['Goa', 'Delhi'])):
+        with use_workspace(workspace):
+            write_table_from_chunks([pd.DataFrame({'city': cities})], 'orders')
+    with use_workspace('tenant-a'):
+        assert get_engine().execute("SELECT city FROM orders").frame(10)['city'].tolist() == ['Pune']
+    with use_workspace('tenant-b'):
+        assert get_engine().execute("SELECT COUNT(*) AS n FROM orders").frame(10)['n'].tolist() == [2]
+        assert 'orders' in schema_catalog.get_schema()
+    assert 'orders' not in schema_catalog.get_schema()
+
+
+def test_least_recently_used_workspaces_are_closed():
+    registry = Workspaces(max_open=2)
+    for workspace in ('lru-a', 'lru-b', 'lru-a', 'lru-c'):
+        registry.database(workspace)
+    assert registry.names() == ['default', 'lru-a', 'lru-c']
+    assert registry.evicted == 1
+
+
+def test_databases_in_use_stay_open():
+    registry = Workspaces(max_open=1)
+    with registry.database('busy-a').reader():
+        registry.database('busy-b')
+        assert registry.names() == ['default', 'busy-a', 'busy-b']
+    registry.database('busy-c')
+    assert registry.names() == ['default', 'busy-c']
+
+
+def test_a_closed_workspace_reopens_the_same_database():
+    registry = Workspaces(max_open=1)
+    database = registry.database('reopen-a')
+    registry.database('reopen-b')
+    assert registry.names() == ['default', 'reopen-b']
+    # A request still holding the handle writes through the one writer there is
+    with database.writer() as conn:
+        conn.execute("CREATE TABLE t (x)")
+    assert registry.database('reopen-a') is database
+    with database.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+
+
+def test_closed_databases_are_forgotten_once_released():
+    registry = Workspaces(max_open=1)
+    database = registry.database('forget-a')
+    registry.database('forget-b')
+    assert 'forget-a' in registry._databases
+    del database
+    gc.collect()
+    assert 'forget-a' not in registry._databases
+    assert registry.database('forget-a') is not None
+
+
+def test_open_hooks_only_hold_up_their_own_workspace():
+    registry = Workspaces()
+    release, started, opened = threading.Event(), threading.Event(), []
+
+    def hook(database):
+        if database.path.endswith('slow-a.db'):
+            started.set()
+            release.wait(5)
+        opened.append(database.path)
+    registry.add_open_hook(hook)
+
+    slow = [threading.Thread(target=registry.database, args=('slow-a',)) for _ in range(2)]
+    slow[0].start()
+    started.wait(5)
+    slow[1].start()
+    # Neither the lock nor the slow workspace's setup blocks another workspace
+    registry.database('slow-b')
+    assert [path.rpartition('/')[2] for path in opened] == ['slow-b.db']
+    release.set()
+    for thread in slow:
+        thread.join(5)
+    # The second request for slow-a waited for the first one's setup instead of repeating it
+    assert [path.rpartition('/')[2] for path in opened] == ['slow-b.db', 'slow-a.db']
+
+
+def test_a_failed_open_is_retried():
+    registry = Workspaces()
+    failures = [RuntimeError('disk full')]
+
+    def hook(database):
+        if failures:
+            raise failures.pop()
+    registry.add_open_hook(hook)
+    with pytest.raises(RuntimeError, match='disk full'):
+        registry.database('retry-a')
+    assert registry.names() == ['default']
+    registry.database('retry-a')
+    assert registry.names() == ['default', 'retry-a']
+
+
+def test_readers_returned_after_close_are_closed(tmp_path):
+    database = Database(str(tmp_path / 'pool.db'))
+    with database.reader() as borrowed:
+        with database.reader() as idle:
+            pass
+        database.close()
+    for conn in (borrowed, idle):
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    with database.reader() as conn:
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+
+
+def test_closing_a_workspace_closes_its_instances(monkeypatch):
+    closed = []
+    local = WorkspaceLocal(lambda workspace: workspace, close=closed.append)
+    monkeypatch.setattr(workspaces, 'max_open', 1)
+    with use_workspace('close-a'):
+        get_database()
+        local.current()
+    with use_workspace('close-b'):
+        get_database()
+    assert closed == ['close-a']
+    assert local.items() == []
+
+
+def test_evicted_duckdb_engines_are_closed(monkeypatch):
+    pytest.importorskip('duckdb')
+    monkeypatch.setattr(engines, 'QUERY_ENGINE', 'duckdb')
+    monkeypatch.setattr(workspaces, 'max_open', 1)
+    with use_workspace('columnar-a'):
+        write_table_from_chunks([pd.DataFrame({'x': [1, 2]})], 'numbers')
+        engine = get_engine()
+        assert engine.execute("SELECT SUM(x) AS s FROM numbers").frame(10)['s'].tolist() == [3]
+    with use_workspace('columnar-b'):
+        get_database()
+    assert engine._conn is None
+    with use_workspace('columnar-a'):
+        assert get_engine() is not engine
+        assert get_engine().execute("SELECT SUM(x) AS s FROM numbers").frame(10)['s'].tolist() == [3]
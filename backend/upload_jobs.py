@@ -0,0 +1,202 @@
+import os
+import copy
+import time
+import uuid
+import queue
+import shutil
+import tempfile
+import threading
+import contextvars
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from database import schema_catalog
+from db import current_workspace
+from file_readers import parse_to_queue, read_frames, set_parse_queues
+from ingest import CSV_CHUNK_SIZE, load_chunks, upload_report
+
+# Processes parsing uploaded files in parallel; parsing is CPU-bound and holds the GIL.
+# With a single worker files are parsed by the writer thread, skipping the IPC.
+# It is also how many files are parsed ahead of the one being written.
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', min(4, os.cpu_count() or 1)))
+# Parsed chunks a file may queue ahead of the writer; bounds memory per file
+UPLOAD_QUEUE_CHUNKS = 4
+# Finished jobs kept for status polling
+UPLOAD_JOB_HISTORY = 100
+POLL_SECONDS = 1.0
+
+
+class UploadJobs:
+    """Batch uploads: files are parsed in a process pool and written by one thread.
+
+    submit() saves the files to a scratch directory and returns a job id right
+    away. Each file is parsed in a worker process that streams DataFrame
+    chunks back through a bounded queue, while the single writer thread loads
+    jobs and their files one after another through the normal upload path, so
+    later files parse while earlier ones are written. Jobs are written into
+    the workspace they were submitted in. get() reports per-file progress and,
+    once finished, the combined schema. On a single-core host
+    (UPLOAD_WORKERS=1) the writer parses the files itself.
+    """
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._queues = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-writer')
+
+    def _workers(self):
+        with self._lock:
+            if self._pool is None and UPLOAD_WORKERS > 1:
+                # Forking a process that holds SQLite connections and threads is unsafe
+                context = multiprocessing.get_context('spawn')
+                # Plain queues cannot be passed to pool tasks, only inherited by the
+                # workers; a file parses into the queue of the slot it was given
+                self._queues = [context.Queue(UPLOAD_QUEUE_CHUNKS) for _ in range(UPLOAD_WORKERS)]
+                self._pool = ProcessPoolExecutor(max_workers=UPLOAD_WORKERS, mp_context=context,
+                                                 initializer=set_parse_queues, initargs=(self._queues,))
+            return self._pool, self._queues
+
+    def submit(self, files, mode='replace', key_columns=None, chunksize=None):
+        """Start a batch of (filename, table_name, file_format, file) uploads; returns the job id"""
+        chunksize = chunksize or CSV_CHUNK_SIZE
+        job_id = uuid.uuid4().hex
+        workdir = tempfile.mkdtemp(prefix='datachat-upload-')
+        job = {
+            'job_id': job_id,
+            'status': 'queued',
+            'mode': mode,
+            'workspace': current_workspace(),
+            'created_at': time.time(),
+            'finished_at': None,
+            'files': []
+        }
+        paths = []
+        for index, (filename, table_name, file_format, file) in enumerate(files):
+            path = os.path.join(workdir, f"{index}_{filename}")
+            with open(path, 'wb') as out:
+                shutil.copyfileobj(getattr(file, 'stream', file), out)
+            paths.append((path, file_format))
+            job['files'].append({
+                'file': filename,
+                'table': table_name,
+                'format': file_format,
+                'status': 'queued',
+                'bytes': os.path.getsize(path),
+                'rows_written': 0
+            })
+
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > UPLOAD_JOB_HISTORY:
+                self._jobs.popitem(last=False)
+        self._writer.submit(contextvars.copy_context().run, self._run, job, paths, chunksize, workdir, mode, key_columns)
+        print(f"Upload job {job_id}: {len(paths)} files queued")
+        return job_id
+
+    def _update(self, entry, **fields):
+        with self._lock:
+            entry.update(fields)
+
+    def _run(self, job, paths, chunksize, workdir, mode, key_columns):
+        start = time.perf_counter()
+        self._update(job, status='running')
+        try:
+            for entry, frames in zip(job['files'], self._parsed(paths, chunksize)):
+                self._write_file(entry, frames, mode, key_columns)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        rows = sum(entry.get('rows', 0) for entry in job['files'])
+        failed = sum(entry['status'] == 'failed' for entry in job['files'])
+        self._update(
+            job,
+            status='failed' if failed == len(job['files']) else 'done',
+            failed_files=failed,
+            rows=rows,
+            seconds=round(elapsed, 3),
+            rows_per_sec=round(rows / elapsed, 1),
+            finished_at=time.time(),
+            schema=schema_catalog.get_schema())
+        print(f"Upload job {job['job_id']}: {rows} rows in {elapsed:.1f} s, {failed} files failed")
+
+    def _parsed(self, paths, chunksize):
+        """Yield the frames of each (path, file_format) in turn, parsing up to UPLOAD_WORKERS files ahead"""
+        pool, queues = self._workers()
+        if pool is None:
+            for path, file_format in paths:
+                yield read_frames(path, file_format, chunksize)
+            return
+        futures = {}
+
+        def start(index):
+            if index < len(paths):
+                path, file_format = paths[index]
+                futures[index] = pool.submit(parse_to_queue, path, file_format, chunksize, index % len(queues))
+
+        for index in range(len(queues)):
+            start(index)
+        for index in range(len(paths)):
+            chunks, future, finished = queues[index % len(queues)], futures.pop(index), []
+            frames = self._queued_frames(chunks, future, finished)
+            yield frames
+            frames.close()
+            if not finished:
+                # Abandoned early (e.g. the write failed): drain so the slot and worker are freed
+                self._drain(chunks, future)
+            start(index + len(queues))
+
+    def _queued_frames(self, chunks, future, finished):
+        """Yield the DataFrames a worker process puts on its queue; marks finished at the end"""
+        while True:
+            try:
+                kind, payload = chunks.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if future.done() and future.exception() is not None:
+                    finished.append(True)
+                    raise ValueError(f"Parser process failed: {future.exception()}")
+                continue
+            if kind != 'chunk':
+                finished.append(True)
+                if kind == 'error':
+                    raise ValueError(payload)
+                return
+            yield payload
+
+    def _drain(self, chunks, future):
+        while not future.done() or not chunks.empty():
+            try:
+                if chunks.get(timeout=POLL_SECONDS)[0] != 'chunk':
+                    return
+            except queue.Empty:
+                pass
+
+    def _write_file(self, entry, frames, mode, key_columns):
+        """Load one file's parsed chunks; a failure is recorded and the batch moves on"""
+        def counted():
+            for frame in frames:
+                yield frame
+                self._update(entry, rows_written=entry['rows_written'] + len(frame))
+
+        start = time.perf_counter()
+        self._update(entry, status='writing')
+        try:
+            write = load_chunks(entry['table'], counted(), mode, key_columns, entry['format'])
+            self._update(entry, status='done', **upload_report(write, entry['bytes'], time.perf_counter() - start))
+        except Exception as e:
+            print(f"Upload of {entry['file']} failed: {str(e)}")
+            self._update(entry, status='failed', error=str(e))
+        finally:
+            frames.close()
+
+    def get(self, job_id):
+        """A snapshot of the job's progress, or None for a job unknown in this workspace"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['workspace'] != current_workspace():
+                return None
+            return copy.deepcopy(job)
+
+
+upload_jobs = UploadJobs()
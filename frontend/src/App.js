@@ -20,9 +20,14 @@ function App() {
     formData.append('file', file);
     
     try {
+      const extension = file.name.split('.').pop().toLowerCase();
       let endpoint = type === 'remove' 
         ? `${API_BASE_URL}/remove/${encodeURIComponent(file.name)}`
-        : `${API_BASE_URL}/upload/csv`;
+        : extension === 'csv'
+          ? `${API_BASE_URL}/upload/csv`
+          : ['xlsx', 'xlsm'].includes(extension)
+            ? `${API_BASE_URL}/upload/excel`
+            : `${API_BASE_URL}/upload/columnar`;
 
       const response = await axios.post(endpoint, formData, {
         headers: {
@@ -42,7 +47,8 @@ function App() {
         }));
       } else {
         setUploadedData(prev => ({
-          tables: [...prev.tables, file.name],
+          // A workbook becomes one table per sheet
+          tables: [...prev.tables, ...(response.data.tables || [file.name])],
           schema: response.data.schema
         }));
         setShowUpload(false);
@@ -54,6 +60,44 @@ function App() {
     }
   };
 
+  // Several files go up as one batch job that parses them in parallel on the server
+  const handleFilesUpload = async (files, onProgress) => {
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+
+    try {
+      const response = await axios.post(`${API_BASE_URL}/upload/batch`, formData, {
+        headers: {
+          'Content-Type': 'multipart/form-data',
+        }
+      });
+
+      let job = response.data;
+      while (job.status === 'queued' || job.status === 'running') {
+        onProgress?.(job);
+        await new Promise(resolve => setTimeout(resolve, 500));
+        job = (await axios.get(`${API_BASE_URL}/upload/jobs/${job.job_id}`)).data;
+      }
+      onProgress?.(job);
+
+      const uploaded = job.files.filter(f => f.status === 'done').map(f => f.file);
+      const failed = job.files.filter(f => f.status === 'failed');
+      setUploadedData(prev => ({
+        tables: [...prev.tables, ...uploaded.filter(name => !prev.tables.includes(name))],
+        schema: job.schema
+      }));
+      if (failed.length > 0) {
+        setError(failed.map(f => `${f.file}: ${f.error}`).join('; '));
+      } else {
+        setError(null);
+        setShowUpload(false);
+      }
+    } catch (error) {
+      console.error('Error uploading files:', error);
+      setError(error.response?.data?.error || 'Network error: Unable to connect to server');
+    }
+  };
+
   const handleBackToUpload = () => {
     setShowUpload(true);
   };
@@ -65,10 +109,11 @@ function App() {
   return (
     <div className="App">
       {uploadedData.tables.length === 0 ? (
-        <UploadPrompt onFileSelect={handleFileSelect} error={error} />
+        <UploadPrompt onFileSelect={handleFileSelect} onFilesUpload={handleFilesUpload} error={error} />
       ) : showUpload ? (
         <UploadPrompt 
           onFileSelect={handleFileSelect} 
+          onFilesUpload={handleFilesUpload}
           error={error}
           onBackToChat={handleBackToChat}
           uploadedData={uploadedData}
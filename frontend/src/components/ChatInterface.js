@@ -1,6 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
-import axios from 'axios';
 import ReactMarkdown from 'react-markdown';
+import { ResultTable } from './ResultDisplay';
+import { WORKSPACE_HEADERS } from '../workspace';
 
 const API_BASE_URL = 'http://127.0.0.1:5000';
 
@@ -16,6 +17,8 @@ function ChatInterface({
   const [showSuggestions, setShowSuggestions] = useState(true);
   const chatEndRef = useRef(null);
   const inputRef = useRef(null);
+  // Conversation id from the server, so follow-up questions see earlier answers
+  const sessionIdRef = useRef(null);
 
   const suggestionQuestions = [
     "What are the total sales in 2024?",
@@ -65,40 +68,103 @@ function ChatInterface({
 
     setLoading(true);
 
+    const messageId = `${Date.now()}-${Math.random()}`;
+    const updateAssistant = (update) => {
+      setMessages(prev => prev.map(message => (
+        message.id === messageId
+          ? { ...message, content: { ...message.content, ...update(message.content) } }
+          : message
+      )));
+    };
+    const showError = (error, suggestion) => {
+      setMessages(prev => [
+        ...prev.filter(message => message.id !== messageId),
+        {
+          type: 'error',
+          content: { message: error, suggestion },
+          timestamp: new Date()
+        }
+      ]);
+    };
+
+    // Events arrive as newline-delimited JSON: the SQL first, then result
+    // rows in batches, then the explanation as the model writes it
+    const handleEvent = (event) => {
+      switch (event.type) {
+        case 'sql':
+          setLoading(false);
+          setMessages(prev => [...prev, {
+            id: messageId,
+            type: 'assistant',
+            content: {
+              sql: event.sql_query,
+              explanation: '',
+              data: [],
+              streaming: true
+            },
+            timestamp: new Date()
+          }]);
+          break;
+        case 'rows':
+          updateAssistant(content => ({ data: [...content.data, ...event.rows] }));
+          break;
+        case 'explanation':
+          updateAssistant(content => ({ explanation: content.explanation + event.text }));
+          break;
+        case 'done':
+          sessionIdRef.current = event.session_id;
+          updateAssistant(() => ({
+            streaming: false,
+            rowCount: event.row_count,
+            resultId: event.result_id
+          }));
+          break;
+        case 'error':
+          showError(
+            event.detail ? `${event.error}: ${event.detail}` : event.error,
+            event.suggestion
+          );
+          break;
+        default:
+          break;
+      }
+    };
+
     try {
-      const response = await axios.post(`${API_BASE_URL}/query`, {
-        question: userMessage
+      const response = await fetch(`${API_BASE_URL}/query/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', ...WORKSPACE_HEADERS },
+        body: JSON.stringify({ question: userMessage, session_id: sessionIdRef.current })
       });
 
-      if (response.data.error) {
-        setMessages(prev => [...prev, {
-          type: 'error',
-          content: {
-            message: response.data.error,
-            suggestion: response.data.suggestion
-          },
-          timestamp: new Date()
-        }]);
-      } else {
-        setMessages(prev => [...prev, {
-          type: 'assistant',
-          content: {
-            sql: response.data.sql_query,
-            explanation: response.data.explanation,
-            data: response.data.data
-          },
-          timestamp: new Date()
-        }]);
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        showError(
+          body.error || 'Failed to process your question',
+          body.suggestion || 'Please try asking in a different way or check your question for typos.'
+        );
+        return;
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+      }
+      if (buffer.trim()) {
+        handleEvent(JSON.parse(buffer));
       }
     } catch (error) {
-      setMessages(prev => [...prev, {
-        type: 'error',
-        content: {
-          message: 'Failed to process your question',
-          suggestion: 'Please try asking in a different way or check your question for typos.'
-        },
-        timestamp: new Date()
-      }]);
+      showError(
+        'Failed to process your question',
+        'Please try asking in a different way or check your question for typos.'
+      );
     } finally {
       setLoading(false);
     }
@@ -118,38 +184,6 @@ function ChatInterface({
     return value;
   };
 
-  const renderDataTable = (data) => {
-    if (!data || data.length === 0) return null;
-    
-    const columns = Object.keys(data[0]);
-    
-    return (
-      <div className="data-table">
-        <table>
-          <thead>
-            <tr>
-              {columns.map((column) => (
-                <th key={column}>{column.replace(/_/g, ' ').toUpperCase()}</th>
-              ))}
-            </tr>
-          </thead>
-          <tbody>
-            {data.map((row, i) => (
-              <tr key={i}>
-                {columns.map((column) => (
-                  <td key={column}>{formatValue(row[column])}</td>
-                ))}
-              </tr>
-            ))}
-          </tbody>
-        </table>
-        <div className="row-count">
-          Total rows: {data.length}
-        </div>
-      </div>
-    );
-  };
-
   const renderMessage = (message) => {
     if (message.type === 'assistant') {
       return (
@@ -166,15 +200,29 @@ function ChatInterface({
             </div>
             <pre>{message.content.sql}</pre>
           </div>
-          {message.content.data && (
+          {message.content.data && message.content.data.length > 0 && (
             <div className="results">
               <h4>SQL Query Results</h4>
-              {renderDataTable(message.content.data)}
+              <ResultTable
+                rows={message.content.data}
+                rowCount={message.content.rowCount}
+                resultId={message.content.resultId}
+                formatHeader={(column) => column.replace(/_/g, ' ').toUpperCase()}
+                formatValue={formatValue}
+              />
             </div>
           )}
           <div className="explanation">
             <h4>Analysis</h4>
-            <ReactMarkdown>{message.content.explanation}</ReactMarkdown>
+            {message.content.streaming && !message.content.explanation ? (
+              <div className="typing-indicator">
+                <span></span>
+                <span></span>
+                <span></span>
+              </div>
+            ) : (
+              <ReactMarkdown>{message.content.explanation}</ReactMarkdown>
+            )}
           </div>
         </div>
       );
@@ -1,11 +1,108 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 import ReactMarkdown from 'react-markdown';
 
+const API_BASE_URL = 'http://127.0.0.1:5000';
+
+// Shows the rows sent with the answer first, then fetches further pages of
+// large results from the server instead of receiving them all up front
+export function ResultTable({ rows, rowCount, resultId, formatHeader, formatValue }) {
+  const pageSize = Math.max(rows.length, 1);
+  const totalRows = rowCount ?? rows.length;
+  const pageCount = Math.max(Math.ceil(totalRows / pageSize), 1);
+  const [page, setPage] = useState(0);
+  const [pageRows, setPageRows] = useState(rows);
+  const [loading, setLoading] = useState(false);
+  const [error, setError] = useState(null);
+
+  useEffect(() => {
+    if (page === 0 || !resultId) {
+      setPageRows(rows);
+      return;
+    }
+
+    let cancelled = false;
+    setLoading(true);
+    axios.get(`${API_BASE_URL}/query/${resultId}/rows`, {
+      params: { offset: page * pageSize, limit: pageSize }
+    })
+      .then(response => {
+        if (!cancelled) {
+          setPageRows(response.data.data);
+          setError(null);
+        }
+      })
+      .catch(err => {
+        if (!cancelled) {
+          setError(err.response?.data?.error || 'Unable to load more rows');
+        }
+      })
+      .finally(() => {
+        if (!cancelled) setLoading(false);
+      });
+    return () => { cancelled = true; };
+  }, [page, pageSize, resultId, rows]);
+
+  if (!rows || rows.length === 0) return null;
+
+  const columns = Object.keys(rows[0]);
+  const showHeader = formatHeader || (column => column);
+  const showValue = formatValue || (value => value);
+  const firstRow = page * pageSize + 1;
+  const lastRow = Math.min((page + 1) * pageSize, totalRows);
+
+  return (
+    <div className="data-table">
+      <table>
+        <thead>
+          <tr>
+            {columns.map((column) => (
+              <th key={column}>{showHeader(column)}</th>
+            ))}
+          </tr>
+        </thead>
+        <tbody>
+          {pageRows.map((row, i) => (
+            <tr key={i}>
+              {columns.map((column) => (
+                <td key={column}>{showValue(row[column])}</td>
+              ))}
+            </tr>
+          ))}
+        </tbody>
+      </table>
+      <div className="row-count">
+        {pageCount > 1
+          ? `Rows ${firstRow}–${lastRow} of ${totalRows}`
+          : `Total rows: ${totalRows}`}
+      </div>
+      {pageCount > 1 && resultId && (
+        <div className="pagination">
+          <button
+            onClick={() => setPage(p => p - 1)}
+            disabled={page === 0 || loading}
+          >
+            Previous
+          </button>
+          <span>Page {page + 1} of {pageCount}</span>
+          <button
+            onClick={() => setPage(p => p + 1)}
+            disabled={page >= pageCount - 1 || loading}
+          >
+            Next
+          </button>
+        </div>
+      )}
+      {error && <p className="error">{error}</p>}
+    </div>
+  );
+}
+
 function ResultDisplay({ result }) {
   return (
     <div className="result-display">
       <h2>Analysis Results</h2>
-      
+
       {/* Show the SQL query that Gemini generated */}
       {result.sql_query && (
         <div className="sql-query">
@@ -13,7 +110,7 @@ function ResultDisplay({ result }) {
           <pre>{result.sql_query}</pre>
         </div>
       )}
-      
+
       {/* Show Gemini's explanation of the results using ReactMarkdown */}
       {result.explanation && (
         <div className="explanation">
@@ -21,39 +118,26 @@ function ResultDisplay({ result }) {
           <ReactMarkdown>{result.explanation}</ReactMarkdown>
         </div>
       )}
-      
-      {/* Show the actual data in a table */}
+
+      {/* Show the actual data in a table, one page at a time */}
       {result.data && (
         <div className="data">
           <h3>Data Results:</h3>
-          <div className="data-table">
-            {result.data.length > 0 ? (
-              <table>
-                <thead>
-                  <tr>
-                    {Object.keys(result.data[0]).map((header) => (
-                      <th key={header}>{header}</th>
-                    ))}
-                  </tr>
-                </thead>
-                <tbody>
-                  {result.data.map((row, index) => (
-                    <tr key={index}>
-                      {Object.values(row).map((value, i) => (
-                        <td key={i}>{value}</td>
-                      ))}
-                    </tr>
-                  ))}
-                </tbody>
-              </table>
-            ) : (
+          {result.data.length > 0 ? (
+            <ResultTable
+              rows={result.data}
+              rowCount={result.row_count}
+              resultId={result.result_id}
+            />
+          ) : (
+            <div className="data-table">
               <p>No matching data found</p>
-            )}
-          </div>
+            </div>
+          )}
         </div>
       )}
     </div>
   );
 }
 
-export default ResultDisplay; 
\ No newline at end of file
+export default ResultDisplay;
@@ -1,10 +1,11 @@
 import React, { useState, useEffect } from 'react';
 
-function UploadPrompt({ onFileSelect, error: parentError, onBackToChat, uploadedData }) {
+function UploadPrompt({ onFileSelect, onFilesUpload, error: parentError, onBackToChat, uploadedData }) {
   const [dragActive, setDragActive] = useState(false);
   const [error, setError] = useState(null);
   const [selectedFiles, setSelectedFiles] = useState([]);
   const [uploading, setUploading] = useState(false);
+  const [progress, setProgress] = useState(null);
 
   // Reset selected files state when component mounts
   useEffect(() => {
@@ -33,11 +34,11 @@ function UploadPrompt({ onFileSelect, error: parentError, onBackToChat, uploaded
     
     const validFiles = files.filter(file => {
       const fileType = file.name.split('.').pop().toLowerCase();
-      return ['csv'].includes(fileType);
+      return ['csv', 'xlsx', 'xlsm', 'parquet', 'arrow', 'feather'].includes(fileType);
     });
 
     if (validFiles.length !== files.length) {
-      setError('Some files were skipped. Only CSV files are supported.');
+      setError('Some files were skipped. Only CSV, Excel, Parquet and Arrow files are supported.');
     }
 
     const newFiles = [...selectedFiles];
@@ -60,7 +61,21 @@ function UploadPrompt({ onFileSelect, error: parentError, onBackToChat, uploaded
     setError(null);
 
     try {
-      for (const file of selectedFiles) {
+      // Excel workbooks have their own endpoint and are uploaded one at a time
+      const isExcel = file => ['xlsx', 'xlsm'].includes(file.name.split('.').pop().toLowerCase());
+      const workbooks = selectedFiles.filter(isExcel);
+      const dataFiles = selectedFiles.filter(file => !isExcel(file));
+      if (dataFiles.length > 1 && onFilesUpload) {
+        await onFilesUpload(dataFiles, job => {
+          const finished = job.files.filter(f => f.status === 'done' || f.status === 'failed').length;
+          setProgress(`${finished}/${job.files.length} files`);
+        });
+      } else {
+        for (const file of dataFiles) {
+          await onFileSelect(file, 'upload');
+        }
+      }
+      for (const file of workbooks) {
         await onFileSelect(file, 'upload');
       }
       setSelectedFiles([]);
@@ -68,6 +83,7 @@ function UploadPrompt({ onFileSelect, error: parentError, onBackToChat, uploaded
       setError('Upload failed: ' + error.message);
     } finally {
       setUploading(false);
+      setProgress(null);
     }
   };
 
@@ -129,14 +145,14 @@ function UploadPrompt({ onFileSelect, error: parentError, onBackToChat, uploaded
             type="file"
             id="file-input"
             multiple
-            accept=".csv"
+            accept=".csv,.xlsx,.xlsm,.parquet,.arrow,.feather"
             onChange={(e) => handleFiles(Array.from(e.target.files))}
             style={{ display: 'none' }}
           />
           <label htmlFor="file-input">
             <div className="option-icon">📁</div>
-            <div>Drop CSV files here or click to select</div>
-            <span>Supported format: CSV</span>
+            <div>Drop data files here or click to select</div>
+            <span>Supported formats: CSV, Excel, Parquet, Arrow</span>
           </label>
         </div>
 
@@ -155,7 +171,7 @@ function UploadPrompt({ onFileSelect, error: parentError, onBackToChat, uploaded
               onClick={handleUpload}
               disabled={uploading}
             >
-              {uploading ? 'Uploading...' : 'Upload Files'}
+              {uploading ? `Uploading${progress ? ` ${progress}` : ''}...` : 'Upload Files'}
             </button>
           </div>
         )}
@@ -0,0 +1,20 @@
+import axios from 'axios';
+
+// Each browser works in its own workspace on the server, so its uploads and
+// questions never touch another user's tables. Kept across page reloads.
+const STORAGE_KEY = 'datachat-workspace';
+
+function loadWorkspaceId() {
+  let id = window.localStorage.getItem(STORAGE_KEY);
+  if (!id) {
+    id = 'ws-' + Math.random().toString(36).slice(2, 12) + Date.now().toString(36);
+    window.localStorage.setItem(STORAGE_KEY, id);
+  }
+  return id;
+}
+
+export const WORKSPACE_ID = loadWorkspaceId();
+export const WORKSPACE_HEADERS = { 'X-Workspace': WORKSPACE_ID };
+
+// Every axios request (uploads, job polling, result pages) carries the workspace
+axios.defaults.headers.common['X-Workspace'] = WORKSPACE_ID;